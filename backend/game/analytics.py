@@ -0,0 +1,155 @@
+"""Incrementally maintained admin analytics (GET /api/admin/analytics/).
+
+The write paths that create, change or delete rooms add their counter deltas
+to two AnalyticsRollup rows per metric: the hour bucket the event happened in
+and the all-time totals (bucket == TOTAL_BUCKET). record() does that with a
+single INSERT ... ON CONFLICT DO UPDATE statement, inside the caller's
+transaction where it has one, so the rollups never need a full scan.
+
+Metrics:
+
+- counters: rooms_created, rooms_deleted, players_joined, games_started,
+  games_finished, game_seconds (summed play time of finished games) and
+  guesses_to_win (summed guesses of finished games);
+- gauges, meaningful in the totals: ``rooms:<status>`` (rooms currently in
+  each status) and players (Player rows).
+
+summary() answers from the totals plus the hour buckets of the requested
+range, i.e. in time proportional to the range, not to the number of games.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from .models import AnalyticsRollup, GameRoom
+
+TOTAL_BUCKET = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+DEFAULT_RANGE = timedelta(hours=24)
+MAX_RANGE = timedelta(days=90)
+
+
+def hour_of(at):
+    return at.replace(minute=0, second=0, microsecond=0)
+
+
+def status_change(old, new, deltas=None):
+    """Counter deltas for a room moving from status `old` to `new` (either may be None)."""
+    deltas = {} if deltas is None else deltas
+    if old:
+        deltas[f'rooms:{old}'] = deltas.get(f'rooms:{old}', 0) - 1
+    if new:
+        deltas[f'rooms:{new}'] = deltas.get(f'rooms:{new}', 0) + 1
+    if new == GameRoom.PLAYING:
+        deltas['games_started'] = deltas.get('games_started', 0) + 1
+    return deltas
+
+
+def game_finished(room, guesses, at):
+    """Deltas for a playing `room` won after `guesses` guesses at `at`."""
+    deltas = status_change(GameRoom.PLAYING, GameRoom.FINISHED)
+    deltas['games_finished'] = 1
+    deltas['guesses_to_win'] = guesses
+    if room.started_at:
+        deltas['game_seconds'] = max(int((at - room.started_at).total_seconds()), 0)
+    return deltas
+
+
+def room_created(status, players=0):
+    deltas = status_change(None, status)
+    deltas['rooms_created'] = 1
+    if players:
+        deltas['players_joined'] = deltas['players'] = players
+    return deltas
+
+
+def room_deleted(status, players):
+    deltas = status_change(status, None)
+    deltas['rooms_deleted'] = 1
+    if players:
+        deltas['players'] = -players
+    return deltas
+
+
+def record(deltas, at=None):
+    """Add `deltas` (metric -> amount) to the hour bucket of `at` (default now) and the totals."""
+    at = at or timezone.now()
+    rows = sorted(
+        (bucket, metric, amount)
+        for bucket in (hour_of(at), TOTAL_BUCKET)
+        for metric, amount in deltas.items() if amount
+    )
+    if not rows:
+        return
+    # Sorted rows lock in the same order in every transaction (no upsert deadlocks)
+    ops = connection.ops
+    table = ops.quote_name(AnalyticsRollup._meta.db_table)
+    values = ', '.join(['(%s, %s, %s)'] * len(rows))
+    params = [p for bucket, metric, amount in rows for p in (ops.adapt_datetimefield_value(bucket), metric, amount)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (bucket, metric, value) VALUES {values} '
+            f'ON CONFLICT (bucket, metric) DO UPDATE SET value = {table}.value + EXCLUDED.value',
+            params,
+        )
+
+
+def _averages(values):
+    finished = values.get('games_finished', 0)
+    return {
+        'average_game_seconds': round(values.get('game_seconds', 0) / finished, 1) if finished else 0,
+        'average_guesses_to_win': round(values.get('guesses_to_win', 0) / finished, 2) if finished else 0,
+    }
+
+
+def summary(since=None, until=None):
+    """All-time totals plus per-range sums and games per hour; one query.
+
+    The range defaults to the DEFAULT_RANGE up to now and is capped at MAX_RANGE.
+    """
+    until = until or timezone.now()
+    since = since or until - DEFAULT_RANGE
+    since = max(since, until - MAX_RANGE)
+    rows = AnalyticsRollup.objects.filter(
+        Q(bucket=TOTAL_BUCKET) | Q(bucket__gte=hour_of(since), bucket__lt=until)
+    ).values_list('bucket', 'metric', 'value')
+    totals = {}
+    in_range = defaultdict(int)
+    per_hour = defaultdict(int)
+    for bucket, metric, value in rows:
+        if bucket == TOTAL_BUCKET:
+            totals[metric] = value
+        else:
+            in_range[metric] += value
+            if metric == 'games_finished':
+                per_hour[bucket] += value
+
+    by_status = {
+        metric.split(':', 1)[1]: value
+        for metric, value in totals.items() if metric.startswith('rooms:') and value
+    }
+    total_rooms = sum(by_status.values())
+    total_players = totals.get('players', 0)
+    return {
+        'total_rooms': total_rooms,
+        'status_breakdown': by_status,
+        'total_players': total_players,
+        'average_players_per_room': round(total_players / total_rooms, 2) if total_rooms else 0,
+        'finished_rooms': by_status.get(GameRoom.FINISHED, 0),
+        'rooms_created': totals.get('rooms_created', 0),
+        'games_started': totals.get('games_started', 0),
+        'games_finished': totals.get('games_finished', 0),
+        **_averages(totals),
+        'range': {
+            'since': since.isoformat(),
+            'until': until.isoformat(),
+            'rooms_created': in_range['rooms_created'],
+            'players_joined': in_range['players_joined'],
+            'games_started': in_range['games_started'],
+            'games_finished': in_range['games_finished'],
+            **_averages(in_range),
+            'games_per_hour': [
+                {'hour': bucket.isoformat(), 'games': games} for bucket, games in sorted(per_hour.items())
+            ],
+        },
+    }
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class GameConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'game'
+
+    def ready(self):
+        from celery.signals import task_prerun
+        from django.contrib.auth.models import User
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete
+        from . import guests, metrics
+        metrics.register_stats()
+        connection_created.connect(metrics.install_query_counter)
+        post_delete.connect(guests.on_user_deleted, sender=User)
+        task_prerun.connect(metrics.record_task_lag)
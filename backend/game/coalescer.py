@@ -0,0 +1,120 @@
+"""Outbound frame coalescing for game sockets.
+
+A single client message can trigger several frames back to back (a
+game_message followed by a room_state_update, a burst of team strategy
+updates, ...). Each socket queues its outbound frames for a short window
+(WS_COALESCE_WINDOW_MS, a few ms by default) and then flushes them as one
+websocket frame:
+
+- a single pending frame is sent unchanged;
+- several pending frames are sent as ``{'type': 'batch', 'frames': [...]}``
+  in the order they were queued.
+
+Frames pushed with a key (full room state, a team's strategy) are snapshots
+that make any earlier pending frame with the same key obsolete. Frames may
+also carry the room version (``seq``) they bring the client to. A keyed
+snapshot with a seq also drops the pending unkeyed frames it covers (room
+deltas up to its version), then is queued after everything else that is left
+except newer deltas, which still follow it. So nothing a snapshot already
+reflects is sent after it, and other unkeyed frames (messages, newer deltas)
+are never dropped or reordered. A window of 0 disables coalescing.
+
+Frames are encoded with the socket's wire codec (see wire.py) when they are
+sent, so superseded frames are never encoded; frames pushed with a ``shared``
+key are encoded once per format and process for all sockets, and
+wire.Encoded frames (encoded by the sender of a group message) are sent as
+they are.
+"""
+import asyncio
+from django.conf import settings
+from . import wire
+
+COALESCE_WINDOW = getattr(settings, 'WS_COALESCE_WINDOW_MS', 5) / 1000
+
+# Process-wide counters. frames_saved counts the sends coalescing avoided:
+# superseded frames plus the frames that went out inside a batch.
+stats = {
+    'frames_queued': 0,
+    'frames_sent': 0,
+    'frames_superseded': 0,
+    'frames_saved': 0,
+    'batches_sent': 0,
+}
+
+
+class FrameCoalescer:
+    """Per-socket outbound queue, flushed once per coalescing window."""
+
+    def __init__(self, send, codec=wire.JSON, window=COALESCE_WINDOW):
+        self.send = send
+        self.codec = codec
+        self.window = window
+        self.pending = []  # [(key, frame, shared, seq)]
+        self.flush_task = None
+
+    async def push(self, frame, key=None, shared=None, seq=None):
+        stats['frames_queued'] += 1
+        if self.window <= 0:
+            await self._send([(frame, shared)])
+            return
+        entry = (key, frame, shared, seq)
+        if key is None:
+            self.pending.append(entry)
+        else:
+            self._supersede(entry)
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+    def _supersede(self, entry):
+        """Queue a keyed snapshot, dropping the pending frames it makes obsolete."""
+        key, _, _, seq = entry
+
+        def covered(pending_key, pending_seq):
+            if pending_key is not None:
+                return pending_key == key
+            return seq is not None and pending_seq is not None and pending_seq <= seq
+
+        kept = [pending for pending in self.pending if not covered(pending[0], pending[3])]
+        stats['frames_superseded'] += len(self.pending) - len(kept)
+        stats['frames_saved'] += len(self.pending) - len(kept)
+        # Ahead of the first newer delta, if any
+        at = next((
+            i for i, pending in enumerate(kept)
+            if seq is not None and pending[0] is None and pending[3] is not None and pending[3] > seq
+        ), len(kept))
+        kept.insert(at, entry)
+        self.pending = kept
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        frames, self.pending = [(frame, shared) for _, frame, shared, _ in self.pending], []
+        if frames:
+            await self._send(frames)
+
+    def _encode(self, frame, shared):
+        if isinstance(frame, wire.Encoded):
+            return frame.frames[self.codec.name]
+        if shared is None:
+            return self.codec.encode(frame)
+        return wire.encode_shared(self.codec, shared, frame)
+
+    async def _send(self, frames):
+        encoded = [self._encode(frame, shared) for frame, shared in frames]
+        if len(encoded) == 1:
+            await self.send(encoded[0])
+        else:
+            await self.send(self.codec.batch(encoded))
+            stats['batches_sent'] += 1
+        stats['frames_sent'] += 1
+        stats['frames_saved'] += len(encoded) - 1
+
+    def close(self):
+        """Drop pending frames (socket is gone)."""
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        self.pending = []
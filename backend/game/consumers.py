@@ -1,159 +1,358 @@
+import functools
 import json
+import time
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Subquery
 from django.utils import timezone
+from . import analytics, lobby, metrics, spectators, strategy, wire
+from .coalescer import FrameCoalescer
+from .engine import ACTOR_MESSAGES, actor_mode_enabled, get_actor
 from .models import GameRoom, Player, Guess, TeamStrategy
-from .tasks import check_turn_timeout
+from .room_state import (
+    bump_room_version, delta_sends, get_room_snapshot, personalize, revealed_secrets, room_event, room_state_sends,
+    serialize_guess, team_group, turn_changed_event,
+)
+from .timers import get_turn_timers, schedule_turn_timeout
 import asyncio
 
 
+# Client message types; anything else is counted as 'other' in metrics
+MESSAGE_TYPES = (
+    'set_secret_number', 'make_guess', 'get_room_state', 'resync', 'get_team_strategy',
+    'update_team_strategy', 'patch_team_strategy', 'change_team', 'start_game',
+)
+
+
+def db_hop(func):
+    """database_sync_to_async for consumer methods, counting each thread-pool hop in ``self.hops``."""
+    run = database_sync_to_async(func)
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        self.hops += 1
+        return await run(self, *args, **kwargs)
+    return wrapper
+
+
 class GameConsumer(AsyncWebsocketConsumer):
+    """Game room socket.
+
+    Two protocol modes, chosen with the ``protocol`` query parameter:
+
+    - full (default): every change is followed by a complete ``room_state_update``.
+    - delta (``?protocol=delta``): every change is sent as a small
+      ``{'type': 'room_delta', 'seq', 'event', 'data'}`` frame, where ``event`` is
+      one of guess_added, turn_changed, team_changed, secret_set or status_changed
+      and ``seq`` increases by one per change in the room. A full
+      ``room_state_update`` (whose ``data.version`` is its seq) is only sent on
+      connect, on ``{'type': 'resync'}`` and for changes that have no delta event.
+
+    Room state broadcasts carry the cached snapshot to the group once, without
+    secrets, and to each team's group with that team's secrets
+    (room_state.room_state_sends()); each socket personalizes it in memory
+    before sending and drops the room group copy when its team had one.
+    Frames identical for every recipient arrive encoded by the sender already
+    (wire.prepare()) and are forwarded as they are.
+
+    Each socket is also in its team's group (room_state.team_group()), which
+    it switches whenever its player changes team. Team-private traffic (team
+    strategy updates and patches, the secret of a secret_set delta) is sent to
+    that group only, so the other team neither receives nor decodes it.
+
+    Clients that see a seq gap should send ``resync``.
+
+    Frames are JSON text unless the client negotiated the compact MessagePack
+    format through the ``numdle.compact.v1`` subprotocol (see wire.py).
+
+    Outbound frames go through a FrameCoalescer, so frames produced within a few
+    milliseconds of each other reach the client as one ``batch`` frame.
+
+    With GAME_ENGINE = 'actor' game actions are applied by the room's in-memory
+    RoomActor (see engine.py) instead of the sync DB helpers below.
+
+    Each client message is handled by one synchronous unit of work (one
+    database_sync_to_async hop through the thread pool) that applies the
+    change and also gathers what has to be sent afterwards: the room snapshot
+    and this user's team strategy (see _room_state_bundle). Hops per message
+    are exported as numdle_ws_message_db_hops.
+
+    Team strategy edits arrive as small ``patch_team_strategy`` ops that are
+    merged and written behind per room (see strategy.py); the handler itself
+    does no database work.
+    """
+
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'game_{self.room_id}'
         self.user = self.scope['user']
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.delta_mode = query.get('protocol', [''])[0] == 'delta'
+        # Highest room seq this socket has been sent (delta mode only)
+        self.delta_seq = 0
+        # Version of the last room state this socket got through its team's group
+        self.team_state_version = 0
+        self.team = None
+        # Delta events produced by the sync DB helpers, published after each message
+        self.pending_events = []
+        self.codec, self.subprotocol = wire.negotiate(self.scope.get('subprotocols'))
+        self.outbound = FrameCoalescer(self.send_encoded, self.codec)
+        self.actor = None
+        self.accepted = False
+        # database_sync_to_async hops of the message being handled (see db_hop)
+        self.hops = 0
         # Reject immediately if not authenticated (prevents AnonymousUser FK lookups)
         if not getattr(self.user, 'is_authenticated', False):
             await self.close()
             return
 
         # Ensure the user is already a player (joining happens via REST). If not, close.
-        player, room = await self.add_player_to_room()
+        # Outside actor mode this also backfills missing teams (legacy rooms).
+        player = await self.add_player_to_room(backfill_teams=not actor_mode_enabled())
         if player is None:
             await self.close()
             return
 
+        self.player_id = player.id
         # Only join group & accept after validation succeeds
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
-        # Backfill team if missing
-        if not player.team:
-            await self.ensure_player_team(player.id)
-        # Ensure all players have a team (legacy rooms)
-        await self.ensure_room_teams()
-        
+        await self.join_team(player.team)
+        await self.accept(self.subprotocol)
+        self.accepted = True
+        metrics.ws_active_sockets.inc()
+        if actor_mode_enabled():
+            # The actor backfills missing teams itself
+            self.actor = await get_actor(self.room_id)
+            await self.actor.attach(self.user.id)
+        elif getattr(settings, 'TURN_TIMERS', 'wheel') == 'wheel':
+            # Bind this process's turn timers to the event loop
+            get_turn_timers()
+
         # Send room state
         await self.send_room_state()
 
     async def disconnect(self, close_code):
+        self.outbound.close()
+        if self.accepted:
+            metrics.ws_active_sockets.dec()
+        if self.actor is not None:
+            await self.actor.detach()
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        await self.join_team(None)
 
-    async def receive(self, text_data):
+    async def join_team(self, team):
+        """Move this socket to `team`'s group (None leaves it)."""
+        if team == self.team:
+            return
+        if self.team:
+            await self.channel_layer.group_discard(team_group(self.room_id, self.team), self.channel_name)
+        self.team = team
+        if team:
+            await self.channel_layer.group_add(team_group(self.room_id, team), self.channel_name)
+
+    async def send_encoded(self, data):
+        if self.codec.binary:
+            await self.send(bytes_data=data)
+        else:
+            await self.send(text_data=data)
+
+    async def send_frame(self, frame, key=None, shared=None, seq=None):
+        """Queue a frame for this socket; see coalescer.FrameCoalescer for key, shared and seq semantics."""
+        await self.outbound.push(frame, key=key, shared=shared, seq=seq)
+
+    async def forward(self, event, key=None, seq=None):
+        """Queue a group message's client frame as its sender encoded it (built here if it was sent without)."""
+        frames = event.get('frames')
+        await self.outbound.push(wire.Encoded(frames) if frames else wire.client_frame(event), key=key, seq=seq)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if text_data is None:
+            # Clients send JSON text whatever wire format they negotiated
+            await self.send_frame({
+                'type': 'game_message',
+                'message': 'Binary messages are not supported; send JSON text'
+            })
+            return
         data = json.loads(text_data)
         message_type = data['type']
-        
-        if message_type == 'set_secret_number':
-            success, _ = await self.set_secret_number(data['number'])
+
+        start = time.perf_counter()
+        self.hops = 0
+        failed = True
+        try:
+            await self.dispatch_message(message_type, data)
+            failed = False
+        finally:
+            await self.publish_room_events()
+            metrics.observe_ws_message(
+                message_type if message_type in MESSAGE_TYPES else 'other', time.perf_counter() - start, failed,
+                hops=self.hops,
+            )
+
+    async def dispatch_message(self, message_type, data):
+        if self.actor is not None and message_type in ACTOR_MESSAGES:
+            await self.dispatch_to_actor(message_type, data)
+        elif message_type == 'set_secret_number':
+            success, _, bundle = await self.set_secret_number(data['number'])
             # Broadcast updated state so clients reflect changes immediately
             if success:
-                await self.send_room_state()
+                await self.send_room_state(bundle)
         elif message_type == 'make_guess':
             target_id = data.get('target_player_id')
-            success, err_or_payload = await self.make_guess(data['guess'], target_id)
+            success, err_or_payload, bundle = await self.make_guess(data['guess'], target_id)
             # Broadcast updated state so clients reflect changes immediately
             if success:
-                await self.send_room_state()
+                await self.send_room_state(bundle)
             else:
                 # Notify client of error
-                await self.send(text_data=json.dumps({
+                await self.send_frame({
                     'type': 'game_message',
                     'message': err_or_payload if isinstance(err_or_payload, str) else 'Failed to make guess'
-                }))
+                })
         elif message_type == 'get_room_state':
             await self.send_room_state()
+        elif message_type == 'resync':
+            await self.send_personal_state()
         elif message_type == 'get_team_strategy':
             await self.send_team_strategy()
         elif message_type == 'update_team_strategy':
             await self.update_team_strategy(data)
+        elif message_type == 'patch_team_strategy':
+            self.patch_team_strategy(data)
         elif message_type == 'change_team':
+            # Broadcasts the updated state so everyone sees the new teams
             await self.change_team(data.get('team'))
-            # After team change broadcast updated state so everyone sees new teams
-            await self.send_room_state()
         elif message_type == 'start_game':
             await self.start_game()
+
+    async def dispatch_to_actor(self, message_type, data):
+        """Apply a game action through the room actor; replies mirror the DB path."""
+        actor = self.actor
+        if message_type == 'set_secret_number':
+            ok, message, events = actor.set_secret_number(self.user.id, data['number'])
+        elif message_type == 'make_guess':
+            ok, message, events = actor.make_guess(self.user.id, data['guess'], data.get('target_player_id'))
+        elif message_type == 'change_team':
+            ok, message, events = actor.change_team(self.user.id, data.get('team'))
+        else:
+            ok, message, events = actor.start_game(self.user.id)
+        self.pending_events.extend(events)
+        if ok and message_type == 'change_team':
+            await self.join_team(data.get('team'))
+
+        if message_type in ('change_team', 'start_game') or (message_type == 'make_guess' and not ok):
+            await self.send_frame({
+                'type': 'game_message',
+                'message': message
+            })
+        if ok and message_type == 'start_game':
+            await metrics.group_send(
+                self.channel_layer,
+                self.room_group_name,
+                {
+                    'type': 'game_message',
+                    'message': 'Game starting. Teams set your secrets!'
+                }
+            )
+        if ok or message_type in ('change_team', 'start_game'):
             await self.send_room_state()
 
-    @database_sync_to_async
-    def add_player_to_room(self):
-        # Guard against AnonymousUser making a DB lookup with invalid FK value
-        if not getattr(self, 'user', None) or not getattr(self.user, 'is_authenticated', False):
-            return None, None
-        try:
-            room = GameRoom.objects.get(id=self.room_id)
-            try:
-                player = Player.objects.get(user=self.user, room=room)
-            except Player.DoesNotExist:
-                # Do not auto-create here; require REST join first
-                return None, room
-            return player, room
-        except GameRoom.DoesNotExist:
-            return None, None
+    async def current_snapshot(self):
+        """The room snapshot: from the actor in actor mode, else from the shared cache."""
+        if self.actor is not None:
+            return self.actor.snapshot()
+        return await self._cached_snapshot()
+
+    @db_hop
+    def _cached_snapshot(self):
+        return get_room_snapshot(self.room_id)
+
+    def _room_state_bundle(self):
+        """(snapshot, team strategy payload) for send_room_state, gathered inside a unit of work (sync)."""
+        snapshot = get_room_snapshot(self.room_id)
+        if not snapshot or not getattr(self.user, 'id', None):
+            return snapshot, None
+        # The snapshot already names this user's team and the room's players
+        own = next((p for p in snapshot['private']['players'] if p['user_id'] == self.user.id), None)
+        if own is None:
+            return snapshot, None
+        names = {
+            secret['user_id']: player['username']
+            for secret, player in zip(snapshot['private']['players'], snapshot['state']['players'])
+        }
+        return snapshot, self._serialize_team_strategy(self._strategy_for_user(own['team'] or 'A'), names)
 
-    @database_sync_to_async
-    def ensure_player_team(self, player_id):
-        try:
-            player = Player.objects.get(id=player_id)
-            if not player.team:
-                room = player.room
-                a_count = room.players.filter(team='A').count()
-                b_count = room.players.filter(team='B').count()
-                player.team = 'A' if a_count <= b_count else 'B'
-                player.save()
-            return True
-        except Player.DoesNotExist:
-            return False
+    @db_hop
+    def _room_state_bundle_hop(self):
+        return self._room_state_bundle()
 
-    @database_sync_to_async
-    def ensure_room_teams(self):
-        try:
-            room = GameRoom.objects.get(id=self.room_id)
-            players = list(room.players.order_by('joined_at'))
-            
-            # Count teams and collect players needing assignment in one pass
-            a_count = 0
-            b_count = 0
-            unassigned_players = []
-            
-            for p in players:
-                if p.team == 'A':
+    @db_hop
+    def _actor_strategy_hop(self, team):
+        return self._serialized_strategy_for_user(team)
+
+    @db_hop
+    def add_player_to_room(self, backfill_teams=True):
+        """This user's Player in the room (None if not joined), with missing teams backfilled."""
+        # Guard against AnonymousUser making a DB lookup with invalid FK value
+        if not getattr(self, 'user', None) or not getattr(self.user, 'is_authenticated', False):
+            return None
+        players = list(Player.objects.filter(room_id=self.room_id).order_by('joined_at'))
+        player = next((p for p in players if p.user_id == self.user.id), None)
+        # Do not auto-create here; require REST join first
+        if player is None or not backfill_teams:
+            return player
+
+        # Ensure all players have a team (legacy rooms): this one first, then in join order
+        a_count = sum(1 for p in players if p.team == 'A')
+        b_count = sum(1 for p in players if p.team == 'B')
+        updates = []
+        for p in sorted(players, key=lambda p: p.id != player.id):
+            if not p.team:
+                if a_count <= b_count:
+                    p.team = 'A'
                     a_count += 1
-                elif p.team == 'B':
-                    b_count += 1
                 else:
-                    unassigned_players.append(p)
-            
-            # Bulk update unassigned players
-            if unassigned_players:
-                updates = []
-                for p in unassigned_players:
-                    if a_count <= b_count:
-                        p.team = 'A'
-                        a_count += 1
-                    else:
-                        p.team = 'B'
-                        b_count += 1
-                    updates.append(p)
-                
-                # Bulk update all at once
-                if updates:
-                    Player.objects.bulk_update(updates, ['team'])
-            
-            return True
-        except GameRoom.DoesNotExist:
-            return False
+                    p.team = 'B'
+                    b_count += 1
+                updates.append(p)
+        if updates:
+            Player.objects.bulk_update(updates, ['team'])
+            bump_room_version(self.room_id)
+        return player
 
-    @database_sync_to_async
+    @db_hop
     def set_secret_number(self, number):
-        try:
-            player = Player.objects.get(user=self.user, room_id=self.room_id)
+        """Unit of work for set_secret_number: (ok, message, room state bundle or None)."""
+        ok, message = self._set_secret_number(number)
+        return ok, message, self._room_state_bundle() if ok else None
+
+    def _set_secret_number(self, number):
+        """Set this user's team secret in one transaction (3 queries, 4 when it starts the game).
+
+        The room row is locked while the secret is checked and saved, so two
+        teams setting theirs at once are applied one after the other: the
+        second sees the first's secret and starts the game.
+        """
+        with transaction.atomic():
+            # The room's players and their (locked) room in one query
+            players = list(
+                Player.objects.filter(room_id=self.room_id).select_related('room')
+                .select_for_update(of=('room',)).order_by('joined_at')
+            )
+            player = next((p for p in players if p.user_id == self.user.id), None)
+            if player is None:
+                return False, "Player not found"
             if not player.validate_secret_number(number):
                 return False, "Invalid secret number. Must be 4 unique digits."
             room = player.room
@@ -169,309 +368,315 @@ class GameConsumer(AsyncWebsocketConsumer):
             if team == 'A':
                 room.team_a_secret = number
                 room.team_a_set_by = player
+                update_fields = ['team_a_secret', 'team_a_set_by']
             else:
                 room.team_b_secret = number
                 room.team_b_set_by = player
-            room.save(update_fields=['team_a_secret','team_b_secret','team_a_set_by','team_b_set_by'])
-            for teammate in room.players.filter(team=team):
-                if teammate.secret_number != number:
-                    teammate.secret_number = number
-                    teammate.save(update_fields=['secret_number'])
+                update_fields = ['team_b_secret', 'team_b_set_by']
 
             # If both secrets set move to PLAYING and init first turn (Team A first)
-            if room.status in (GameRoom.SETTING_NUMBERS, GameRoom.WAITING) and room.team_a_secret and room.team_b_secret:
+            starting = room.status in (GameRoom.SETTING_NUMBERS, GameRoom.WAITING) and room.team_a_secret and room.team_b_secret
+            first_a = None
+            if starting:
+                analytics.record(analytics.status_change(room.status, GameRoom.PLAYING))
                 room.status = GameRoom.PLAYING
-                first_a = room.players.filter(team='A').order_by('joined_at').first()
+                room.started_at = timezone.now()
+                first_a = next((p for p in players if p.team == 'A'), None)
                 if first_a:
-                    room.current_turn_player = first_a.user
+                    room.current_turn_player_id = first_a.user_id
                     room.current_turn_team = 'A'
-                    room.turn_start_time = timezone.now()
-                room.save()
-                # Schedule first turn timeout
-                if room.turn_time_limit:
-                    check_turn_timeout.apply_async(args=[str(room.id)], countdown=room.turn_time_limit)
-            return True, "Team secret set"
-        except Player.DoesNotExist:
-            return False, "Player not found"
-
-    @database_sync_to_async
+                    room.turn_start_time = room.started_at
+                    room.turn_deadline = room.deadline_for(room.turn_start_time)
+                update_fields += ['status', 'started_at', 'current_turn_player', 'current_turn_team', 'turn_start_time', 'turn_deadline']
+            # One save for the secret and, when both are set, the start of the game
+            room.save(update_fields=update_fields)
+            Player.objects.filter(room_id=room.id, team=team).exclude(secret_number=number).update(secret_number=number)
+
+        self.pending_events.append(room_event(
+            room.id, 'secret_set',
+            {'team': team, 'set_by_username': player.display_name},
+            private={'secret_number': number},
+        ))
+        if starting:
+            self.pending_events.append(room_event(room.id, 'status_changed', {'status': room.status}))
+            if first_a:
+                self.pending_events.append(turn_changed_event(room, first_a.display_name))
+            # Schedule first turn timeout
+            schedule_turn_timeout(room)
+        return True, "Team secret set"
+
+    @db_hop
     def make_guess(self, guess_number, target_player_id=None):
-        try:
-            player = Player.objects.get(user=self.user, room_id=self.room_id)
+        """Unit of work for make_guess: (ok, result or error message, room state bundle or None)."""
+        ok, result = self._make_guess(guess_number, target_player_id)
+        return ok, result, self._room_state_bundle() if ok else None
+
+    def _make_guess(self, guess_number, target_player_id=None):
+        """Record a guess and advance the turn in one transaction (3 queries, 5 for a winning guess).
+
+        The turn is claimed with a conditional UPDATE on (current_turn_player,
+        turn_start_time) rather than a row lock: of two concurrent guesses in the
+        same turn exactly one matches, the other gets "Not your turn".
+        """
+        with transaction.atomic():
+            # The room's players, their room and its guess count (for a win's analytics) in one query
+            players = list(
+                Player.objects.filter(room_id=self.room_id).select_related('room').order_by('joined_at')
+                .annotate(room_guesses=Subquery(
+                    Guess.objects.filter(room_id=self.room_id).order_by()
+                    .values('room_id').annotate(count=Count('pk')).values('count')
+                ))
+            )
+            player = next((p for p in players if p.user_id == self.user.id), None)
+            if player is None:
+                return False, "Invalid guess"
             room = player.room
-            # Ensure teams are properly assigned
-            if not player.team:
-                a_count = room.players.filter(team='A').count()
-                b_count = room.players.filter(team='B').count()
-                player.team = 'A' if a_count <= b_count else 'B'
-                player.save()
-
-            # Backfill missing team assignments for any players
-            a_count = room.players.filter(team='A').count()
-            b_count = room.players.filter(team='B').count()
-            for p in room.players.filter(team=''):
-                p.team = 'A' if a_count <= b_count else 'B'
-                p.save()
-                if p.team == 'A':
-                    a_count += 1
-                else:
-                    b_count += 1
-            
+
+            # Backfill missing team assignments (legacy rooms) in one bulk update
+            a_count = sum(1 for p in players if p.team == 'A')
+            b_count = sum(1 for p in players if p.team == 'B')
+            backfilled = []
+            for p in sorted(players, key=lambda p: p.id != player.id):
+                if not p.team:
+                    p.team = 'A' if a_count <= b_count else 'B'
+                    if p.team == 'A':
+                        a_count += 1
+                    else:
+                        b_count += 1
+                    backfilled.append(p)
+            if backfilled:
+                Player.objects.bulk_update(backfilled, ['team'])
+
             # Validate it's the player's turn
-            if room.current_turn_player != self.user:
-                return False, "Not your turn"
-            
+            if room.status != GameRoom.PLAYING or room.current_turn_player_id != self.user.id:
+                result = False, "Not your turn"
             # Validate guess format
-            if len(guess_number) != 4 or not guess_number.isdigit():
-                return False, "Invalid guess format"
-            
-            # Pick an opponent target automatically if not supplied: choose first opponent team player
-            if not target_player_id:
-                target_team = 'B' if player.team == 'A' else 'A'
-                target_player = room.players.filter(team=target_team).order_by('joined_at').first()
+            elif not isinstance(guess_number, str) or len(guess_number) != 4 or not guess_number.isdigit():
+                result = False, "Invalid guess format"
             else:
-                target_player = Player.objects.get(id=target_player_id, room=player.room)
-
-            if not target_player:
-                return False, "No opponent available to target"
-
-            # Calculate feedback
-            strikes, balls = Guess.calculate_feedback(target_player.secret_number, guess_number)
-            is_correct = strikes == 4
-            
-            # Create guess record
-            guess = Guess.objects.create(
-                player=player,
-                target_player=target_player,
-                room=room,
-                guess_number=guess_number,
-                strikes=strikes,
-                balls=balls,
-                is_correct=is_correct
-            )
-            
-            # Check for win condition
-            if is_correct:
-                player.is_winner = True
-                player.save()
-                room.status = GameRoom.FINISHED
-                room.save()
-            else:
-                # Switch turns to next player from the opposite team
-                players = list(room.players.order_by('joined_at'))
-                try:
-                    current_index = next(i for i, p in enumerate(players) if p.user == room.current_turn_player)
-                except StopIteration:
-                    # Fallback: if current_turn_player not found, start from current player
-                    current_index = next((i for i, p in enumerate(players) if p.id == player.id), 0)
-                current_team = players[current_index].team
-                # find next player with different team; wrap around
-                n = len(players)
-                for step in range(1, n+1):
-                    idx = (current_index + step) % n
-                    if players[idx].team != current_team:
-                        room.current_turn_player = players[idx].user
-                        room.current_turn_team = players[idx].team
-                        break
-                room.turn_start_time = timezone.now()
-                room.save()
-                # Schedule next turn timeout
-                if room.turn_time_limit:
-                    check_turn_timeout.apply_async(args=[str(room.id)], countdown=room.turn_time_limit)
-            
-            return True, {
-                'guess': guess_number,
-                'strikes': strikes,
-                'balls': balls,
-                'is_correct': is_correct,
-                'target_player': target_player.display_name
-            }
-        except (Player.DoesNotExist, ValueError):
-            return False, "Invalid guess"
+                result = self._record_guess(room, players, player, guess_number, target_player_id)
+        if backfilled:
+            bump_room_version(room.id)
+        if not result[0]:
+            return result
+
+        guess, next_player = result[1]
+        self.pending_events.append(room_event(room.id, 'guess_added', serialize_guess(guess)))
+        if guess.is_correct:
+            # Finished games reveal both team secrets to everyone
+            self.pending_events.append(room_event(room.id, 'status_changed', {
+                'status': room.status,
+                'winner_username': player.display_name,
+                'winner_team': player.team,
+                'team_secrets': {'A': room.team_a_secret, 'B': room.team_b_secret},
+            }))
+        else:
+            self.pending_events.append(turn_changed_event(
+                room, next_player.display_name if next_player else None
+            ))
+            # Schedule next turn timeout
+            schedule_turn_timeout(room)
+        return True, {
+            'guess': guess.guess_number,
+            'strikes': guess.strikes,
+            'balls': guess.balls,
+            'is_correct': guess.is_correct,
+            'target_player': guess.target_player.display_name
+        }
 
-    @database_sync_to_async
-    def get_room_state(self, current_user_id=None, personalized=False):
-        """Build a room state snapshot.
+    def _record_guess(self, room, players, player, guess_number, target_player_id):
+        """Claim the turn, insert the guess and mark a winner (sync, inside make_guess's transaction).
 
-        If personalized=True and current_user_id is provided, include only THAT user's
-        secret number (unless game finished). If personalized=False, never include
-        any secret numbers unless the game has finished (then reveal all).
-        This prevents leaking another player's secret via broadcasts triggered by them.
+        Returns (True, (guess, next_player)) or (False, error message).
         """
-        try:
-            # Use select_related to fetch related objects in one query
-            room = GameRoom.objects.select_related('creator', 'current_turn_player', 'team_a_set_by', 'team_b_set_by').get(id=self.room_id)
-            # Prefetch all players with their users in one query
-            room_players = list(room.players.select_related('user').all())
-            players = []
-            finished = room.status == GameRoom.FINISHED
-
-            # Determine current user's team (for personalized view) so teammates can all see the shared team secret
-            current_user_team = None
-            if personalized and current_user_id:
-                try:
-                    current_player_obj = next((p for p in room_players if p.user_id == current_user_id), None)
-                    current_user_team = current_player_obj.team if current_player_obj else None
-                except StopIteration:
-                    current_user_team = None
-
-            for player in room_players:
-                reveal_secret = False
-                team_secret = room.team_a_secret if player.team == 'A' else room.team_b_secret if player.team == 'B' else ''
-
-                if finished:
-                    reveal_secret = True  # end of game: reveal all
-                elif personalized and current_user_id:
-                    # Reveal if this is the requesting player OR if it's a teammate (shared team secret concept)
-                    if player.user_id == current_user_id:
-                        reveal_secret = True
-                    elif current_user_team and player.team == current_user_team and team_secret:
-                        reveal_secret = True
-
-                # Mirror team secret into effective_secret so front-end can pick it up uniformly
-                effective_secret = team_secret or player.secret_number
-                players.append({
-                    'id': player.id,
-                    'username': player.display_name,
-                    'has_secret_number': bool(team_secret),
-                    'is_winner': player.is_winner,
-                    'team': player.team,
-                    **({'secret_number': effective_secret} if (reveal_secret or finished) else {})
-                })
+        # Pick an opponent target automatically if not supplied: choose first opponent team player
+        if not target_player_id:
+            target_team = 'B' if player.team == 'A' else 'A'
+            target_player = next((p for p in players if p.team == target_team), None)
+        else:
+            try:
+                target_id = int(target_player_id)
+            except (TypeError, ValueError):
+                return False, "Invalid guess"
+            target_player = next((p for p in players if p.id == target_id), None)
+            if target_player is None:
+                return False, "Invalid guess"
+        if not target_player:
+            return False, "No opponent available to target"
+
+        strikes, balls = Guess.calculate_feedback(target_player.secret_number, guess_number)
+        is_correct = strikes == 4
+
+        next_player = None
+        if is_correct:
+            changes = {'status': GameRoom.FINISHED, 'finished_at': timezone.now()}
+        else:
+            # Switch turns to next player from the opposite team
+            current_index = next((i for i, p in enumerate(players) if p.id == player.id), 0)
+            n = len(players)
+            for step in range(1, n+1):
+                candidate = players[(current_index + step) % n]
+                if candidate.team != player.team:
+                    next_player = candidate
+                    break
+            now = timezone.now()
+            changes = {'turn_start_time': now, 'turn_deadline': room.deadline_for(now)}
+            if next_player:
+                changes['current_turn_player_id'] = next_player.user_id
+                changes['current_turn_team'] = next_player.team
+
+        claimed = GameRoom.objects.filter(
+            id=room.id,
+            status=GameRoom.PLAYING,
+            current_turn_player_id=self.user.id,
+            turn_start_time=room.turn_start_time,
+        ).update(**changes)
+        if not claimed:
+            return False, "Not your turn"
+        for field, value in changes.items():
+            setattr(room, field, value)
+
+        guess = Guess.objects.create(
+            player=player,
+            target_player=target_player,
+            room=room,
+            guess_number=guess_number,
+            strikes=strikes,
+            balls=balls,
+            is_correct=is_correct
+        )
+        if is_correct:
+            player.is_winner = True
+            player.save(update_fields=['is_winner'])
+            guesses = (player.room_guesses or 0) + 1
+            analytics.record(analytics.game_finished(room, guesses, guess.timestamp), guess.timestamp)
+        return True, (guess, next_player)
+
+    async def send_room_state(self, bundle=None):
+        """Broadcast the room state to every socket in the group, this one included.
+
+        The snapshot is fetched once (from the shared cache) and sent once to the
+        group and to each team group with secrets to show (room_state_sends());
+        each receiving socket layers its own user's secrets on top in memory
+        (see room_state_update), so a broadcast costs one snapshot build at most
+        and one used message per socket.
+
+        `bundle` is the (snapshot, strategy) a unit of work already gathered;
+        without it both are fetched here in one hop.
+        """
+        await self.publish_room_events()
+        if bundle is not None:
+            snapshot, strategy = bundle
+        elif self.actor is not None:
+            snapshot = self.actor.snapshot()
+            strategy = await self._actor_strategy_hop(self._actor_team()) if snapshot and getattr(self.user, 'id', None) else None
+        else:
+            snapshot, strategy = await self._room_state_bundle_hop()
+        if not snapshot:
+            return
+        for group, message in room_state_sends(self.room_id, snapshot):
+            await metrics.group_send(self.channel_layer, group, message)
 
-            # Fetch guesses with related objects in one query
-            guesses = []
-            for guess in Guess.objects.filter(room=room).select_related('player', 'target_player').order_by('timestamp'):
-                guesses.append({
-                    'player': guess.player.display_name,
-                    'target_player': guess.target_player.display_name,
-                    'guess': guess.guess_number,
-                    'strikes': guess.strikes,
-                    'balls': guess.balls,
-                    'is_correct': guess.is_correct,
-                    'timestamp': guess.timestamp.isoformat()
-                })
+        if strategy:
+            # Also push team strategy init for this user
+            await self.send_frame({'type': 'team_strategy_init', 'data': strategy})
 
-            # Find winner from already-loaded players
-            winner = next((p for p in room_players if p.is_winner), None)
-            
-            # Get current turn player's display name from already-loaded data
-            current_turn_display_name = None
-            if room.current_turn_player:
-                current_turn_player_obj = next((p for p in room_players if p.user_id == room.current_turn_player.id), None)
-                current_turn_display_name = current_turn_player_obj.display_name if current_turn_player_obj else None
-            
-            return {
-                'room_id': str(room.id),
-                'name': room.name,
-                'status': room.status,
-                'creator_username': (
-                    next((p.display_name for p in room_players if p.user_id == room.creator.id), None)
-                    if room.creator else None
-                ),
-                'players': players,
-                'current_turn_player': current_turn_display_name,
-                'current_turn_team': room.current_turn_team,
-                'turn_start_time': room.turn_start_time.isoformat() if room.turn_start_time else None,
-                'turn_time_limit': room.turn_time_limit,
-                'guesses': guesses,
-                'winner_username': winner.display_name if winner else None,
-                'winner_team': winner.team if winner else None,
-                'team_a_secret_set': bool(room.team_a_secret),
-                'team_b_secret_set': bool(room.team_b_secret),
-                'team_a_set_by_username': (
-                    next((p.display_name for p in room_players if room.team_a_set_by and p.user_id == room.team_a_set_by.id), None)
-                    if room.team_a_set_by else None
-                ),
-                'team_b_set_by_username': (
-                    next((p.display_name for p in room_players if room.team_b_set_by and p.user_id == room.team_b_set_by.id), None)
-                    if room.team_b_set_by else None
-                ),
-            }
-        except GameRoom.DoesNotExist:
-            return None
+    async def send_personal_state(self, snapshot=None, frames=None):
+        """Send this socket its personalized full state (from the cache unless given).
 
-    async def send_room_state(self):
-        """Send personalized state to this socket, then broadcast generic state to group.
-        
-        This reduces database calls by generating personalized state first, then stripping
-        secrets for the broadcast rather than making two separate database queries.
+        `frames` is the generic state as encoded by the broadcaster, sent as is
+        when this user sees no secret; personalized states are encoded once
+        per set of visible secrets and version.
         """
-        current_user_id = getattr(self.user, 'id', None)
-
-        # Generate personalized state first (if authenticated user exists)
-        if current_user_id:
-            personal_state = await self.get_room_state(current_user_id, personalized=True)
-            if personal_state:
-                # Send personalized state to this connection
-                await self.send(text_data=json.dumps({
-                    'type': 'room_state_update',
-                    'data': personal_state
-                }))
-                
-                # Create generic state by stripping secret numbers (unless game finished)
-                generic_state = personal_state.copy()
-                if personal_state.get('status') != 'finished':
-                    # Remove secret numbers from players for generic broadcast
-                    generic_players = []
-                    for player in personal_state.get('players', []):
-                        generic_player = player.copy()
-                        generic_player.pop('secret_number', None)
-                        generic_players.append(generic_player)
-                    generic_state['players'] = generic_players
-                
-                # Broadcast generic state to group
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'room_state_update',
-                        'room_state': generic_state
-                    }
-                )
-                
-                # Also push team strategy init for this user
-                await self.send_team_strategy(init=True)
-        else:
-            # Fallback for unauthenticated connections
-            generic_state = await self.get_room_state(None, personalized=False)
-            if generic_state:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'room_state_update',
-                        'room_state': generic_state
-                    }
-                )
+        if snapshot is None:
+            snapshot = await self.current_snapshot()
+            if not snapshot:
+                return
+        own = next((p for p in snapshot['private']['players'] if p['user_id'] == self.user.id), None)
+        await self.join_team(own['team'] if own else None)
+        self.delta_seq = max(self.delta_seq, snapshot['version'])
+        revealed = revealed_secrets(snapshot, self.user.id)
+        if frames and not revealed:
+            await self.outbound.push(wire.Encoded(frames), key='room_state', seq=snapshot['version'])
+            return
+        shared = None
+        if snapshot['version'] is not None:
+            shared = ('room_state', self.room_id, snapshot['version'], len(snapshot['state']['guesses']), revealed)
+        await self.send_frame({
+            'type': 'room_state_update',
+            'data': personalize(snapshot, self.user.id, revealed)
+        }, key='room_state', shared=shared, seq=snapshot['version'])
+
+    async def publish_room_events(self):
+        """Broadcast the delta events queued by the sync DB helpers, in seq order."""
+        events, self.pending_events = self.pending_events, []
+        for event in events:
+            for group, message in delta_sends(self.room_id, event):
+                await metrics.group_send(self.channel_layer, group, message)
+            if event['type'] == 'room_delta' and event['event'] == 'status_changed':
+                await lobby.publish_status(self.channel_layer, self.room_id, event['data']['status'])
 
     async def room_state_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'room_state_update',
-            'data': event['room_state']
-        }))
+        snapshot = event['snapshot']
+        version = snapshot['version'] or 0
+        if 'team' in event:
+            self.team_state_version = version
+        elif version and version <= self.team_state_version:
+            # The team group copy (secrets included) came first
+            return
+        # Delta sockets already got changes up to delta_seq as deltas
+        if self.delta_mode and snapshot['version'] <= self.delta_seq:
+            return
+        await self.send_personal_state(snapshot, event.get('frames'))
+
+    async def room_delta(self, event):
+        if not self.delta_mode or event['seq'] <= self.delta_seq:
+            return
+        self.delta_seq = event['seq']
+        data = event['data']
+        if event['event'] == 'team_changed' and data['player_id'] == self.player_id:
+            await self.join_team(data['team'])
+        # The copy with a private part only reaches its team's group (delta_sends)
+        await self.forward(event, seq=event['seq'])
 
     async def refresh_room_state(self, event):
-        # Task requested a state refresh after turn skip
-        await self.send_room_state()
+        # Legacy task message: refresh this socket only (no re-broadcast)
+        await self.send_personal_state()
 
     # --- Team Strategy Section ---
-    @database_sync_to_async
-    def _get_player_and_strategy(self):
-        try:
-            player = Player.objects.get(user=self.user, room_id=self.room_id)
-            ts, _ = TeamStrategy.objects.get_or_create(
-                room_id=self.room_id,
-                team=player.team or 'A',
-                defaults={
-                    'slot_digits': [[-1]*10 for _ in range(4)],
-                    'draft_guess': ['', '', '', '']
-                }
-            )
-            ts.ensure_defaults(save=True)
-            return player, ts
-        except Player.DoesNotExist:
-            return None, None
+    def _actor_team(self):
+        """This user's team as the room actor holds it (the database may lag behind); None outside actor mode."""
+        return self.actor.player_team(self.user.id) if self.actor is not None else None
+
+    def _strategy_for_user(self, team=None):
+        """This user's TeamStrategy, None if not a player; a known `team` (see _actor_team) skips the player lookup."""
+        if team is None:
+            try:
+                team = Player.objects.get(user=self.user, room_id=self.room_id).team
+            except Player.DoesNotExist:
+                return None
+        ts, _ = TeamStrategy.objects.get_or_create(
+            room_id=self.room_id,
+            team=team or 'A',
+            defaults=strategy.default_strategy()
+        )
+        ts.ensure_defaults(save=True)
+        return ts
+
+    @db_hop
+    def _update_team_strategy(self, data, team=None):
+        """Unit of work for update_team_strategy: (ok, payload), payload None if the user has no strategy."""
+        ts = self._strategy_for_user(team)
+        if not ts:
+            return False, None
+        return self._apply_team_strategy_update(
+            ts.team,
+            data.get('version'),
+            data.get('notes', ts.notes),
+            data.get('slot_digits', ts.slot_digits),
+            data.get('draft_guess', ts.draft_guess)
+        )
 
-    @database_sync_to_async
     def _apply_team_strategy_update(self, team, version, notes, slot_digits, draft_guess):
         try:
             ts = TeamStrategy.objects.get(room_id=self.room_id, team=team)
@@ -490,85 +695,60 @@ class GameConsumer(AsyncWebsocketConsumer):
             ts.draft_guess = draft_guess
             ts.version += 1
             ts.last_editor = self.user if getattr(self.user, 'is_authenticated', False) else None
-            ts.save()
+            # Notes patches based on earlier versions can no longer be rebased
+            ts.recent_splices = (ts.recent_splices + [[ts.version, None]])[-strategy.HISTORY:]
+            ts.save(update_fields=[
+                'notes', 'slot_digits', 'draft_guess', 'version', 'last_editor', 'recent_splices', 'updated_at',
+            ])
             return True, self._serialize_team_strategy(ts)
         except TeamStrategy.DoesNotExist:
             return False, None
 
     # Synchronous helper (must NOT be decorated) used inside other sync DB functions
-    def _serialize_team_strategy(self, ts, room=None):
+    def _serialize_team_strategy(self, ts, names=None):
+        """`names` (user id -> display name of the room's players) saves the last editor lookup."""
         if not ts:
             return None
-        # Get room if not provided
-        if not room:
-            try:
-                room = GameRoom.objects.get(id=self.room_id)
-            except GameRoom.DoesNotExist:
-                room = None
-        
-        return {
-            'team': ts.team,
-            'notes': ts.notes,
-            'slot_digits': ts.slot_digits,
-            'draft_guess': ts.draft_guess,
-            'version': ts.version,
-            'updated_at': ts.updated_at.isoformat() if ts.updated_at else None,
-            'last_editor': (
-                room.players.filter(user=ts.last_editor).first().display_name
-                if ts.last_editor and room and room.players.filter(user=ts.last_editor).exists()
-                else None
+        if not ts.last_editor_id:
+            editor = None
+        elif names is not None:
+            editor = names.get(ts.last_editor_id)
+        else:
+            editor = (
+                Player.objects.filter(room_id=self.room_id, user_id=ts.last_editor_id)
+                .values_list('display_name', flat=True).first()
             )
-        }
+        return strategy.serialize_strategy(ts, editor)
 
-    @database_sync_to_async
-    def _get_serialized_strategy_for_user(self):
-        try:
-            # Use select_related to avoid additional query for room
-            player = Player.objects.select_related('room').get(user=self.user, room_id=self.room_id)
-            ts, created = TeamStrategy.objects.get_or_create(
-                room_id=self.room_id,
-                team=player.team or 'A',
-                defaults={
-                    'slot_digits': [[-1]*10 for _ in range(4)],
-                    'draft_guess': ['', '', '', '']
-                }
-            )
-            if created or not hasattr(ts, 'slot_digits') or not hasattr(ts, 'draft_guess'):
-                ts.ensure_defaults(save=True)
-            return self._serialize_team_strategy(ts, room=player.room)
-        except Player.DoesNotExist:
-            return None
+    def _serialized_strategy_for_user(self, team=None):
+        return self._serialize_team_strategy(self._strategy_for_user(team))
+
+    @db_hop
+    def _get_serialized_strategy_for_user(self, team=None):
+        return self._serialized_strategy_for_user(team)
 
-    async def send_team_strategy(self, init=False):
-        payload = await self._get_serialized_strategy_for_user()
+    async def send_team_strategy(self):
+        payload = await self._get_serialized_strategy_for_user(self._actor_team())
         if not payload:
             return
-        await self.send(text_data=json.dumps({
-            'type': 'team_strategy_init' if init else 'team_strategy_update',
+        await self.send_frame({
+            'type': 'team_strategy_update',
             'data': payload
-        }))
+        })
 
     async def update_team_strategy(self, data):
-        player, ts = await self._get_player_and_strategy()
-        if not player or not ts:
-            return
-        ok, payload = await self._apply_team_strategy_update(
-            ts.team,
-            data.get('version'),
-            data.get('notes', ts.notes),
-            data.get('slot_digits', ts.slot_digits),
-            data.get('draft_guess', ts.draft_guess)
-        )
+        ok, payload = await self._update_team_strategy(data, self._actor_team())
         if payload is None:
             return
         if not ok:
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 'type': 'team_strategy_conflict',
                 'data': payload
-            }))
+            })
             return
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await metrics.group_send(
+            self.channel_layer,
+            team_group(self.room_id, payload['team']),
             {
                 'type': 'team_strategy_group_update',
                 'payload': payload
@@ -576,25 +756,36 @@ class GameConsumer(AsyncWebsocketConsumer):
         )
 
     async def team_strategy_group_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'team_strategy_update',
+        await self.forward(event, key=f"team_strategy:{event['payload']['team']}")
+
+    def patch_team_strategy(self, data):
+        """Buffer a strategy patch for this player's team; merged and saved by the next flush (strategy.py)."""
+        strategy.add_patch(self.room_id, self.team or 'A', self.user.id, self.channel_name, data)
+
+    async def team_strategy_patch(self, event):
+        # Patches are incremental: never coalesced away
+        await self.forward(event)
+
+    async def team_strategy_resync(self, event):
+        # One of this socket's patches could not be merged
+        await self.send_frame({
+            'type': 'team_strategy_conflict',
             'data': event['payload']
-        }))
+        })
 
     async def game_message(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'game_message',
-            'message': event['message']
-        }))
+        await self.forward(event)
 
     async def turn_timeout(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'turn_timeout',
-            'message': 'Turn time expired!'
-        }))
+        await self.forward(event)
 
     # --- Team Switching ---
-    @database_sync_to_async
+    @db_hop
+    def _change_team(self, desired_team):
+        """Unit of work for change_team: (ok, message, room state bundle)."""
+        ok, message = self._can_change_team(desired_team)
+        return ok, message, self._room_state_bundle()
+
     def _can_change_team(self, desired_team):
         try:
             player = Player.objects.get(user=self.user, room_id=self.room_id)
@@ -613,27 +804,30 @@ class GameConsumer(AsyncWebsocketConsumer):
             # Balance restriction removed – allow any imbalance
             # Apply change
             player.team = desired_team
-            player.save()
+            player.save(update_fields=['team'])
+            self.pending_events.append(room_event(room.id, 'team_changed', {'player_id': player.id, 'team': desired_team}))
             return True, "Team changed"
         except Player.DoesNotExist:
             return False, "Player not found"
 
     async def change_team(self, desired_team):
-        ok, message = await self._can_change_team(desired_team)
-        if not ok:
-            await self.send(text_data=json.dumps({
-                'type': 'game_message',
-                'message': message
-            }))
-        else:
-            # Send success message only to requester (state broadcast covers rest)
-            await self.send(text_data=json.dumps({
-                'type': 'game_message',
-                'message': message
-            }))
+        ok, message, bundle = await self._change_team(desired_team)
+        if ok:
+            await self.join_team(desired_team)
+        # Success or not, the message goes to the requester only (the state broadcast covers the rest)
+        await self.send_frame({
+            'type': 'game_message',
+            'message': message
+        })
+        await self.send_room_state(bundle)
 
     # --- Start Game (early start before room full) ---
-    @database_sync_to_async
+    @db_hop
+    def _start_game(self):
+        """Unit of work for start_game: (ok, message, room state bundle)."""
+        ok, message = self._attempt_start_game()
+        return ok, message, self._room_state_bundle()
+
     def _attempt_start_game(self):
         try:
             room = GameRoom.objects.get(id=self.room_id)
@@ -643,6 +837,7 @@ class GameConsumer(AsyncWebsocketConsumer):
                 if first_player and first_player.user == self.user:
                     room.creator = self.user
                     room.save(update_fields=['creator'])
+                    bump_room_version(room.id)
                 else:
                     return False, "Only the room creator can start the game"
             elif room.creator != self.user:
@@ -656,24 +851,124 @@ class GameConsumer(AsyncWebsocketConsumer):
                 return False, "Need at least one player on each team"
             # Move to setting_numbers if still waiting
             if room.status == GameRoom.WAITING:
+                analytics.record(analytics.status_change(room.status, GameRoom.SETTING_NUMBERS))
                 room.status = GameRoom.SETTING_NUMBERS
                 room.save(update_fields=['status'])
+                self.pending_events.append(room_event(room.id, 'status_changed', {'status': room.status}))
             return True, "Game started - set team secrets"
         except GameRoom.DoesNotExist:
             return False, "Room not found"
 
     async def start_game(self):
-        ok, message = await self._attempt_start_game()
-        await self.send(text_data=json.dumps({
+        ok, message, bundle = await self._start_game()
+        await self.send_frame({
             'type': 'game_message',
             'message': message
-        }))
+        })
         if ok:
             # Broadcast new state to others
-            await self.channel_layer.group_send(
+            await metrics.group_send(
+                self.channel_layer,
                 self.room_group_name,
                 {
                     'type': 'game_message',
                     'message': 'Game starting. Teams set your secrets!'
                 }
             )
+        await self.send_room_state(bundle)
+
+
+class LobbyConsumer(AsyncWebsocketConsumer):
+    """Live lobby socket (ws/lobby/), open to anonymous clients.
+
+    Sends ``{'type': 'lobby_snapshot', 'data': <first lobby page>}`` on connect
+    and on ``{'type': 'resync'}``, then one ``{'type': 'lobby_event', 'event',
+    'room'}`` frame per room_created / room_updated / room_closed (see lobby.py).
+    """
+
+    async def connect(self):
+        # Join first: events published while the snapshot is built are sent after it
+        await self.channel_layer.group_add(lobby.LOBBY_GROUP, self.channel_name)
+        await self.accept()
+        await self.send_snapshot()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(lobby.LOBBY_GROUP, self.channel_name)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except ValueError:
+            return
+        if isinstance(data, dict) and data.get('type') == 'resync':
+            await self.send_snapshot()
+
+    async def send_snapshot(self):
+        query = lobby.parse_query({'limit': str(lobby.MAX_PAGE_SIZE)})
+        _, body = await database_sync_to_async(lobby.get_page)(query)
+        # The cached page is already JSON; splice it in instead of re-encoding
+        await self.send(text_data='{"type": "lobby_snapshot", "data": ' + body.decode() + '}')
+
+    async def lobby_event(self, event):
+        await self.send(text_data=json.dumps(event))
+
+
+class SpectatorConsumer(AsyncWebsocketConsumer):
+    """Read-only room socket for spectators (ws/watch/<room_id>/), open to anonymous clients.
+
+    Gets the room's secret-free ``room_state_update`` frames (and ``room_delta``
+    frames with ``?protocol=delta``) from this process's RoomFeed, at most
+    SPECTATOR_MAX_FPS a second or ``?fps=`` if lower; see spectators.py.
+    The only message it accepts is ``{'type': 'resync'}``. Wire formats are
+    negotiated as for game sockets.
+    """
+
+    # Fed in-process by the room's feed: no channel-layer channel per viewer
+    channel_layer_alias = None
+
+    async def connect(self):
+        self.room_id = self.scope['url_route']['kwargs']['room_id']
+        self.feed = None
+        self.accepted = False
+        if spectators.MAX_FPS <= 0:
+            await self.close()
+            return
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            fps = float(query.get('fps', [''])[0])
+        except ValueError:
+            fps = None
+        self.codec, self.subprotocol = wire.negotiate(self.scope.get('subprotocols'))
+        self.viewer = spectators.Viewer(
+            self.send_encoded, self.codec, query.get('protocol', [''])[0] == 'delta', fps if fps and fps > 0 else None
+        )
+        self.feed = await spectators.watch(self.room_id, self.viewer)
+        if self.feed is None:
+            await self.close()
+            return
+        await self.accept(self.subprotocol)
+        self.accepted = True
+        metrics.spectator_sockets.inc()
+        self.feed.resync(self.viewer)
+
+    async def disconnect(self, close_code):
+        if self.feed is not None:
+            await spectators.unwatch(self.feed, self.viewer)
+            self.feed = None
+        if self.accepted:
+            metrics.spectator_sockets.dec()
+            self.accepted = False
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data or '')
+        except ValueError:
+            return
+        if isinstance(data, dict) and data.get('type') == 'resync' and self.feed is not None:
+            self.feed.resync(self.viewer)
+
+    async def send_encoded(self, data):
+        if self.codec.binary:
+            await self.send(bytes_data=data)
+        else:
+            await self.send(text_data=data)
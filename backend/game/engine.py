@@ -0,0 +1,655 @@
+"""In-memory authoritative room engine (GAME_ENGINE = 'actor').
+
+In the default 'db' engine every game action in GameConsumer is a handful of
+synchronous ORM round trips. In 'actor' mode each active room is owned by one
+RoomActor living on the ASGI event loop: it holds the room, its players and its
+guess history in memory and applies guesses, secrets, team changes, game start
+and turn timeouts without touching the database.
+
+Durability comes from write-behind persistence:
+
+1. every mutation is appended to a per-room journal file (one JSON object per
+   line, numbered by ``n``) before the action is acknowledged;
+2. a flusher persists journal entries to the database in one transaction per
+   batch, at most every ENGINE_FLUSH_INTERVAL_MS, and records the last
+   persisted ``n`` in GameRoom.engine_seq;
+3. when a room is loaded, journal entries newer than engine_seq (left behind by
+   a crashed process) are replayed into the database first.
+
+Entries are flushed to the OS on write, which survives a process crash; set
+ENGINE_JOURNAL_FSYNC to also fsync each entry (power-loss safe, slower).
+
+An actor only exists in the process that loaded it, so every socket of a room
+must be routed to the same ASGI process (e.g. sticky routing on the room id)
+when running more than one. Turn timeouts are handled by the actor itself, so
+no Celery worker is needed for them in this mode. Players still join through
+the REST join_room view, which writes to the database behind the actor; the
+socket that follows a join merges those writes in (RoomActor.attach).
+"""
+import asyncio
+import json
+import logging
+import os
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from . import analytics, metrics
+from .models import GameRoom, Player, Guess
+from .room_state import bump_room_version, room_state_sends, serialize_guess, snapshot_from
+from .tasks import SKIP_GRACE_SECONDS, turn_skipped_message, turn_timeout_message
+
+logger = logging.getLogger(__name__)
+
+ENGINE = getattr(settings, 'GAME_ENGINE', 'db')
+FLUSH_INTERVAL = getattr(settings, 'ENGINE_FLUSH_INTERVAL_MS', 250) / 1000
+JOURNAL_DIR = getattr(settings, 'ENGINE_JOURNAL_DIR', os.path.join(settings.BASE_DIR, 'journal'))
+JOURNAL_FSYNC = getattr(settings, 'ENGINE_JOURNAL_FSYNC', False)
+# Room versions an actor reserves from the shared counter at a time (see RoomActor._next_version)
+VERSION_BLOCK = 1000
+
+# Message types the actor handles; everything else goes through the DB path
+ACTOR_MESSAGES = ('set_secret_number', 'make_guess', 'change_team', 'start_game')
+
+# Process-wide counters
+stats = {
+    'commands': 0,
+    'entries_journaled': 0,
+    'entries_flushed': 0,
+    'flushes': 0,
+    'flush_errors': 0,
+}
+
+_actors = {}
+_loading = {}
+_closing = {}
+
+_DATETIME_FIELDS = ('turn_start_time', 'turn_deadline', 'started_at', 'finished_at')
+
+
+def actor_mode_enabled():
+    return ENGINE == 'actor'
+
+
+def _journal_path(room_id):
+    return os.path.join(JOURNAL_DIR, f'{room_id}.jsonl')
+
+
+def _read_journal(room_id):
+    path = _journal_path(room_id)
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path) as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Torn last line from a crash mid-write; it was never acknowledged
+                break
+    return entries
+
+
+def _decode_fields(fields):
+    return {
+        name: parse_datetime(value) if name in _DATETIME_FIELDS and value else value
+        for name, value in fields.items()
+    }
+
+
+def persist_entries(room_id, entries):
+    """Apply journal entries to the database in one transaction."""
+    room_fields = {}
+    player_fields = {}
+    guesses = []
+    rollups = []
+    for entry in entries:
+        if entry['op'] == 'room':
+            room_fields.update(entry['fields'])
+        elif entry['op'] == 'player':
+            player_fields.setdefault(entry['id'], {}).update(entry['fields'])
+        elif entry['op'] == 'guess':
+            guesses.append(Guess(room_id=room_id, **entry['fields']))
+        elif entry['op'] == 'stats':
+            rollups.append((parse_datetime(entry['at']), entry['deltas']))
+    with transaction.atomic():
+        updated = GameRoom.objects.filter(id=room_id).update(engine_seq=entries[-1]['n'], **_decode_fields(room_fields))
+        if not updated:
+            # Room was deleted while the actor held it; nothing left to persist
+            return
+        for player_id, fields in player_fields.items():
+            Player.objects.filter(id=player_id).update(**_decode_fields(fields))
+        if guesses:
+            Guess.objects.bulk_create(guesses)
+        for at, deltas in rollups:
+            analytics.record(deltas, at)
+    # Non-actor readers (views, other processes) rebuild from the new rows
+    bump_room_version(room_id)
+
+
+def replay_journal(room_id):
+    """Persist journal entries a previous process wrote but never flushed."""
+    entries = _read_journal(room_id)
+    if not entries:
+        return
+    engine_seq = GameRoom.objects.filter(id=room_id).values_list('engine_seq', flat=True).first()
+    if engine_seq is None:
+        os.remove(_journal_path(room_id))
+        return
+    pending = [e for e in entries if e['n'] > engine_seq]
+    if pending:
+        logger.warning("Replaying %d journal entries for room %s", len(pending), room_id)
+        persist_entries(room_id, pending)
+    os.remove(_journal_path(room_id))
+
+
+class RoomActor:
+    """Owns one room's state on the event loop. Commands are plain methods (no awaits),
+    so each runs atomically with respect to every other command for the room."""
+
+    def __init__(self, room, players, guesses, reserved):
+        self.room = room
+        self.room_id = str(room.id)
+        self.group = f'game_{self.room_id}'
+        self.players = players  # join order
+        self.guesses = guesses  # serialized, oldest first
+        # Top of the block of room versions this actor reserved; it uses the ones below
+        self.reserved = reserved
+        self.version = reserved - VERSION_BLOCK + 1
+        self.seq = room.engine_seq
+        self.unflushed = []
+        self.sockets = 0
+        self.flush_task = None
+        self.flush_lock = asyncio.Lock()
+        self.turn_timer = None
+        self._snapshot = None
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        self.journal = open(_journal_path(self.room_id), 'a')
+
+    @classmethod
+    def load(cls, room_id):
+        """Load a room from the database (sync; replays any leftover journal first)."""
+        replay_journal(room_id)
+        # The players and their room in one query, as build_room_snapshot() does
+        players = list(
+            Player.objects.filter(room_id=room_id)
+            .select_related('room__team_a_set_by', 'room__team_b_set_by')
+            .order_by('joined_at')
+        )
+        if players:
+            room = players[0].room
+            for player in players:
+                player.room = room
+        else:
+            room = GameRoom.objects.select_related('team_a_set_by', 'team_b_set_by').get(id=room_id)
+        guesses = [
+            serialize_guess(guess)
+            for guess in Guess.objects.filter(room=room).select_related('player', 'target_player').order_by('timestamp')
+        ]
+        return cls(room, players, guesses, bump_room_version(room_id, VERSION_BLOCK))
+
+    # --- Snapshots & events ---
+
+    def snapshot(self):
+        if self._snapshot is None or self._snapshot['version'] != self.version:
+            self._snapshot = snapshot_from(self.room, self.players, list(self.guesses), self.version)
+        return self._snapshot
+
+    def _next_version(self):
+        """Move to the room's next version (delta sequence number).
+
+        Versions come from the shared counter (room_state.bump_room_version),
+        reserved VERSION_BLOCK at a time, so they never match the version of a
+        snapshot built from the database, nor one of an earlier actor of the
+        room, and no (room, version) memo key (wire.py, spectators.py) can
+        name two different states. The top of each block is left unused: it
+        is the counter value readers of the cache see. Moving to a new block
+        shows up to delta clients as a gap.
+        """
+        if self.version + 1 >= self.reserved:
+            # A cache round trip on the event loop, once per block
+            self.reserved = bump_room_version(self.room_id, VERSION_BLOCK)
+            self.version = self.reserved - VERSION_BLOCK
+        self.version += 1
+        return self.version
+
+    def _event(self, name, data, private=None):
+        message = {'type': 'room_delta', 'seq': self._next_version(), 'event': name, 'data': data}
+        if private:
+            message['private'] = private
+        return message
+
+    def _turn_changed(self, player):
+        return self._event('turn_changed', {
+            'current_turn_player': player.display_name if player else None,
+            'current_turn_team': self.room.current_turn_team,
+            'turn_start_time': self.room.turn_start_time.isoformat() if self.room.turn_start_time else None,
+        })
+
+    # --- Journal ---
+
+    def _record(self, op, **entry):
+        self.seq += 1
+        entry = {'n': self.seq, 'op': op, **entry}
+        self.journal.write(json.dumps(entry) + '\n')
+        self.journal.flush()
+        if JOURNAL_FSYNC:
+            os.fsync(self.journal.fileno())
+        self.unflushed.append(entry)
+        stats['entries_journaled'] += 1
+        self._schedule_flush()
+
+    @staticmethod
+    def _encode(value):
+        return value.isoformat() if hasattr(value, 'isoformat') else value
+
+    def _save_room(self, *attnames):
+        self._record('room', fields={name: self._encode(getattr(self.room, name)) for name in attnames})
+
+    def _save_player(self, player, *attnames):
+        self._record('player', id=player.id, fields={name: getattr(player, name) for name in attnames})
+
+    def _record_stats(self, deltas, at=None):
+        # Analytics rollup deltas, applied by persist_entries() in the flush transaction
+        self._record('stats', at=(at or timezone.now()).isoformat(), deltas=deltas)
+
+    # --- Write-behind ---
+
+    def _schedule_flush(self):
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(FLUSH_INTERVAL)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        async with self.flush_lock:
+            entries = list(self.unflushed)
+            if not entries:
+                return
+            try:
+                await database_sync_to_async(persist_entries)(self.room_id, entries)
+            except Exception:
+                stats['flush_errors'] += 1
+                logger.exception("Flushing room %s failed; entries stay journaled", self.room_id)
+                self._schedule_flush()
+                return
+            stats['flushes'] += 1
+            stats['entries_flushed'] += len(entries)
+            self.unflushed = self.unflushed[len(entries):]
+            self._rewrite_journal()
+
+    def _rewrite_journal(self):
+        self.journal.close()
+        path = _journal_path(self.room_id)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for entry in self.unflushed:
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.journal = open(path, 'a')
+
+    # --- Lifecycle ---
+
+    async def attach(self, user_id):
+        """Register a socket; picks up what join_room (REST) wrote since the load."""
+        self.sockets += 1
+        rows = await database_sync_to_async(
+            lambda: list(Player.objects.filter(room_id=self.room_id).select_related('room').order_by('joined_at'))
+        )()
+        if self._merge_joins(rows):
+            # No delta event for joins: the version gap makes delta clients resync
+            self._next_version()
+
+    def _merge_joins(self, rows):
+        """Adopt the room's player rows (with their room) as join_room left them; True if anything changed.
+
+        join_room only sets a missing creator, moves a full room from waiting
+        to setting numbers, assigns missing teams, renames players and adds new
+        ones, so only those changes are taken over: everywhere else the actor's
+        own state, maybe not flushed yet, is newer than the database.
+        """
+        if not rows:
+            return False
+        room = self.room
+        changed = False
+        if room.creator_id is None and rows[0].room.creator_id is not None:
+            room.creator_id = rows[0].room.creator_id
+            changed = True
+        if room.status == GameRoom.WAITING and rows[0].room.status == GameRoom.SETTING_NUMBERS:
+            room.status = GameRoom.SETTING_NUMBERS
+            changed = True
+        known = {p.id: p for p in self.players}
+        for row in rows:
+            player = known.get(row.id)
+            if player is None:
+                self.players.append(row)
+                changed = True
+                continue
+            if player.display_name != row.display_name:
+                player.display_name = row.display_name
+                changed = True
+            if not player.team and row.team:
+                player.team = row.team
+                changed = True
+        return self._backfill_teams() or changed
+
+    async def detach(self):
+        self.sockets -= 1
+        if self.sockets > 0:
+            return
+        _actors.pop(self.room_id, None)
+        task = asyncio.ensure_future(self.close())
+        _closing[self.room_id] = task
+        try:
+            await task
+        finally:
+            _closing.pop(self.room_id, None)
+
+    async def close(self):
+        if self.turn_timer:
+            self.turn_timer.cancel()
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+        self.journal.close()
+        if not self.unflushed:
+            os.remove(_journal_path(self.room_id))
+
+    # --- Turn timers ---
+
+    def arm_turn_timer(self):
+        if self.turn_timer:
+            self.turn_timer.cancel()
+            self.turn_timer = None
+        room = self.room
+        if room.status != GameRoom.PLAYING or not room.turn_start_time or not room.turn_time_limit:
+            return
+        start = room.turn_start_time
+        remaining = room.turn_time_limit - (timezone.now() - start).total_seconds()
+        loop = asyncio.get_running_loop()
+        self.turn_timer = loop.call_later(max(remaining, 0), lambda: asyncio.ensure_future(self._turn_expired(start)))
+
+    async def _turn_expired(self, start):
+        if self.room.turn_start_time != start or self.room.status != GameRoom.PLAYING:
+            return
+        channel_layer = get_channel_layer()
+        await metrics.group_send(channel_layer, self.group, turn_timeout_message())
+        loop = asyncio.get_running_loop()
+        self.turn_timer = loop.call_later(SKIP_GRACE_SECONDS, lambda: asyncio.ensure_future(self._skip_expired(start)))
+
+    async def _skip_expired(self, start):
+        events, next_player = self.skip_turn(start)
+        if not events:
+            return
+        channel_layer = get_channel_layer()
+        for event in events:
+            await metrics.group_send(channel_layer, self.group, event)
+        await metrics.group_send(
+            channel_layer, self.group, turn_skipped_message(self.room.current_turn_team, next_player.display_name)
+        )
+        for group, message in room_state_sends(self.room_id, self.snapshot()):
+            await metrics.group_send(channel_layer, group, message)
+
+    # --- Commands: each returns (ok, message, events) ---
+
+    def _player_for(self, user_id):
+        return next((p for p in self.players if p.user_id == user_id), None)
+
+    def player_team(self, user_id):
+        """The user's team as of the last command (the database may lag behind); None if not a player."""
+        player = self._player_for(user_id)
+        return player.team if player else None
+
+    def _backfill_teams(self):
+        a_count = sum(1 for p in self.players if p.team == 'A')
+        b_count = sum(1 for p in self.players if p.team == 'B')
+        changed = False
+        for p in self.players:
+            if not p.team:
+                p.team = 'A' if a_count <= b_count else 'B'
+                if p.team == 'A':
+                    a_count += 1
+                else:
+                    b_count += 1
+                self._save_player(p, 'team')
+                changed = True
+        return changed
+
+    def set_secret_number(self, user_id, number):
+        stats['commands'] += 1
+        room = self.room
+        player = self._player_for(user_id)
+        if player is None:
+            return False, "Player not found", []
+        if not player.validate_secret_number(number):
+            return False, "Invalid secret number. Must be 4 unique digits.", []
+        team = player.team or 'A'
+        if team == 'A' and room.team_a_secret:
+            return False, "Team A secret already set", []
+        if team == 'B' and room.team_b_secret:
+            return False, f"Team {team} secret already set", []
+
+        if team == 'A':
+            room.team_a_secret = number
+            room.team_a_set_by = player
+        else:
+            room.team_b_secret = number
+            room.team_b_set_by = player
+        self._save_room('team_a_secret', 'team_b_secret', 'team_a_set_by_id', 'team_b_set_by_id')
+        for teammate in self.players:
+            if teammate.team == team and teammate.secret_number != number:
+                teammate.secret_number = number
+                self._save_player(teammate, 'secret_number')
+        events = [self._event(
+            'secret_set',
+            {'team': team, 'set_by_username': player.display_name},
+            private={'secret_number': number},
+        )]
+
+        # If both secrets set move to PLAYING and init first turn (Team A first)
+        if room.status in (GameRoom.SETTING_NUMBERS, GameRoom.WAITING) and room.team_a_secret and room.team_b_secret:
+            self._record_stats(analytics.status_change(room.status, GameRoom.PLAYING))
+            room.status = GameRoom.PLAYING
+            room.started_at = timezone.now()
+            first_a = next((p for p in self.players if p.team == 'A'), None)
+            if first_a:
+                room.current_turn_player_id = first_a.user_id
+                room.current_turn_team = 'A'
+                room.turn_start_time = room.started_at
+                room.turn_deadline = room.deadline_for(room.turn_start_time)
+            self._save_room(
+                'status', 'started_at', 'current_turn_player_id', 'current_turn_team', 'turn_start_time', 'turn_deadline'
+            )
+            events.append(self._event('status_changed', {'status': room.status}))
+            if first_a:
+                events.append(self._turn_changed(first_a))
+            self.arm_turn_timer()
+        return True, "Team secret set", events
+
+    def make_guess(self, user_id, guess_number, target_player_id=None):
+        stats['commands'] += 1
+        room = self.room
+        if room.status != GameRoom.PLAYING:
+            return False, "Game is not in progress", []
+        player = self._player_for(user_id)
+        if player is None:
+            return False, "Invalid guess", []
+        if self._backfill_teams():
+            # No delta event for backfills: the version gap makes delta clients resync
+            self._next_version()
+
+        if room.current_turn_player_id != user_id:
+            return False, "Not your turn", []
+        if not isinstance(guess_number, str) or len(guess_number) != 4 or not guess_number.isdigit():
+            return False, "Invalid guess format", []
+
+        if not target_player_id:
+            target_team = 'B' if player.team == 'A' else 'A'
+            target_player = next((p for p in self.players if p.team == target_team), None)
+        else:
+            try:
+                target_id = int(target_player_id)
+            except (TypeError, ValueError):
+                return False, "Invalid guess", []
+            target_player = next((p for p in self.players if p.id == target_id), None)
+            if target_player is None:
+                return False, "Invalid guess", []
+        if not target_player:
+            return False, "No opponent available to target", []
+
+        strikes, balls = Guess.calculate_feedback(target_player.secret_number, guess_number)
+        is_correct = strikes == 4
+        self._record('guess', fields={
+            'player_id': player.id,
+            'target_player_id': target_player.id,
+            'guess_number': guess_number,
+            'strikes': strikes,
+            'balls': balls,
+            'is_correct': is_correct,
+        })
+        guess = {
+            'player': player.display_name,
+            'target_player': target_player.display_name,
+            'player_id': player.id,
+            'target_player_id': target_player.id,
+            'guess': guess_number,
+            'strikes': strikes,
+            'balls': balls,
+            'is_correct': is_correct,
+            'timestamp': timezone.now().isoformat()
+        }
+        self.guesses.append(guess)
+        events = [self._event('guess_added', guess)]
+
+        if is_correct:
+            player.is_winner = True
+            self._save_player(player, 'is_winner')
+            now = timezone.now()
+            self._record_stats(analytics.game_finished(room, len(self.guesses), now), now)
+            room.status = GameRoom.FINISHED
+            room.finished_at = now
+            self._save_room('status', 'finished_at')
+            events.append(self._event('status_changed', {
+                'status': room.status,
+                'winner_username': player.display_name,
+                'winner_team': player.team,
+                'team_secrets': {'A': room.team_a_secret, 'B': room.team_b_secret},
+            }))
+            self.arm_turn_timer()
+        else:
+            next_player = self._advance_turn(fallback=player)
+            events.append(self._turn_changed(next_player))
+            self.arm_turn_timer()
+        return True, "Guess recorded", events
+
+    def _advance_turn(self, fallback=None, sequential_fallback=False):
+        """Hand the turn to the next player of the other team; returns that player."""
+        room = self.room
+        players = self.players
+        current_index = next((i for i, p in enumerate(players) if p.user_id == room.current_turn_player_id), None)
+        if current_index is None:
+            current_index = next((i for i, p in enumerate(players) if fallback and p.id == fallback.id), 0)
+        current_team = players[current_index].team
+        n = len(players)
+        next_player = None
+        for step in range(1, n + 1):
+            candidate = players[(current_index + step) % n]
+            if candidate.team != current_team:
+                next_player = candidate
+                break
+        if next_player is None and sequential_fallback:
+            next_player = players[(current_index + 1) % n]
+        if next_player:
+            room.current_turn_player_id = next_player.user_id
+            room.current_turn_team = next_player.team
+        room.turn_start_time = timezone.now()
+        room.turn_deadline = room.deadline_for(room.turn_start_time)
+        self._save_room('current_turn_player_id', 'current_turn_team', 'turn_start_time', 'turn_deadline')
+        return next_player
+
+    def skip_turn(self, expected_start):
+        """Skip an expired turn (mirrors tasks.skip_turn); returns (events, next_player)."""
+        room = self.room
+        if room.status != GameRoom.PLAYING or room.turn_start_time != expected_start or not self.players:
+            return [], None
+        next_player = self._advance_turn(sequential_fallback=True)
+        self.arm_turn_timer()
+        return [self._turn_changed(next_player)], next_player
+
+    def change_team(self, user_id, desired_team):
+        stats['commands'] += 1
+        room = self.room
+        player = self._player_for(user_id)
+        if player is None:
+            return False, "Player not found", []
+        if room.status != GameRoom.SETTING_NUMBERS and room.status != GameRoom.WAITING:
+            return False, "Cannot change teams after game has started", []
+        if player.secret_number:
+            return False, "Cannot change team after setting secret number", []
+        if desired_team not in ('A', 'B'):
+            return False, "Invalid team", []
+        if player.team == desired_team:
+            return True, "Already on that team", []
+        player.team = desired_team
+        self._save_player(player, 'team')
+        return True, "Team changed", [self._event('team_changed', {'player_id': player.id, 'team': desired_team})]
+
+    def start_game(self, user_id):
+        stats['commands'] += 1
+        room = self.room
+        events = []
+        if not room.creator_id:
+            first_player = self.players[0] if self.players else None
+            if first_player and first_player.user_id == user_id:
+                room.creator_id = user_id
+                self._save_room('creator_id')
+                # No delta event for creator changes: the version gap makes delta clients resync
+                self._next_version()
+            else:
+                return False, "Only the room creator can start the game", events
+        elif room.creator_id != user_id:
+            return False, "Only the room creator can start the game", events
+        if room.status not in (GameRoom.WAITING, GameRoom.SETTING_NUMBERS):
+            return False, "Game already started", events
+        has_a = any(p.team == 'A' for p in self.players)
+        has_b = any(p.team == 'B' for p in self.players)
+        if not (has_a and has_b):
+            return False, "Need at least one player on each team", events
+        if room.status == GameRoom.WAITING:
+            self._record_stats(analytics.status_change(room.status, GameRoom.SETTING_NUMBERS))
+            room.status = GameRoom.SETTING_NUMBERS
+            self._save_room('status')
+            events.append(self._event('status_changed', {'status': room.status}))
+        return True, "Game started - set team secrets", events
+
+
+async def get_actor(room_id):
+    """Return the room's actor, loading it (once) if this process does not own it yet."""
+    room_id = str(room_id)
+    actor = _actors.get(room_id)
+    if actor is not None:
+        return actor
+    closing = _closing.get(room_id)
+    if closing is not None:
+        # Let the previous actor finish flushing before the room is reloaded
+        await asyncio.shield(closing)
+    task = _loading.get(room_id)
+    if task is None:
+        task = asyncio.ensure_future(database_sync_to_async(RoomActor.load)(room_id))
+        _loading[room_id] = task
+    try:
+        actor = await task
+    finally:
+        _loading.pop(room_id, None)
+    if room_id not in _actors:
+        _actors[room_id] = actor
+        actor.arm_turn_timer()
+    return _actors[room_id]
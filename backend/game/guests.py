@@ -0,0 +1,200 @@
+"""Guest identities: device id -> auth_user row, cached.
+
+Every guest is a Django User named ``g:<device_id>`` (display names live on
+Player). Resolving one used to be a get_or_create (plus a second save() for
+new guests) on every WebSocket handshake and join, which a reconnect storm
+after a deploy turns into a burst of auth_user reads.
+
+get_guest() first asks an identity cache for the user id:
+
+- GUEST_IDENTITY_CACHE = 'local' (default): a bounded in-process LRU of
+  GUEST_CACHE_SIZE entries, each trusted for GUEST_CACHE_TTL seconds;
+- 'shared': the Django cache (Redis) with the same TTL, shared by all processes;
+- 'off': no cache.
+
+A hit costs no query and returns an unsaved-looking User carrying only id and
+username (enough for FKs, ids and names). A miss reads the row once, and a new
+guest is created with a single INSERT (password already unusable).
+
+Deleting a guest User (any path that sends post_delete, e.g. retention) calls
+forget_guest() through the signal hook installed by GameConfig.ready();
+retention also forgets the guests it purges itself. Local caches of other
+processes keep a purged id until the TTL, so the write paths that store a
+guest's id (join_room) re-resolve it with refresh_guest() when the INSERT
+fails on the missing User.
+
+Guest tokens: join_room and rematch also hand out issue_token(user), an
+HMAC-signed (SECRET_KEY, TimestampSigner) "<user id>:<username>" valid for
+GUEST_TOKEN_MAX_AGE seconds, and never longer than the guest retention
+horizon (RETENTION_GUEST_DAYS). The WebSocket middleware checks it with
+user_from_token() and needs no database access at all for the handshake. A
+token only proves who the guest is; room membership is still checked against
+Player rows, so a token outliving its user (see retention.purge_orphan_guests)
+just fails that check and the client joins again for a fresh one.
+
+Lookups are counted in numdle_guest_identity_lookups_total by result (hit,
+miss, created, token, bad_token).
+"""
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core import signing
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from . import metrics
+
+GUEST_IDENTITY_CACHE = getattr(settings, 'GUEST_IDENTITY_CACHE', 'local')
+GUEST_CACHE_SIZE = getattr(settings, 'GUEST_CACHE_SIZE', 10000)
+GUEST_CACHE_TTL = getattr(settings, 'GUEST_CACHE_TTL', 300)
+GUEST_TOKEN_MAX_AGE = getattr(settings, 'GUEST_TOKEN_MAX_AGE', 30 * 24 * 60 * 60)
+# Tokens are not accepted past the age at which retention may purge their guest
+TOKEN_MAX_AGE = min(GUEST_TOKEN_MAX_AGE, getattr(settings, 'RETENTION_GUEST_DAYS', 30) * 24 * 60 * 60)
+
+_TOKEN_SALT = 'numdle.guest'
+
+
+def guest_username(device_id):
+    return f"g:{device_id}"[:150]
+
+
+class LRUCache:
+    """Thread-safe bounded mapping whose entries expire after `ttl` seconds."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_local = LRUCache(GUEST_CACHE_SIZE, GUEST_CACHE_TTL)
+
+
+def _key(username):
+    return f'guest:{username}'
+
+
+def _cached_id(username):
+    if GUEST_IDENTITY_CACHE == 'local':
+        return _local.get(username)
+    if GUEST_IDENTITY_CACHE == 'shared':
+        return cache.get(_key(username))
+    return None
+
+
+def _remember(username, user_id):
+    if GUEST_IDENTITY_CACHE == 'local':
+        _local.set(username, user_id)
+    elif GUEST_IDENTITY_CACHE == 'shared':
+        cache.set(_key(username), user_id, timeout=GUEST_CACHE_TTL)
+
+
+def forget_guest(username):
+    """Invalidate a cached identity (the User row was deleted or renamed)."""
+    forget_guests([username])
+
+
+def forget_guests(usernames):
+    """forget_guest() for several identities, with one shared-cache round trip."""
+    for username in usernames:
+        _local.discard(username)
+    if GUEST_IDENTITY_CACHE == 'shared' and usernames:
+        cache.delete_many([_key(username) for username in usernames])
+
+
+def clear_guest_cache():
+    """Drop this process's cached identities (tests, or after restoring the database)."""
+    _local.clear()
+
+
+def on_user_deleted(sender, instance, **kwargs):
+    """post_delete receiver for User (connected in GameConfig.ready())."""
+    forget_guest(instance.username)
+
+
+def guest_user(user_id, username):
+    """A User for a known guest id, built without a query (id and username only)."""
+    user = User(id=user_id, username=username)
+    user._state.adding = False
+    user._state.db = DEFAULT_DB_ALIAS
+    return user
+
+
+def _create(username):
+    user = User(username=username)
+    user.set_unusable_password()
+    try:
+        with transaction.atomic():
+            user.save(force_insert=True)
+    except IntegrityError:
+        # Created concurrently by another request
+        return User.objects.only('id', 'username').get(username=username), False
+    return user, True
+
+
+def get_guest(username):
+    """The guest User for `username` (see guest_username()), created if needed."""
+    user_id = _cached_id(username)
+    if user_id is not None:
+        metrics.guest_identity_lookups.inc('hit')
+        return guest_user(user_id, username)
+    user = User.objects.only('id', 'username').filter(username=username).first()
+    created = False
+    if user is None:
+        user, created = _create(username)
+    metrics.guest_identity_lookups.inc('created' if created else 'miss')
+    _remember(username, user.id)
+    return user
+
+
+def refresh_guest(user):
+    """The current guest User for `user`'s username, bypassing a cached id whose row may have been purged."""
+    forget_guest(user.username)
+    return get_guest(user.username)
+
+
+def issue_token(user):
+    """Signed guest token for `user` (see user_from_token())."""
+    return signing.TimestampSigner(salt=_TOKEN_SALT).sign(f'{user.id}:{user.username}')
+
+
+def user_from_token(token):
+    """The guest User a valid, unexpired token was issued for, else None; no database access."""
+    try:
+        value = signing.TimestampSigner(salt=_TOKEN_SALT).unsign(token, max_age=TOKEN_MAX_AGE)
+        user_id, username = value.split(':', 1)
+        user = guest_user(int(user_id), username)
+    except (signing.BadSignature, ValueError):
+        metrics.guest_identity_lookups.inc('bad_token')
+        return None
+    metrics.guest_identity_lookups.inc('token')
+    return user
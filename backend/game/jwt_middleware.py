@@ -1,17 +1,21 @@
 from urllib.parse import parse_qs
-from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.auth.models import AnonymousUser
 from channels.db import database_sync_to_async
 import re
+from .guests import get_guest, guest_username, user_from_token
 
 
 class JWTAuthMiddleware:
     """Guest-only middleware with device identity.
 
     Accepts one of:
+      - ?guest_token=<signed token from join_room/rematch> (checked without database access)
       - ?guest_id=<uuid>&name=<displayName>
       - (legacy) ?guest=<displayName>
 
     Internal auth_user.username becomes 'g:<guest_id>' while display name lives on Player.display_name.
+    Identities are resolved through the guest identity cache (guests.py), so a
+    reconnecting device normally costs no query.
     """
 
     GUEST_ID_RE = re.compile(r"^[a-fA-F0-9-]{8,36}$")
@@ -23,17 +27,17 @@ class JWTAuthMiddleware:
         try:
             query_string = scope.get("query_string", b"").decode()
             params = parse_qs(query_string)
+            tokens = params.get("guest_token", [])
             guest_ids = params.get("guest_id", [])
             names = params.get("name", [])
             legacy = params.get("guest", [])  # legacy fallback
 
-            user = None
-            if guest_ids:
+            user = user_from_token(tokens[0]) if tokens else None
+            if user is None and guest_ids:
                 raw_id = guest_ids[0][:36]
                 if self.GUEST_ID_RE.match(raw_id):
-                    internal_username = f"g:{raw_id}"[:150]
-                    user = await self._get_or_create_guest(internal_username)
-            elif legacy:
+                    user = await self._get_or_create_guest(guest_username(raw_id))
+            elif user is None and legacy:
                 # Fallback legacy mode
                 legacy_name = legacy[0][:30]
                 if legacy_name:
@@ -46,8 +50,4 @@ class JWTAuthMiddleware:
     @staticmethod
     @database_sync_to_async
     def _get_or_create_guest(username: str):
-        user, created = User.objects.get_or_create(username=username)
-        if created:
-            user.set_unusable_password()
-            user.save(update_fields=['password'])
-        return user
+        return get_guest(username)
@@ -0,0 +1,152 @@
+"""Lobby listing (GET /api/rooms/ and ws/lobby/): keyset pages of open rooms, cached briefly.
+
+A page is one annotated query (player count and creator name included) over
+rooms still waiting for players, newest first. Pages are addressed by an
+opaque cursor (created_at, id of the last room shown), so deep pages cost the
+same as the first one and concurrent inserts never shift rows between pages.
+
+Rendered pages are cached for LOBBY_CACHE_TTL seconds under their normalized
+query string together with an ETag. Every lobby event (below) bumps a lobby
+generation counter that is read with the page in one cache round trip, so
+those changes show up immediately; anything else (e.g. a rejoining player's
+new name) at the latest after the TTL.
+
+Live lobby: LobbyConsumer (ws/lobby/) sends one snapshot page on connect and
+then every lobby event published to the 'lobby' group by the room write
+paths:
+
+- room_created: a full room row (as in the listing);
+- room_updated: ``id`` plus the fields that changed (``player_count``, ``status``);
+- room_closed: ``id`` of a room that left the lobby (game started or room deleted).
+
+publish() bumps the lobby generation before sending, so a snapshot built
+after an event always includes it; events are upserts/removals and may be
+re-applied safely.
+"""
+import hashlib
+import json
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.utils.http import parse_etags
+from . import metrics
+from .models import GameRoom, Player
+from .pagination import InvalidQuery, bool_param, decode_cursor, int_param, keyset_page
+
+LOBBY_CACHE_TTL = getattr(settings, 'LOBBY_CACHE_TTL', 2)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+LOBBY_STATUSES = (GameRoom.WAITING, GameRoom.SETTING_NUMBERS)
+LOBBY_GROUP = 'lobby'
+
+_GENERATION_KEY = 'lobby:generation'
+
+
+def bump_lobby_generation():
+    """Invalidate cached lobby pages (done by publish())."""
+    try:
+        cache.incr(_GENERATION_KEY)
+    except ValueError:
+        cache.add(_GENERATION_KEY, 0, timeout=None)
+        cache.incr(_GENERATION_KEY)
+
+
+def parse_query(params):
+    """Normalized lobby query from request.GET; raises InvalidQuery."""
+    query = {
+        'limit': int_param(params, 'limit', 1, MAX_PAGE_SIZE) or DEFAULT_PAGE_SIZE,
+        'min_players': int_param(params, 'min_players', 0, 10),
+        'max_players': int_param(params, 'max_players', 0, 10),
+        'has_space': bool_param(params, 'has_space'),
+        'private': bool_param(params, 'private'),
+        'cursor': params.get('cursor') or None,
+    }
+    if query['cursor']:
+        decode_cursor(query['cursor'])
+    return query
+
+
+def build_page(query):
+    """One page of lobby rooms as a JSON-ready dict (a single SQL query)."""
+    creator_name = Player.objects.filter(room=OuterRef('pk'), user=OuterRef('creator')).values('display_name')[:1]
+    rooms = GameRoom.objects.filter(status__in=LOBBY_STATUSES).annotate(
+        player_count=Count('players'),
+        creator_username=Subquery(creator_name),
+    )
+    if query['private'] is not None:
+        rooms = rooms.filter(is_private=query['private'])
+    if query['min_players'] is not None:
+        rooms = rooms.filter(player_count__gte=query['min_players'])
+    if query['max_players'] is not None:
+        rooms = rooms.filter(player_count__lte=query['max_players'])
+    if query['has_space'] is not None:
+        space = Q(player_count__lt=F('max_players'))
+        rooms = rooms.filter(space if query['has_space'] else ~space)
+    page, next_cursor = keyset_page(rooms, query['cursor'], query['limit'])
+    return {
+        'rooms': [room_summary(r, r.player_count, r.creator_username) for r in page],
+        'next_cursor': next_cursor,
+    }
+
+
+def room_summary(room, player_count, creator_username=None):
+    """A room's lobby row."""
+    return {
+        'id': str(room.id),
+        'name': room.name,
+        'status': room.status,
+        'player_count': player_count,
+        'max_players': room.max_players,
+        'turn_time_limit': room.turn_time_limit,
+        'created_at': room.created_at.isoformat(),
+        'creator_username': creator_username,
+        'is_private': room.is_private,
+    }
+
+
+def get_page(query):
+    """(etag, JSON body bytes) of a lobby page, from the cache when still current."""
+    key = 'lobby:page:' + hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()
+    cached = cache.get_many([_GENERATION_KEY, key])
+    generation = cached.get(_GENERATION_KEY, 0)
+    entry = cached.get(key)
+    if entry and entry[0] == generation:
+        return entry[1], entry[2]
+    body = json.dumps(build_page(query)).encode()
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    cache.set(key, (generation, etag, body), timeout=LOBBY_CACHE_TTL)
+    return etag, body
+
+
+def etag_matches(etag, if_none_match):
+    """Whether an If-None-Match header value lists `etag` (weak comparison, as RFC 9110 asks for GET)."""
+    tags = parse_etags(if_none_match or '')
+    return '*' in tags or etag in (tag.removeprefix('W/') for tag in tags)
+
+
+# --- Live lobby events ---
+
+def lobby_message(event, room):
+    return {'type': 'lobby_event', 'event': event, 'room': room}
+
+
+async def publish(channel_layer, event, room):
+    """Invalidate cached lobby pages and send one event to every lobby socket."""
+    await sync_to_async(bump_lobby_generation)()
+    await metrics.group_send(channel_layer, LOBBY_GROUP, lobby_message(event, room))
+
+
+def publish_from_sync(event, room):
+    """publish() for views and other sync code."""
+    bump_lobby_generation()
+    async_to_sync(metrics.group_send)(get_channel_layer(), LOBBY_GROUP, lobby_message(event, room))
+
+
+async def publish_status(channel_layer, room_id, status):
+    """Lobby event for a room's status_changed delta; finished games have left the lobby already."""
+    if status in LOBBY_STATUSES:
+        await publish(channel_layer, 'room_updated', {'id': str(room_id), 'status': status})
+    elif status == GameRoom.PLAYING:
+        await publish(channel_layer, 'room_closed', {'id': str(room_id)})
@@ -0,0 +1,116 @@
+"""CPU cost of fanning room broadcasts out to a room's sockets.
+
+Compares, per room size, the two ways a broadcast reaches N sockets in one
+process:
+
+- per-socket: every socket builds and encodes its own copy of the frame
+  (what the handlers did before wire.prepare());
+- pre-encoded: the sender encodes each frame once per format
+  (wire.prepare()) and sockets forward it; personalized room states are
+  encoded once per set of visible secrets (encode_shared()).
+
+A broadcast here is one room_state_update, one guess_added room_delta and one
+game_message, with both team secrets set. Only encoding and personalization
+are timed (no channel layer, no socket I/O):
+
+    python manage.py bench_broadcast --sizes 2,8,32,128 --guesses 40 --compact 0.5
+"""
+import time
+import uuid
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from game import wire
+from game.models import GameRoom, Player
+from game.room_state import personalize, revealed_secrets, room_state_sends, snapshot_from
+
+
+def bench_snapshot(sockets, guesses):
+    now = timezone.now()
+    room = GameRoom(
+        id=uuid.uuid4(), name='bench', status=GameRoom.PLAYING, max_players=sockets,
+        team_a_secret='1234', team_b_secret='5678', current_turn_team='A', turn_start_time=now,
+    )
+    players = [
+        Player(id=i + 1, user_id=i + 1, display_name=f'player{i}', team='AB'[i % 2], secret_number=('1234', '5678')[i % 2])
+        for i in range(sockets)
+    ]
+    history = [{
+        'player': f'player{i % sockets}', 'target_player': f'player{(i + 1) % sockets}',
+        'player_id': i % sockets + 1, 'target_player_id': (i + 1) % sockets + 1,
+        'guess': f'{i % 10000:04d}', 'strikes': i % 3, 'balls': i % 2, 'is_correct': False,
+        'timestamp': (now - timedelta(seconds=guesses - i)).isoformat(),
+    } for i in range(guesses)]
+    return snapshot_from(room, players, history, 0)
+
+
+def versioned(snapshot, version):
+    return {**snapshot, 'version': version, 'state': {**snapshot['state'], 'version': version}}
+
+
+class Command(BaseCommand):
+    help = 'Measure CPU per room broadcast: per-socket encoding vs pre-encoded frames (wire.prepare).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='2,8,32,128', help='Comma-separated sockets per room.')
+        parser.add_argument('--guesses', type=int, default=40, help='Guesses in the room state.')
+        parser.add_argument('--rounds', type=int, default=200, help='Broadcasts timed per size and path.')
+        parser.add_argument('--compact', type=float, default=0.0, help='Share of sockets on the compact format.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'sockets':>8} {'per-socket us':>14} {'pre-encoded us':>15} {'speedup':>8}")
+        # Versions stay unique across runs so no memoized encoding is reused between broadcasts
+        self.version = 0
+        for size in (int(s) for s in options['sizes'].split(',')):
+            snapshot = bench_snapshot(size, options['guesses'])
+            compact = round(size * options['compact'])
+            sockets = [(i + 1, wire.COMPACT if i < compact else wire.JSON) for i in range(size)]
+            before = self.run(self.per_socket, snapshot, sockets, options['rounds'])
+            after = self.run(self.pre_encoded, snapshot, sockets, options['rounds'])
+            self.stdout.write(f'{size:>8} {before:>14.1f} {after:>15.1f} {before / after:>7.1f}x')
+
+    def run(self, fanout, snapshot, sockets, rounds):
+        start = time.process_time()
+        for _ in range(rounds):
+            self.version += 1
+            messages = [
+                versioned(snapshot, self.version),
+                room_event_message(snapshot, self.version),
+                {'type': 'game_message', 'message': 'Turn skipped. Team B now.'},
+            ]
+            fanout(messages, sockets)
+        return (time.process_time() - start) / rounds * 1e6
+
+    @staticmethod
+    def per_socket(messages, sockets):
+        snapshot, delta, message = messages
+        for user_id, codec in sockets:
+            codec.encode({'type': 'room_state_update', 'data': personalize(snapshot, user_id)})
+            codec.encode(wire.client_frame(delta))
+            codec.encode(wire.client_frame(message))
+
+    @staticmethod
+    def pre_encoded(messages, sockets):
+        snapshot, delta, message = messages
+        # Room group copy under None, team group copies under their team
+        states = {
+            state.get('team'): wire.prepare(state) for _, state in room_state_sends(snapshot['state']['room_id'], snapshot)
+        }
+        delta, message = wire.prepare(delta), wire.prepare(message)
+        for user_id, codec in sockets:
+            # As GameConsumer.room_state_update (bench_snapshot() puts user i on team 'AB'[(i - 1) % 2])
+            state = states.get('AB'[(user_id - 1) % 2], states[None])
+            copy = state['snapshot']
+            revealed = revealed_secrets(copy, user_id)
+            if revealed:
+                key = ('room_state', copy['state']['room_id'], copy['version'], len(copy['state']['guesses']), revealed)
+                wire.encode_shared(codec, key, {'type': 'room_state_update', 'data': personalize(copy, user_id, revealed)})
+            else:
+                state['frames'][codec.name]
+            delta['frames'][codec.name]
+            message['frames'][codec.name]
+
+
+def room_event_message(snapshot, seq):
+    """A guess_added delta like room_event() builds, without bumping a cached room version."""
+    return {'type': 'room_delta', 'seq': seq, 'event': 'guess_added', 'data': snapshot['state']['guesses'][-1]}
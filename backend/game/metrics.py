@@ -0,0 +1,319 @@
+"""Prometheus metrics for /api/metrics/ (text exposition format 0.0.4).
+
+Metrics are plain in-process counters and fixed-bucket histograms: recording
+one is a dict lookup and a few additions under a lock, cheap enough to leave on
+in production. Every ASGI process serves its own values, so scrape each
+process (or each pod) separately.
+
+Celery task lag is recorded by the worker processes, so those histograms live
+in the shared cache instead (one incr per bucket touched) and are read back
+with a single get_many per scrape.
+"""
+import bisect
+import threading
+import time
+from django.core.cache import cache
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from . import wire
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LAG_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LAG_TASKS = ('game.tasks.check_turn_timeout', 'game.tasks.skip_turn')
+LAG_TTL = 7 * 24 * 60 * 60
+
+_registry = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [(self.name, labels, (), value) for labels, value in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class CallbackMetric:
+    """Single-sample metric read at scrape time (e.g. from a module's stats dict)."""
+
+    def __init__(self, name, help_text, read, kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        self.kind = kind
+        self.labels = ()
+        _registry.append(self)
+
+    def samples(self):
+        return [(self.name, (), (), self.read())]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            row = self.values.get(label_values)
+            if row is None:
+                row = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            row[index] += 1
+            row[-1] += value
+
+    def samples(self):
+        with self.lock:
+            items = sorted((labels, list(row)) for labels, row in self.values.items())
+        return [sample for labels, row in items for sample in self._expand(labels, row[:-1], row[-1])]
+
+    def _expand(self, labels, counts, total):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), counts):
+            cumulative += count
+            le = bound if bound == '+Inf' else _format_value(bound)
+            yield (f'{self.name}_bucket', labels, (('le', le),), cumulative)
+        yield (f'{self.name}_sum', labels, (), total)
+        yield (f'{self.name}_count', labels, (), cumulative)
+
+
+class SharedHistogram(Histogram):
+    """Histogram kept in the shared cache so every process (Celery workers too) adds to it."""
+
+    def __init__(self, name, help_text, label, label_values, buckets):
+        super().__init__(name, help_text, labels=(label,), buckets=buckets)
+        self.label_values = label_values
+
+    def _key(self, label_value, slot):
+        return f'metrics:{self.name}:{label_value}:{slot}'
+
+    def observe(self, value, label_value):
+        index = bisect.bisect_left(self.buckets, value)
+        for slot, amount in ((index, 1), ('sum_us', int(value * 1_000_000))):
+            key = self._key(label_value, slot)
+            try:
+                cache.incr(key, amount)
+            except ValueError:
+                cache.add(key, 0, timeout=LAG_TTL)
+                cache.incr(key, amount)
+
+    def samples(self):
+        slots = [*range(len(self.buckets) + 1), 'sum_us']
+        keys = [self._key(v, slot) for v in self.label_values for slot in slots]
+        stored = cache.get_many(keys)
+        samples = []
+        for v in self.label_values:
+            counts = [stored.get(self._key(v, slot), 0) for slot in slots[:-1]]
+            total = stored.get(self._key(v, 'sum_us'), 0) / 1_000_000
+            samples.extend(self._expand((v,), counts, total))
+        return samples
+
+
+def render():
+    """All registered metrics in Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, extra, value in metric.samples():
+            lines.append(f'{name}{_format_labels(metric.labels, labels, extra)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- WebSocket / channel layer ---
+
+ws_messages = Counter('numdle_ws_messages_total', 'GameConsumer messages received, by type.', ('type',))
+ws_message_errors = Counter('numdle_ws_message_errors_total', 'GameConsumer messages whose handler raised, by type.', ('type',))
+ws_message_seconds = Histogram('numdle_ws_message_seconds', 'GameConsumer.receive handling time, by message type.', ('type',))
+ws_message_hops = Histogram(
+    'numdle_ws_message_db_hops',
+    'Thread-pool hops (database_sync_to_async calls) per GameConsumer message, by type.',
+    ('type',), buckets=(0, 1, 2, 3, 4, 6),
+)
+ws_active_sockets = Gauge('numdle_ws_active_sockets', 'Accepted game sockets open in this process.')
+spectator_sockets = Gauge('numdle_spectator_sockets', 'Spectator sockets open in this process.')
+group_send_seconds = Histogram('numdle_group_send_seconds', 'Channel layer group_send latency, by message type.', ('type',))
+
+
+def observe_ws_message(message_type, seconds, failed=False, hops=0):
+    ws_messages.inc(message_type)
+    ws_message_seconds.observe(seconds, message_type)
+    ws_message_hops.observe(hops, message_type)
+    if failed:
+        ws_message_errors.inc(message_type)
+
+
+async def group_send(channel_layer, group, message):
+    """channel_layer.group_send of `message` with its client frame pre-encoded (wire.prepare()).
+
+    Timed, encoding included, into numdle_group_send_seconds.
+    """
+    start = time.perf_counter()
+    try:
+        await channel_layer.group_send(group, wire.prepare(message))
+    finally:
+        group_send_seconds.observe(time.perf_counter() - start, message['type'])
+
+
+# --- Team strategy patches (strategy.py) ---
+
+strategy_patches = Counter(
+    'numdle_strategy_patches_total',
+    'Team strategy patches flushed, by result: applied, rejected (base too old; the sender resyncs).',
+    ('result',),
+)
+strategy_writes = Counter('numdle_strategy_writes_total', 'Team strategy rows written by write-behind flushes.')
+
+
+# --- Guest identities (guests.py) ---
+
+guest_identity_lookups = Counter(
+    'numdle_guest_identity_lookups_total',
+    'Guest identity resolutions, by result: hit (cache), miss (read from auth_user), created, token (signed token), bad_token.',
+    ('result',),
+)
+
+
+# --- ORM ---
+
+# _count is the number of SQL statements this process executed
+db_query_seconds = Histogram('numdle_db_query_seconds', 'SQL statement execution time.')
+db_connects = Counter(
+    'numdle_db_connects_total',
+    'Database connections set up by Django: new connections, or pool checkouts with DB_POOL_MODE=pool.',
+)
+
+
+def count_queries(execute, sql, params, many, context):
+    """Connection execute_wrapper; installed on every new connection by GameConfig.ready()."""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        db_query_seconds.observe(time.perf_counter() - start)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    db_connects.inc()
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+# --- Celery ---
+
+celery_task_lag = SharedHistogram(
+    'numdle_celery_task_lag_seconds',
+    'Delay between a countdown task\'s scheduled time (ETA) and its actual start.',
+    'task', LAG_TASKS, LAG_BUCKETS,
+)
+
+
+def record_task_lag(sender=None, task=None, **kwargs):
+    """celery task_prerun handler."""
+    if task is None or task.name not in LAG_TASKS:
+        return
+    eta = getattr(task.request, 'eta', None)
+    if not eta:
+        return
+    eta = parse_datetime(eta) if isinstance(eta, str) else eta
+    if eta is None:
+        return
+    celery_task_lag.observe(max((timezone.now() - eta).total_seconds(), 0.0), task.name)
+
+
+# --- Existing process-wide stats ---
+
+def _stat_metrics(prefix, stats, help_texts):
+    for key, help_text in help_texts.items():
+        CallbackMetric(f'{prefix}_{key}_total', help_text, lambda key=key: stats[key], kind='counter')
+
+
+def _pool_stat(key, scale=1):
+    def read():
+        from django.db import connection
+        return connection.pool.get_stats().get(key, 0) * scale
+    return read
+
+
+def register_pool_stats():
+    """psycopg pool gauges and counters (DB_POOL_MODE=pool), read from the process's pool at scrape time."""
+    for name, key, kind, help_text in (
+        ('numdle_db_pool_max', 'pool_max', 'gauge', 'Connection pool maximum size.'),
+        ('numdle_db_pool_size', 'pool_size', 'gauge', 'Connections currently open in the pool (idle or in use).'),
+        ('numdle_db_pool_available', 'pool_available', 'gauge', 'Idle connections in the pool.'),
+        ('numdle_db_pool_waiting', 'requests_waiting', 'gauge', 'Requests waiting for a connection right now (saturation).'),
+        ('numdle_db_pool_requests_total', 'requests_num', 'counter', 'Connection checkouts.'),
+        ('numdle_db_pool_queued_total', 'requests_queued', 'counter', 'Checkouts that had to wait for a connection.'),
+        ('numdle_db_pool_timeouts_total', 'requests_errors', 'counter', 'Checkouts that gave up after DB_POOL_TIMEOUT.'),
+        ('numdle_db_pool_connections_total', 'connections_num', 'counter', 'Connections the pool opened.'),
+        ('numdle_db_pool_bad_returns_total', 'returns_bad', 'counter', 'Connections discarded as broken when returned.'),
+    ):
+        CallbackMetric(name, help_text, _pool_stat(key), kind=kind)
+    CallbackMetric('numdle_db_pool_wait_seconds_total', 'Time spent waiting for pool connections.',
+                   _pool_stat('requests_wait_ms', 0.001), kind='counter')
+
+
+def register_stats():
+    from django.conf import settings
+    from . import coalescer, engine, spectators
+    if settings.DATABASES['default'].get('OPTIONS', {}).get('pool'):
+        register_pool_stats()
+    _stat_metrics('numdle_ws', coalescer.stats, {
+        'frames_queued': 'Outbound frames queued for coalescing.',
+        'frames_sent': 'Websocket frames actually sent after coalescing.',
+        'frames_superseded': 'Queued frames dropped unsent: an older snapshot of the same kind, or deltas a newer room state covers.',
+        'frames_saved': 'Websocket sends avoided by coalescing (superseded frames plus frames sent inside a batch).',
+        'batches_sent': 'Batch frames sent.',
+    })
+    _stat_metrics('numdle_engine', engine.stats, {
+        'commands': 'Game actions applied by room actors.',
+        'entries_journaled': 'Journal entries written by room actors.',
+        'entries_flushed': 'Journal entries persisted to the database.',
+        'flushes': 'Write-behind flushes.',
+        'flush_errors': 'Failed write-behind flushes.',
+    })
+    _stat_metrics('numdle_spectator', spectators.stats, {
+        'feeds_opened': 'Room feeds opened (one per watched room and process, each reading one cached snapshot).',
+        'states_sent': 'Full states sent to spectators.',
+        'deltas_sent': 'Delta frames (or batches) sent to spectators.',
+        'slow_skips': 'Ticks a spectator was skipped at while its previous frame was still being sent.',
+    })
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0009_add_performance_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameroom',
+            name='engine_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
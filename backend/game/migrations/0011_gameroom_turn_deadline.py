@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:53
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_turn_deadlines(apps, schema_editor):
+    GameRoom = apps.get_model('game', 'GameRoom')
+    rooms = list(GameRoom.objects.filter(status='playing', turn_start_time__isnull=False, turn_time_limit__gt=0).only('turn_start_time', 'turn_time_limit'))
+    for room in rooms:
+        room.turn_deadline = room.turn_start_time + timedelta(seconds=room.turn_time_limit)
+    GameRoom.objects.bulk_update(rooms, ['turn_deadline'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_gameroom_engine_seq'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameroom',
+            name='turn_deadline',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_turn_deadlines, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='gameroom',
+            index=models.Index(condition=models.Q(('status', 'playing')), fields=['turn_deadline'], name='game_room_turn_deadline_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0011_gameroom_turn_deadline'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gameroom',
+            index=models.Index(condition=models.Q(('status__in', ['waiting', 'setting_numbers'])), fields=['-created_at', '-id'], name='game_room_lobby_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:00
+
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+TOTAL_BUCKET = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def backfill_rollups(apps, schema_editor):
+    """Seed the gauges and the created/joined counters from existing rows.
+
+    Game counters (started, finished, durations, guesses) start counting from here:
+    past games have no recorded start time.
+    """
+    GameRoom = apps.get_model('game', 'GameRoom')
+    Player = apps.get_model('game', 'Player')
+    AnalyticsRollup = apps.get_model('game', 'AnalyticsRollup')
+    values = Counter()
+    for status, in GameRoom.objects.values_list('status').iterator():
+        values[(TOTAL_BUCKET, f'rooms:{status}')] += 1
+    for metric, model, field in (('rooms_created', GameRoom, 'created_at'), ('players_joined', Player, 'joined_at')):
+        for at, in model.objects.values_list(field).iterator():
+            values[(TOTAL_BUCKET, metric)] += 1
+            values[(at.replace(minute=0, second=0, microsecond=0), metric)] += 1
+    values[(TOTAL_BUCKET, 'players')] = values[(TOTAL_BUCKET, 'players_joined')]
+    AnalyticsRollup.objects.bulk_create(
+        [AnalyticsRollup(bucket=bucket, metric=metric, value=value) for (bucket, metric), value in values.items() if value],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0012_gameroom_lobby_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameroom',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='AnalyticsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('metric', models.CharField(max_length=40)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'metric'), name='game_analytics_bucket_metric_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
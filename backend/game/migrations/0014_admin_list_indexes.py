@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0013_analytics_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gameroom',
+            index=models.Index(fields=['-created_at', '-id'], name='game_room_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usermessage',
+            index=models.Index(fields=['-created_at', '-id'], name='game_message_created_idx'),
+        ),
+    ]
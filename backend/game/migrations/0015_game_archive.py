@@ -0,0 +1,47 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_finished_at(apps, schema_editor):
+    # Existing finished games: time of the last guess, else of the last turn, else creation
+    GameRoom = apps.get_model('game', 'GameRoom')
+    Guess = apps.get_model('game', 'Guess')
+    last_guess = Guess.objects.filter(room=OuterRef('pk')).values('room').annotate(at=Max('timestamp')).values('at')
+    GameRoom.objects.filter(status='finished').update(
+        finished_at=Coalesce(Subquery(last_guess), 'turn_start_time', 'created_at'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0014_admin_list_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameArchive',
+            fields=[
+                ('room_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(db_index=True)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='gameroom',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_finished_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='gameroom',
+            index=models.Index(condition=models.Q(('status', 'finished')), fields=['finished_at'], name='game_room_finished_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0015_game_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teamstrategy',
+            name='recent_splices',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import User
 import uuid
 import json
+from datetime import timedelta
 
 
 class GameRoom(models.Model):
@@ -35,9 +36,34 @@ class GameRoom(models.Model):
     team_b_secret = models.CharField(max_length=4, blank=True, null=True, default='')
     team_a_set_by = models.ForeignKey('Player', null=True, blank=True, on_delete=models.SET_NULL, related_name='team_a_secret_set')
     team_b_set_by = models.ForeignKey('Player', null=True, blank=True, on_delete=models.SET_NULL, related_name='team_b_secret_set')
+    # Last journal entry persisted by the in-memory room engine (engine.py); makes journal replay idempotent
+    engine_seq = models.PositiveBigIntegerField(default=0)
+    # When the current turn (or its grace period, once announced) runs out; swept by tasks.sweep_turn_deadlines
+    turn_deadline = models.DateTimeField(null=True, blank=True)
+    # When the room moved to PLAYING (game duration rollups, see analytics.py)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # When the game was won; finished rooms are archived and purged some time after (retention.py)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['turn_deadline'], name='game_room_turn_deadline_idx', condition=models.Q(status='playing')),
+            # Lobby keyset pages (lobby.py)
+            models.Index(fields=['-created_at', '-id'], name='game_room_lobby_idx',
+                         condition=models.Q(status__in=['waiting', 'setting_numbers'])),
+            # Admin keyset pages and exports (pagination.py)
+            models.Index(fields=['-created_at', '-id'], name='game_room_created_idx'),
+            models.Index(fields=['finished_at'], name='game_room_finished_idx', condition=models.Q(status='finished')),
+        ]
     
     def __str__(self):
         return f"Room {self.name} ({self.status})"
+
+    def deadline_for(self, turn_start):
+        """turn_deadline of a turn starting at `turn_start` (None without a start or time limit)."""
+        if not turn_start or not self.turn_time_limit:
+            return None
+        return turn_start + timedelta(seconds=self.turn_time_limit)
     
     @property
     def is_full(self):
@@ -135,6 +161,8 @@ class TeamStrategy(models.Model):
     slot_digits: 4 x 10 matrix of ints (-1 unknown, 0 possible, 1 confirmed, 2 cannot)
     draft_guess: list of 4 strings (single digits or empty)
     version: optimistic concurrency control counter
+    recent_splices: [[version, [[client, at, delete, insert], ...] or null], ...] of
+        the last versions, for rebasing notes patches (see strategy.py)
     """
     room = models.ForeignKey(GameRoom, on_delete=models.CASCADE, related_name='team_strategies')
     team = models.CharField(max_length=1, choices=[('A', 'Team A'), ('B', 'Team B')])
@@ -144,6 +172,7 @@ class TeamStrategy(models.Model):
     version = models.PositiveIntegerField(default=1)
     updated_at = models.DateTimeField(auto_now=True)
     last_editor = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    recent_splices = models.JSONField(default=list, blank=True)
 
     class Meta:
         unique_together = ('room', 'team')
@@ -208,6 +237,39 @@ class UserMessage(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='game_message_created_idx'),
+        ]
     
     def __str__(self):
         return f"Message from {self.username}: {self.subject} ({self.status})"
+
+
+class GameArchive(models.Model):
+    """A purged finished game, kept as one compressed blob (see retention.py)."""
+    room_id = models.UUIDField(primary_key=True)
+    name = models.CharField(max_length=100)
+    created_at = models.DateTimeField()
+    finished_at = models.DateTimeField(db_index=True)
+    data = models.BinaryField()
+
+    def __str__(self):
+        return f"Archived game {self.name} ({self.finished_at:%Y-%m-%d})"
+
+
+class AnalyticsRollup(models.Model):
+    """One counter in one hour bucket (see analytics.py).
+
+    Rows with bucket == analytics.TOTAL_BUCKET hold the all-time totals.
+    """
+    bucket = models.DateTimeField()
+    metric = models.CharField(max_length=40)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'metric'], name='game_analytics_bucket_metric_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric}@{self.bucket:%Y-%m-%d %H:00} = {self.value}"
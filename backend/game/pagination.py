@@ -0,0 +1,95 @@
+"""Keyset pagination and NDJSON export helpers for list endpoints.
+
+Lists are ordered newest first by (created_at, id). A cursor is the opaque
+(created_at, id) of the last row shown, so every page is one indexed range
+query however deep it is, and rows inserted meanwhile never shift pages.
+
+ndjson_response() streams a whole queryset, one JSON object per line, reading
+it in chunks with QuerySet.iterator(): memory stays flat and the first bytes
+go out before the last rows are read.
+"""
+import base64
+import json
+from datetime import datetime
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+
+EXPORT_CHUNK_SIZE = 500
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def encode_cursor(obj):
+    raw = f'{obj.created_at.isoformat()}|{obj.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, obj_id = raw.split('|')
+        return datetime.fromisoformat(created_at), obj_id
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidQuery('Invalid cursor')
+
+
+def int_param(params, name, low, high):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise InvalidQuery(f'{name} must be an integer')
+    if not low <= value <= high:
+        raise InvalidQuery(f'{name} must be between {low} and {high}')
+    return value
+
+
+def bool_param(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise InvalidQuery(f'{name} must be true or false')
+
+
+def choice_param(params, name, choices):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    if value not in [choice[0] for choice in choices]:
+        raise InvalidQuery(f'Invalid {name}')
+    return value
+
+
+def newest_first(queryset, cursor=None):
+    """`queryset` ordered newest first, starting after `cursor` (raises InvalidQuery)."""
+    if cursor:
+        created_at, obj_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=obj_id))
+    return queryset.order_by('-created_at', '-id')
+
+
+def keyset_page(queryset, cursor, limit):
+    """(rows, next_cursor) for one page of at most `limit` rows."""
+    rows = list(newest_first(queryset, cursor)[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]) if more else None
+
+
+def ndjson_response(queryset, serialize, filename, chunk_size=EXPORT_CHUNK_SIZE):
+    """Stream serialize(row) for every row of `queryset` as an NDJSON download."""
+    def lines():
+        for row in queryset.iterator(chunk_size=chunk_size):
+            yield json.dumps(serialize(row)) + '\n'
+
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,212 @@
+"""Retention: archive and purge old finished games, expire abandoned lobby rooms.
+
+Nothing else ever deletes GameRoom, Player, Guess or TeamStrategy rows, so
+without this the hot tables (and their indexes) only grow.
+
+- Finished games older than RETENTION_FINISHED_DAYS (7) are written to
+  GameArchive, one zlib-compressed JSON blob per game (encode_game() /
+  decode_game()), and deleted with their players, guesses and strategies.
+- Rooms still waiting for players (or secrets) RETENTION_WAITING_HOURS (24)
+  after creation are deleted without an archive; nothing was played. They
+  get the same bookkeeping as an admin delete: analytics room_deleted deltas,
+  dropped room-state cache and a lobby room_closed event.
+- Guest users (``g:<device_id>``) older than RETENTION_GUEST_DAYS (30) that
+  no longer have a Player row or a room of their own are deleted, which keeps
+  auth_user bounded; their cached identities are forgotten (guests.py), and a
+  returning device just gets a new guest on its next join.
+
+All three run in batches of RETENTION_BATCH_SIZE rows. Each batch is one short
+transaction whose rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so
+rows a live request holds are simply left for the next run and no lock is held
+for longer than one batch. Batches are RETENTION_BATCH_PAUSE seconds apart and a
+run stops after RETENTION_MAX_SECONDS (inside the Celery time limit); the next
+beat run (every RETENTION_INTERVAL seconds) carries on where it stopped.
+Progress is logged per batch and reported to the caller through `progress`.
+"""
+import json
+import logging
+import time
+import zlib
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from . import analytics, guests, lobby
+from .models import GameArchive, GameRoom, Guess, Player, TeamStrategy
+from .room_state import forget_room
+
+logger = logging.getLogger(__name__)
+
+FINISHED_DAYS = getattr(settings, 'RETENTION_FINISHED_DAYS', 7)
+WAITING_HOURS = getattr(settings, 'RETENTION_WAITING_HOURS', 24)
+GUEST_DAYS = getattr(settings, 'RETENTION_GUEST_DAYS', 30)
+BATCH_SIZE = getattr(settings, 'RETENTION_BATCH_SIZE', 50)
+BATCH_PAUSE = getattr(settings, 'RETENTION_BATCH_PAUSE', 0.2)
+MAX_SECONDS = getattr(settings, 'RETENTION_MAX_SECONDS', 45)
+
+ARCHIVE_VERSION = 1
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def encode_game(room, players, guesses, strategies):
+    """One compressed archive blob for a finished room.
+
+    Players are rows of [user_id, display_name, team, secret_number, is_winner];
+    guesses are rows of [player, target, guess, strikes, balls, is_correct, ms],
+    with players as indexes into the player rows and `ms` counted from created_at.
+    """
+    index = {p.id: i for i, p in enumerate(players)}
+    doc = {
+        'v': ARCHIVE_VERSION,
+        'id': str(room.id),
+        'name': room.name,
+        'max_players': room.max_players,
+        'turn_time_limit': room.turn_time_limit,
+        'is_private': room.is_private,
+        'created_at': _iso(room.created_at),
+        'started_at': _iso(room.started_at),
+        'finished_at': _iso(room.finished_at),
+        'secrets': {'A': room.team_a_secret or '', 'B': room.team_b_secret or ''},
+        'players': [[p.user_id, p.display_name, p.team, p.secret_number, p.is_winner] for p in players],
+        'guesses': [
+            [index.get(g.player_id), index.get(g.target_player_id), g.guess_number, g.strikes, g.balls,
+             g.is_correct, int((g.timestamp - room.created_at).total_seconds() * 1000)]
+            for g in guesses
+        ],
+        'strategies': {
+            s.team: {'notes': s.notes, 'slot_digits': s.slot_digits, 'draft_guess': s.draft_guess}
+            for s in strategies
+        },
+    }
+    return zlib.compress(json.dumps(doc, separators=(',', ':')).encode(), 9)
+
+
+def decode_game(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def _group(rows, key):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(key(row), []).append(row)
+    return grouped
+
+
+def _delete_rooms(ids, deltas):
+    """Delete rooms (players, guesses, strategies cascade) and record the analytics deltas."""
+    _, deleted = GameRoom.objects.filter(id__in=ids).delete()
+    analytics.record(deltas)
+    return deleted
+
+
+def archive_finished_batch(cutoff, limit):
+    """Archive and delete up to `limit` rooms finished before `cutoff`; returns per-model delete counts."""
+    with transaction.atomic():
+        rooms = list(
+            GameRoom.objects.select_for_update(skip_locked=True)
+            .filter(status=GameRoom.FINISHED, finished_at__lt=cutoff)
+            .order_by('finished_at')[:limit]
+        )
+        if not rooms:
+            return {}
+        ids = [r.id for r in rooms]
+        players = _group(Player.objects.filter(room_id__in=ids).order_by('id'), lambda p: p.room_id)
+        guesses = _group(Guess.objects.filter(room_id__in=ids).order_by('timestamp', 'id'), lambda g: g.room_id)
+        strategies = _group(TeamStrategy.objects.filter(room_id__in=ids), lambda s: s.room_id)
+        GameArchive.objects.bulk_create([
+            GameArchive(
+                room_id=r.id, name=r.name, created_at=r.created_at, finished_at=r.finished_at,
+                data=encode_game(r, players.get(r.id, []), guesses.get(r.id, []), strategies.get(r.id, [])),
+            )
+            for r in rooms
+        ], ignore_conflicts=True)
+        deltas = Counter()
+        for r in rooms:
+            deltas.update(analytics.room_deleted(r.status, len(players.get(r.id, []))))
+        deleted = _delete_rooms(ids, deltas)
+    for room_id in ids:
+        forget_room(room_id)
+    return deleted
+
+
+def expire_waiting_batch(cutoff, limit):
+    """Delete up to `limit` lobby rooms created before `cutoff`; returns per-model delete counts."""
+    with transaction.atomic():
+        rooms = list(
+            GameRoom.objects.select_for_update(skip_locked=True)
+            .filter(status__in=lobby.LOBBY_STATUSES, created_at__lt=cutoff)
+            .order_by('created_at')
+            .only('id', 'status')[:limit]
+        )
+        if not rooms:
+            return {}
+        ids = [r.id for r in rooms]
+        counts = dict(
+            Player.objects.filter(room_id__in=ids).values('room_id').annotate(n=Count('id')).values_list('room_id', 'n')
+        )
+        deltas = Counter()
+        for r in rooms:
+            deltas.update(analytics.room_deleted(r.status, counts.get(r.id, 0)))
+        deleted = _delete_rooms(ids, deltas)
+    for room_id in ids:
+        forget_room(room_id)
+        lobby.publish_from_sync('room_closed', {'id': str(room_id)})
+    return deleted
+
+
+def purge_orphan_guests_batch(cutoff, limit):
+    """Delete up to `limit` guest users joined before `cutoff` without players or rooms; returns per-model delete counts."""
+    orphans = User.objects.filter(
+        username__startswith='g:', date_joined__lt=cutoff, player__isnull=True, created_rooms__isnull=True,
+    )
+    with transaction.atomic():
+        rows = list(orphans.select_for_update(skip_locked=True, of=('self',)).order_by('id').values_list('id', 'username')[:limit])
+        if not rows:
+            return {}
+        # Re-checked in the DELETE: a guest may have joined a room since
+        _, deleted = orphans.filter(id__in=[user_id for user_id, _ in rows]).delete()
+    # The identity cache must not hand the purged ids out again
+    guests.forget_guests([username for _, username in rows])
+    return deleted
+
+
+def run_retention(now=None, batch_size=BATCH_SIZE, pause=BATCH_PAUSE, max_seconds=MAX_SECONDS, progress=None):
+    """Expire stale lobby rooms, archive old finished games, then purge orphan guests, batch by batch.
+
+    Returns (and passes to `progress` after every batch) a dict of rooms
+    expired, games archived, guesses deleted, guests purged and whether the
+    backlog is done.
+    """
+    now = now or timezone.now()
+    stop_at = time.monotonic() + max_seconds
+    report = {'expired': 0, 'archived': 0, 'guesses_deleted': 0, 'guests_purged': 0, 'done': False}
+    phases = (
+        ('expired', expire_waiting_batch, now - timedelta(hours=WAITING_HOURS), GameRoom),
+        ('archived', archive_finished_batch, now - timedelta(days=FINISHED_DAYS), GameRoom),
+        ('guests_purged', purge_orphan_guests_batch, now - timedelta(days=GUEST_DAYS), User),
+    )
+    for name, run_batch, cutoff, model in phases:
+        while True:
+            if time.monotonic() >= stop_at:
+                logger.info("Retention stopped at its time budget: %s", report)
+                return report
+            deleted = run_batch(cutoff, batch_size)
+            count = deleted.get(model._meta.label, 0)
+            if not count:
+                break
+            report[name] += count
+            report['guesses_deleted'] += deleted.get(Guess._meta.label, 0)
+            logger.info("Retention batch: %d %s (%s)", count, name, report)
+            if progress:
+                progress(report)
+            if count < batch_size:
+                break
+            time.sleep(pause)
+    report['done'] = True
+    return report
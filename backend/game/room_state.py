@@ -0,0 +1,311 @@
+"""Versioned, cached room-state snapshots.
+
+Every state-changing write to a room (its row, its players or its guesses)
+must call bump_room_version() after saving. Readers compare the cached
+snapshot's version with the current counter and only rebuild from the
+database when it is stale, so reading a busy room's state costs one cache
+round trip instead of the room + players + full guess history queries.
+
+Both keys live in the default Django cache (Redis in production) so all
+consumers, processes and Celery workers share them.
+
+A snapshot holds the generic (secret-free) state plus a private section with
+team secrets; personalize() layers the requesting player's secrets on top
+without touching the database. Broadcasts never put a team's secrets where
+the other team's sockets receive them (see room_state_sends()).
+
+The version doubles as the room sequence number of the delta protocol: each
+delta event built by room_event() bumps it once, and a snapshot's 'version'
+is the sequence number of the last change it includes. A bump without an
+event (e.g. a team backfill) shows up to delta clients as a gap, which they
+repair by asking for a snapshot.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .models import GameRoom, Guess, Player
+
+SNAPSHOT_TTL = getattr(settings, 'ROOM_SNAPSHOT_TTL', 60 * 60)
+VERSION_TTL = getattr(settings, 'ROOM_VERSION_TTL', 24 * 60 * 60)
+
+
+def _version_key(room_id):
+    return f'room:{room_id}:version'
+
+
+def _snapshot_key(room_id):
+    return f'room:{room_id}:snapshot'
+
+
+def _initial_version():
+    # Counters that fell out of the cache restart from a time-based value so a
+    # surviving snapshot can never match a re-created counter.
+    return time.time_ns() // 1000
+
+
+def bump_room_version(room_id, count=1):
+    """Invalidate cached snapshots of a room. Call after every state-changing write.
+
+    Returns the new version; `count` > 1 reserves the versions up to it at
+    once (engine.RoomActor takes its sequence numbers in blocks).
+    """
+    key = _version_key(room_id)
+    try:
+        return cache.incr(key, count)
+    except ValueError:
+        cache.add(key, _initial_version(), timeout=VERSION_TTL)
+        return cache.incr(key, count)
+
+
+def forget_room(room_id):
+    """Drop all cached state of a deleted room."""
+    cache.delete_many([_version_key(room_id), _snapshot_key(room_id)])
+
+
+def team_group(room_id, team):
+    """Channel-layer group of one team's sockets in a room, for team-private traffic."""
+    return f'game_{room_id}_{team}'
+
+
+def delta_sends(room_id, event):
+    """(group, message) pairs delivering a room_delta event.
+
+    An event with a private part (data of ``data['team']``) goes to that team's
+    group with it and to the room group without it; the team's sockets drop the
+    second copy by its seq.
+    """
+    if 'private' not in event:
+        return [(f'game_{room_id}', event)]
+    public = {key: value for key, value in event.items() if key != 'private'}
+    return [(team_group(room_id, event['data']['team']), event), (f'game_{room_id}', public)]
+
+
+def room_event(room_id, event, data, private=None):
+    """Bump the room version for one delta event and return its channel-layer message.
+
+    `private` holds data only the team in ``data['team']`` may see (e.g. its
+    secret); see delta_sends().
+    """
+    message = {
+        'type': 'room_delta',
+        'seq': bump_room_version(room_id),
+        'event': event,
+        'data': data,
+    }
+    if private:
+        message['private'] = private
+    return message
+
+
+def turn_changed_event(room, current_turn_display_name):
+    """room_event() for a turn change that has just been saved on `room`."""
+    return room_event(room.id, 'turn_changed', {
+        'current_turn_player': current_turn_display_name,
+        'current_turn_team': room.current_turn_team,
+        'turn_start_time': room.turn_start_time.isoformat() if room.turn_start_time else None,
+    })
+
+
+def serialize_guess(guess):
+    """Guess as it appears in the room state (expects player/target_player loaded)."""
+    return {
+        'player': guess.player.display_name,
+        'target_player': guess.target_player.display_name,
+        'player_id': guess.player_id,
+        'target_player_id': guess.target_player_id,
+        'guess': guess.guess_number,
+        'strikes': guess.strikes,
+        'balls': guess.balls,
+        'is_correct': guess.is_correct,
+        'timestamp': guess.timestamp.isoformat()
+    }
+
+
+def build_room_snapshot(room_id, version=None):
+    """Build a snapshot from the database (2 queries, 3 for a room without players).
+
+    Returns a dict with 'version', 'state' (safe to broadcast: no secrets unless
+    the game has finished) and 'private' (secrets for personalize()), or None if
+    the room does not exist.
+    """
+    # The players and their room (with the set-by players) in one query
+    room_players = list(
+        Player.objects.filter(room_id=room_id)
+        .select_related('room__team_a_set_by', 'room__team_b_set_by')
+        .order_by('joined_at')
+    )
+    if room_players:
+        room = room_players[0].room
+    else:
+        try:
+            room = GameRoom.objects.get(id=room_id)
+        except GameRoom.DoesNotExist:
+            return None
+    # Fetch guesses with related objects in one query
+    guesses = [
+        serialize_guess(guess)
+        for guess in Guess.objects.filter(room=room).select_related('player', 'target_player').order_by('timestamp')
+    ]
+    return snapshot_from(room, room_players, guesses, version)
+
+
+def snapshot_from(room, room_players, guesses, version):
+    """Assemble a snapshot from a loaded room, its players (in join order) and serialized guesses.
+
+    Makes no queries as long as room.team_a_set_by / team_b_set_by are loaded
+    (or unset); the in-memory room engine builds its snapshots through here too.
+    """
+    finished = room.status == GameRoom.FINISHED
+
+    players = []
+    player_secrets = []
+    for player in room_players:
+        team_secret = room.team_a_secret if player.team == 'A' else room.team_b_secret if player.team == 'B' else ''
+        # Mirror team secret into effective_secret so front-end can pick it up uniformly
+        effective_secret = team_secret or player.secret_number
+        players.append({
+            'id': player.id,
+            'username': player.display_name,
+            'has_secret_number': bool(team_secret),
+            'is_winner': player.is_winner,
+            'team': player.team,
+            **({'secret_number': effective_secret} if finished else {})
+        })
+        player_secrets.append({
+            'user_id': player.user_id,
+            'team': player.team,
+            'team_secret': team_secret or '',
+            'secret_number': effective_secret,
+        })
+
+    def display_name_for(user_id):
+        return next((p.display_name for p in room_players if p.user_id == user_id), None)
+
+    # Find winner from already-loaded players
+    winner = next((p for p in room_players if p.is_winner), None)
+
+    state = {
+        'room_id': str(room.id),
+        'name': room.name,
+        'status': room.status,
+        'version': version,
+        'creator_username': display_name_for(room.creator_id) if room.creator_id else None,
+        'players': players,
+        'current_turn_player': display_name_for(room.current_turn_player_id) if room.current_turn_player_id else None,
+        'current_turn_team': room.current_turn_team,
+        'turn_start_time': room.turn_start_time.isoformat() if room.turn_start_time else None,
+        'turn_time_limit': room.turn_time_limit,
+        'guesses': guesses,
+        'winner_username': winner.display_name if winner else None,
+        'winner_team': winner.team if winner else None,
+        'team_a_secret_set': bool(room.team_a_secret),
+        'team_b_secret_set': bool(room.team_b_secret),
+        'team_a_set_by_username': room.team_a_set_by.display_name if room.team_a_set_by_id else None,
+        'team_b_set_by_username': room.team_b_set_by.display_name if room.team_b_set_by_id else None,
+    }
+    return {
+        'version': version,
+        'state': state,
+        'private': {'players': player_secrets},
+    }
+
+
+def get_room_snapshot(room_id):
+    """Return the current snapshot of a room, rebuilding it only when stale."""
+    version_key = _version_key(room_id)
+    snapshot_key = _snapshot_key(room_id)
+    cached = cache.get_many([version_key, snapshot_key])
+    version = cached.get(version_key)
+    if version is None:
+        cache.add(version_key, _initial_version(), timeout=VERSION_TTL)
+        version = cache.get(version_key)
+    snapshot = cached.get(snapshot_key)
+    if snapshot is not None and snapshot['version'] == version:
+        return snapshot
+
+    # The version is read before the database so a write landing mid-build
+    # leaves this snapshot tagged with an already-stale version.
+    snapshot = build_room_snapshot(room_id, version=version)
+    if snapshot is not None:
+        cache.set(snapshot_key, snapshot, timeout=SNAPSHOT_TTL)
+    return snapshot
+
+
+def restrict_snapshot(snapshot, team=None):
+    """`snapshot` with the secrets of every player outside `team` blanked (of every player when None)."""
+    return {**snapshot, 'private': {'players': [
+        secret if team and secret['team'] == team else {**secret, 'team_secret': '', 'secret_number': ''}
+        for secret in snapshot['private']['players']
+    ]}}
+
+
+def room_state_sends(room_id, snapshot):
+    """(group, message) pairs broadcasting a snapshot, the way delta_sends() sends a private delta.
+
+    The room group gets the snapshot with every secret blanked. Each team
+    that has a secret to show first gets, in its team group, a copy (marked
+    ``team``) with its own players' secrets; its sockets then drop the room
+    group copy of that version. Every GameConsumer applies personalize() for
+    its own user, so no socket queries the database and a change costs at
+    most three messages whatever the room size.
+    """
+    sends = []
+    if snapshot['state']['status'] != GameRoom.FINISHED:
+        for team in ('A', 'B'):
+            if any(s['team'] == team and s['secret_number'] for s in snapshot['private']['players']):
+                sends.append((team_group(room_id, team), {
+                    'type': 'room_state_update', 'team': team, 'snapshot': restrict_snapshot(snapshot, team),
+                }))
+    sends.append((f'game_{room_id}', {'type': 'room_state_update', 'snapshot': restrict_snapshot(snapshot)}))
+    return sends
+
+
+def revealed_secrets(snapshot, user_id=None):
+    """Indices of the state's players whose secret `user_id` may see, as a tuple (empty: the generic state).
+
+    A player sees their own secret and, once their team's secret is set, their
+    teammates' (shared team secret). Secrets of a finished game are already in
+    the generic state, and unset secrets are not layered, so every socket of
+    a room that has no secret yet shows the same state.
+    """
+    state = snapshot['state']
+    if not user_id or state['status'] == GameRoom.FINISHED:
+        return ()
+    secrets = snapshot['private']['players']
+    own = next((s for s in secrets if s['user_id'] == user_id), None)
+    if own is None:
+        return ()
+    return tuple(
+        i for i, secret in enumerate(secrets)
+        if secret['secret_number'] and (
+            secret['user_id'] == user_id
+            or (own['team'] and secret['team'] == own['team'] and secret['team_secret'])
+        )
+    )
+
+
+def shows_generic_state(snapshot):
+    """Whether any player of the snapshot may see no secret, i.e. get the generic state (see revealed_secrets()).
+
+    Reads the generic state only, so it also answers for a snapshot restricted
+    by restrict_snapshot().
+    """
+    state = snapshot['state']
+    return state['status'] == GameRoom.FINISHED or not all(player['has_secret_number'] for player in state['players'])
+
+
+def personalize(snapshot, user_id=None, revealed=None):
+    """Return the snapshot's state with the secrets `user_id` may see layered on top.
+
+    `revealed` is revealed_secrets(snapshot, user_id) when the caller has it.
+    Passing no user_id returns the generic state.
+    """
+    if revealed is None:
+        revealed = revealed_secrets(snapshot, user_id)
+    state = snapshot['state']
+    if not revealed:
+        return state
+    players = list(state['players'])
+    for i in revealed:
+        players[i] = {**players[i], 'secret_number': snapshot['private']['players'][i]['secret_number']}
+    return {**state, 'players': players}
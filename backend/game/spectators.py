@@ -0,0 +1,250 @@
+"""Spectator tier: read-only room viewers, fanned out per process.
+
+Spectator sockets (ws/watch/<room_id>/, SpectatorConsumer) have no
+channel-layer channel and never touch the player tables. Each ASGI process
+keeps one RoomFeed per watched room instead:
+
+- the feed's channel is the process's only member of the room group for its
+  viewers, so a change costs the channel layer one delivery per process
+  whatever the number of viewers;
+- it keeps the room's latest secret-free state (room group copies of
+  room_state_update broadcasts carry no secrets, see
+  room_state.room_state_sends()) and the last SPECTATOR_DELTA_HISTORY public
+  deltas;
+- its initial state is the room's cached snapshot (get_room_snapshot(), or
+  the local actor's with GAME_ENGINE = 'actor'), read once per room and
+  process.
+
+Viewers get at most SPECTATOR_MAX_FPS frames a second (a client may ask for
+fewer with ``?fps=``). At each tick a viewer that is behind gets either the
+deltas it misses (``?protocol=delta``, while the history still holds them
+all) or the latest state. A viewer whose previous frame is still being sent
+is skipped and later gets whatever is latest then: intermediate changes are
+dropped for slow viewers, never queued. States are encoded once per feed,
+format and version, and deltas arrive encoded by their sender (wire.prepare()).
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from . import engine, wire
+from .room_state import get_room_snapshot
+
+logger = logging.getLogger(__name__)
+
+MAX_FPS = getattr(settings, 'SPECTATOR_MAX_FPS', 4)
+DELTA_HISTORY = getattr(settings, 'SPECTATOR_DELTA_HISTORY', 64)
+
+# Process-wide counters
+stats = {
+    'feeds_opened': 0,
+    'states_sent': 0,
+    'deltas_sent': 0,
+    'slow_skips': 0,
+}
+
+
+class Viewer:
+    """One spectator socket, as its feed sees it."""
+
+    def __init__(self, send, codec=wire.JSON, delta_mode=False, fps=None):
+        self.send = send
+        self.codec = codec
+        self.delta_mode = delta_mode
+        self.interval = 1 / min(fps or MAX_FPS, MAX_FPS)
+        # Room version this viewer has; None until its socket is accepted
+        self.version = None
+        self.next_at = 0.0
+        self.sending = False
+
+
+class RoomFeed:
+    """A room's spectator fan-out in this process. Use it from its event loop only."""
+
+    def __init__(self, room_id, loop):
+        self.room_id = room_id
+        self.loop = loop
+        self.viewers = set()
+        self.state = None  # generic state of the latest snapshot
+        self.version = 0  # its version
+        self.seq = 0  # highest room version seen (snapshots and deltas)
+        self.deltas = OrderedDict()  # seq -> wire.Encoded
+        self.channel = None
+        self.started = None
+        self.receiver = None
+        self.tick_handle = None
+        self.last_tick = 0.0
+        self.deliveries = set()
+
+    async def start(self):
+        """Join the room group, then load the initial state; False when the room does not exist."""
+        channel_layer = get_channel_layer()
+        self.channel = await channel_layer.new_channel('spectate')
+        # Join first: changes published while the snapshot loads are applied after it
+        await channel_layer.group_add(f'game_{self.room_id}', self.channel)
+        self.receiver = self.loop.create_task(self._receive(channel_layer))
+        stats['feeds_opened'] += 1
+        snapshot = await self._load_snapshot()
+        if snapshot is None:
+            return False
+        self.set_state(snapshot)
+        return True
+
+    async def _load_snapshot(self):
+        actor = engine._actors.get(self.room_id)
+        if actor is not None:
+            return actor.snapshot()
+        try:
+            return await database_sync_to_async(get_room_snapshot)(self.room_id)
+        except ValidationError:
+            return None
+
+    async def _receive(self, channel_layer):
+        while True:
+            message = await channel_layer.receive(self.channel)
+            try:
+                if message['type'] == 'room_state_update':
+                    self.set_state(message['snapshot'])
+                elif message['type'] == 'room_delta':
+                    self.add_delta(message)
+            except Exception:
+                logger.exception("Spectator feed of room %s dropped a %s message", self.room_id, message.get('type'))
+
+    async def close(self):
+        if self.started is not None and not self.started.done():
+            await asyncio.wait([self.started])
+        for handle in (self.receiver, self.tick_handle):
+            if handle is not None:
+                handle.cancel()
+        if self.channel is not None:
+            await get_channel_layer().group_discard(f'game_{self.room_id}', self.channel)
+
+    def set_state(self, snapshot):
+        if snapshot['version'] is None or snapshot['version'] < self.version:
+            return
+        self.state = snapshot['state']
+        self.version = snapshot['version']
+        self.seq = max(self.seq, self.version)
+        self.schedule()
+
+    def add_delta(self, message):
+        seq = message['seq']
+        if seq <= self.version:
+            return
+        frames = message.get('frames')
+        if frames is None or 'private' in message:
+            # Room group copies are public already; never forward a team's part
+            public = {key: value for key, value in message.items() if key not in ('private', 'frames')}
+            frames = wire.encode_frames(wire.client_frame(public))
+        self.deltas[seq] = wire.Encoded(frames)
+        while len(self.deltas) > DELTA_HISTORY:
+            self.deltas.popitem(last=False)
+        self.seq = max(self.seq, seq)
+        self.schedule()
+
+    def resync(self, viewer):
+        """Send `viewer` the full state at its next tick (also marks a new viewer ready)."""
+        viewer.version = 0
+        self.schedule()
+
+    def schedule(self):
+        """Run a tick as soon as the frame rate cap allows, unless one is pending."""
+        if self.tick_handle is None and self.state is not None:
+            delay = max(0.0, self.last_tick + 1 / MAX_FPS - time.monotonic())
+            self.tick_handle = self.loop.call_later(delay, self.tick)
+
+    def _behind(self, viewer):
+        return viewer.version is not None and (self.seq if viewer.delta_mode else self.version) > viewer.version
+
+    def tick(self):
+        self.tick_handle = None
+        self.last_tick = now = time.monotonic()
+        encoded = {}  # (format, delta mode, from version) -> _frame(): shared by the viewers of this tick
+        waiting = False
+        for viewer in self.viewers:
+            if not self._behind(viewer):
+                continue
+            if viewer.sending or now < viewer.next_at:
+                if viewer.sending:
+                    stats['slow_skips'] += 1
+                waiting = True
+                continue
+            key = (viewer.codec.name, viewer.delta_mode, viewer.version)
+            if key not in encoded:
+                encoded[key] = self._frame(viewer)
+            data, version, kind = encoded[key]
+            if data is None:
+                continue
+            stats[kind] += 1
+            viewer.version = version
+            viewer.next_at = now + viewer.interval
+            viewer.sending = True
+            task = self.loop.create_task(self._deliver(viewer, data))
+            self.deliveries.add(task)
+            task.add_done_callback(self.deliveries.discard)
+        if waiting:
+            self.schedule()
+
+    def _frame(self, viewer):
+        """(encoded frame, version it brings `viewer` to, stats key); no frame when it has to wait for a state."""
+        codec = viewer.codec
+        missing = range(viewer.version + 1, self.seq + 1)
+        if viewer.delta_mode and viewer.version and all(seq in self.deltas for seq in missing):
+            frames = [self.deltas[seq].frames[codec.name] for seq in missing]
+            return (frames[0] if len(frames) == 1 else codec.batch(frames)), self.seq, 'deltas_sent'
+        if self.version <= viewer.version:
+            # Deltas missing from the history: the state that covers them is on its way
+            return None, None, None
+        frame = {'type': 'room_state_update', 'data': self.state}
+        return wire.encode_shared(codec, ('spectate', self.room_id, self.version), frame), self.version, 'states_sent'
+
+    async def _deliver(self, viewer, data):
+        try:
+            await viewer.send(data)
+        except Exception:
+            # The socket is going away; disconnect removes the viewer
+            logger.debug("Spectator frame for room %s not delivered", self.room_id, exc_info=True)
+        finally:
+            viewer.sending = False
+        if self._behind(viewer):
+            self.schedule()
+
+
+_feeds = {}
+
+
+async def watch(room_id, viewer):
+    """Add `viewer` to the room's feed, opening the feed on first use; None when the room does not exist.
+
+    The viewer gets frames once resync() marks it ready (after its socket is accepted).
+    """
+    room_id = str(room_id)
+    loop = asyncio.get_running_loop()
+    feed = _feeds.get(room_id)
+    if feed is None or feed.loop is not loop:
+        feed = _feeds[room_id] = RoomFeed(room_id, loop)
+        feed.started = asyncio.ensure_future(feed.start())
+    feed.viewers.add(viewer)
+    try:
+        opened = await asyncio.shield(feed.started)
+    except Exception:
+        logger.exception("Could not open the spectator feed of room %s", room_id)
+        opened = False
+    if not opened:
+        await unwatch(feed, viewer)
+        return None
+    return feed
+
+
+async def unwatch(feed, viewer):
+    """Remove `viewer`; the last one closes the feed."""
+    feed.viewers.discard(viewer)
+    if feed.viewers:
+        return
+    if _feeds.get(feed.room_id) is feed:
+        del _feeds[feed.room_id]
+    await feed.close()
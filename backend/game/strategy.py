@@ -0,0 +1,314 @@
+"""Team strategy patches: merged server-side, written behind.
+
+Clients used to send the whole strategy (notes, 4 x 10 slot matrix, draft
+guess) on every edit; every edit was a version-checked UPDATE plus a full
+broadcast, and two teammates editing at once kept rejecting each other.
+
+A ``patch_team_strategy`` message instead carries a few ops against the
+strategy version the client last saw (``base``), tagged with a client id and
+a per-client ``seq``:
+
+- ``{'op': 'set_cell', 'row', 'col', 'value'}``: one slot_digits cell;
+- ``{'op': 'set_draft', 'index', 'digit'}``: one draft_guess position;
+- ``{'op': 'splice', 'at', 'delete', 'insert'}``: replace ``delete`` characters
+  of the notes at ``at`` with ``insert``.
+
+Cells and draft digits are last-writer-wins. Splices are rebased over the
+splices other clients committed after ``base`` (TeamStrategy.recent_splices
+keeps those of the last STRATEGY_HISTORY versions), so concurrent typing
+merges instead of conflicting. Splices of a patch whose base is older than
+that history (or older than a full update_team_strategy) are dropped and the
+sender gets a team_strategy_conflict with the full state to start over from.
+
+Write-behind: patches are buffered per room in the process that received
+them and flushed STRATEGY_FLUSH_INTERVAL_MS after the first one. A flush is
+one transaction that locks the room's strategy rows, applies the buffered
+patches in arrival order, bumps each edited team's version once and writes
+all edited rows with one UPDATE. The ops as applied then go out as a single
+``team_strategy_patch`` per team and version, to that team's group only.
+Patches still buffered when a process dies are lost (at most one flush
+interval of edits).
+"""
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from . import metrics
+from .models import Player, TeamStrategy
+from .room_state import team_group
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, 'STRATEGY_FLUSH_INTERVAL_MS', 250) / 1000
+HISTORY = getattr(settings, 'STRATEGY_HISTORY', 50)
+NOTES_MAX_LENGTH = 10000
+MAX_OPS = 200
+
+SLOT_VALUES = (-1, 0, 1, 2)
+DRAFT_DIGITS = ('',) + tuple('0123456789')
+
+_FIELDS = ['notes', 'slot_digits', 'draft_guess', 'version', 'recent_splices', 'last_editor', 'updated_at']
+
+
+def default_strategy():
+    return {'slot_digits': [[-1] * 10 for _ in range(4)], 'draft_guess': ['', '', '', '']}
+
+
+def serialize_strategy(ts, last_editor=None):
+    """A strategy's full client payload; `last_editor` is the editor's display name."""
+    return {
+        'team': ts.team,
+        'notes': ts.notes,
+        'slot_digits': ts.slot_digits,
+        'draft_guess': ts.draft_guess,
+        'version': ts.version,
+        'updated_at': ts.updated_at.isoformat() if ts.updated_at else None,
+        'last_editor': last_editor,
+    }
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def clean_ops(ops):
+    """The well-formed ops of a client patch, normalized; anything else is dropped."""
+    cleaned = []
+    for op in ops[:MAX_OPS] if isinstance(ops, list) else ():
+        if not isinstance(op, dict):
+            continue
+        kind = op.get('op')
+        if kind == 'set_cell':
+            row, col, value = op.get('row'), op.get('col'), op.get('value')
+            if _is_int(row) and _is_int(col) and 0 <= row < 4 and 0 <= col < 10 and value in SLOT_VALUES:
+                cleaned.append({'op': kind, 'row': row, 'col': col, 'value': value})
+        elif kind == 'set_draft':
+            index, digit = op.get('index'), op.get('digit')
+            if _is_int(index) and 0 <= index < 4 and digit in DRAFT_DIGITS:
+                cleaned.append({'op': kind, 'index': index, 'digit': digit})
+        elif kind == 'splice':
+            at, delete, insert = op.get('at'), op.get('delete', 0), op.get('insert', '')
+            if _is_int(at) and _is_int(delete) and at >= 0 and delete >= 0 and isinstance(insert, str):
+                if delete or insert:
+                    cleaned.append({'op': kind, 'at': at, 'delete': delete, 'insert': insert[:NOTES_MAX_LENGTH]})
+    return cleaned
+
+
+def transform_splice(splice, over):
+    """`splice` rebased over the concurrent splice `over` (both made against the same text).
+
+    Returns a list of splices: a deletion straddling the range `over` replaced
+    comes back in two parts around the text `over` inserted. On a tie the
+    committed splice's insertion stays first.
+    """
+    at, delete, insert = splice
+    o_at, o_delete, o_insert = over
+    o_end = o_at + o_delete
+    if at + delete <= o_at and not (at == o_at and delete == 0):
+        return [splice]
+    if at >= o_end:
+        return [(at - o_delete + len(o_insert), delete, insert)]
+    # Overlaps the range `over` replaced; that part is deleted already
+    after = max(0, at + delete - o_end)
+    if at < o_at:
+        parts = [(at, o_at - at, insert)]
+        if after:
+            parts.append((at + len(insert) + len(o_insert), after, ''))
+        return parts
+    return [(o_at + len(o_insert), after, insert)]
+
+
+def rebase(splices, over):
+    """Each of `splices` rebased over every splice of `over`, in order."""
+    for committed in over:
+        splices = [part for splice in splices for part in transform_splice(splice, committed)]
+    return splices
+
+
+def apply_splice(text, splice):
+    """(new text, splice as applied): positions clamped to `text`, length capped at NOTES_MAX_LENGTH."""
+    at, delete, insert = splice
+    at = min(at, len(text))
+    delete = min(delete, len(text) - at)
+    insert = insert[:max(0, NOTES_MAX_LENGTH - len(text) + delete)]
+    return text[:at] + insert + text[at + delete:], (at, delete, insert)
+
+
+def _concurrent(history, batch, base, version, client):
+    """Splices committed after `base` by other clients, or None when the history no longer covers `base`."""
+    if base > version:
+        return None
+    if base < version and not (history and history[0][0] <= base + 1):
+        return None
+    splices = []
+    for entry_version, entries in history:
+        if entry_version <= base:
+            continue
+        if entries is None:
+            # A full update replaced the notes
+            return None
+        splices.extend((at, delete, insert) for author, at, delete, insert in entries if author != client)
+    splices.extend(splice for author, splice in batch if author != client)
+    return splices
+
+
+def merge_patches(ts, patches):
+    """Apply `patches` to `ts` in order, without saving.
+
+    Returns (applied, rejected): `applied` lists {'client', 'seq', 'ops'} with
+    the ops as applied, `rejected` the patches whose splices could not be
+    rebased. Bumps ts.version (once) and records the splices in
+    ts.recent_splices when anything was applied.
+    """
+    ts.ensure_defaults()
+    history = ts.recent_splices or []
+    batch = []
+    applied, rejected = [], []
+    for patch in patches:
+        client, ops = patch['client'], patch['ops']
+        concurrent = []
+        if any(op['op'] == 'splice' for op in ops):
+            concurrent = _concurrent(history, batch, patch['base'], ts.version, client)
+            if concurrent is None:
+                rejected.append(patch)
+                ops = [op for op in ops if op['op'] != 'splice']
+        done = []
+        for op in ops:
+            if op['op'] == 'set_cell':
+                ts.slot_digits[op['row']][op['col']] = op['value']
+                done.append(op)
+            elif op['op'] == 'set_draft':
+                ts.draft_guess[op['index']] = op['digit']
+                done.append(op)
+            else:
+                for splice in rebase([(op['at'], op['delete'], op['insert'])], concurrent):
+                    ts.notes, splice = apply_splice(ts.notes, splice)
+                    if splice[1] or splice[2]:
+                        batch.append((client, splice))
+                        done.append({'op': 'splice', 'at': splice[0], 'delete': splice[1], 'insert': splice[2]})
+        if done:
+            applied.append({'client': client, 'seq': patch['seq'], 'ops': done})
+            ts.last_editor_id = patch['user_id']
+    if applied:
+        ts.version += 1
+        history.append([ts.version, [[author, *splice] for author, splice in batch]])
+        ts.recent_splices = history[-HISTORY:]
+        ts.updated_at = timezone.now()
+    return applied, rejected
+
+
+def commit_patches(room_id, patches):
+    """Merge and save one flush of a room's patches (one transaction, one UPDATE).
+
+    Returns (messages, conflicts): group messages to broadcast, and
+    (channel name, full strategy payload) for the senders of rejected patches.
+    """
+    by_team = {}
+    for patch in patches:
+        by_team.setdefault(patch['team'], []).append(patch)
+    with transaction.atomic():
+        docs = {ts.team: ts for ts in TeamStrategy.objects.select_for_update().filter(room_id=room_id, team__in=by_team)}
+        for team in by_team.keys() - docs.keys():
+            docs[team], _ = TeamStrategy.objects.get_or_create(room_id=room_id, team=team, defaults=default_strategy())
+        names = dict(
+            Player.objects.filter(room_id=room_id, user_id__in={p['user_id'] for p in patches})
+            .values_list('user_id', 'display_name')
+        )
+        dirty, messages, conflicts = [], [], []
+        for team, team_patches in by_team.items():
+            ts = docs[team]
+            applied, rejected = merge_patches(ts, team_patches)
+            metrics.strategy_patches.inc('rejected', amount=len(rejected))
+            metrics.strategy_patches.inc('applied', amount=len(team_patches) - len(rejected))
+            if applied:
+                dirty.append(ts)
+                messages.append({
+                    'type': 'team_strategy_patch',
+                    'team': team,
+                    'version': ts.version,
+                    'patches': applied,
+                    'updated_at': ts.updated_at.isoformat(),
+                    'last_editor': names.get(ts.last_editor_id),
+                })
+            conflicts.extend(
+                (patch['reply_to'], serialize_strategy(ts, names.get(ts.last_editor_id))) for patch in rejected
+            )
+        if dirty:
+            TeamStrategy.objects.bulk_update(dirty, _FIELDS)
+            metrics.strategy_writes.inc(amount=len(dirty))
+    return messages, conflicts
+
+
+class StrategyBuffer:
+    """This process's patches waiting for their room's next flush. Use it from its event loop only."""
+
+    def __init__(self, loop, interval=None):
+        self.loop = loop
+        self.interval = FLUSH_INTERVAL if interval is None else interval
+        self.pending = {}  # room id -> [patch, ...]
+        self.tasks = set()
+
+    def add(self, room_id, patch):
+        """Buffer a patch (as built by add_patch()); the first one of a room schedules its flush."""
+        patches = self.pending.setdefault(room_id, [])
+        patches.append(patch)
+        if len(patches) == 1:
+            task = self.loop.create_task(self._flush_later(room_id))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _flush_later(self, room_id):
+        await asyncio.sleep(self.interval)
+        await self.flush(room_id)
+
+    async def flush(self, room_id):
+        patches = self.pending.pop(room_id, None)
+        if not patches:
+            return
+        try:
+            messages, conflicts = await database_sync_to_async(commit_patches)(room_id, patches)
+        except Exception:
+            logger.exception("Dropped %d team strategy patches for room %s", len(patches), room_id)
+            return
+        channel_layer = get_channel_layer()
+        for message in messages:
+            await metrics.group_send(channel_layer, team_group(room_id, message['team']), message)
+        for channel_name, payload in conflicts:
+            await channel_layer.send(channel_name, {'type': 'team_strategy_resync', 'payload': payload})
+
+    async def flush_all(self):
+        for room_id in list(self.pending):
+            await self.flush(room_id)
+
+
+_buffer = None
+
+
+def get_strategy_buffer():
+    """This process's StrategyBuffer, bound to the running loop on first use (call from async code)."""
+    global _buffer
+    loop = asyncio.get_running_loop()
+    if _buffer is None or _buffer.loop is not loop:
+        _buffer = StrategyBuffer(loop)
+    return _buffer
+
+
+def add_patch(room_id, team, user_id, reply_to, data):
+    """Buffer a patch_team_strategy message for `team`; returns False when it carries no usable op."""
+    ops = clean_ops(data.get('ops'))
+    base, seq, client = data.get('base'), data.get('seq'), data.get('client')
+    if not ops or not _is_int(base):
+        return False
+    get_strategy_buffer().add(room_id, {
+        'team': team,
+        'user_id': user_id,
+        'reply_to': reply_to,
+        'client': str(client)[:40] if client is not None else reply_to,
+        'seq': seq if _is_int(seq) else None,
+        'base': base,
+        'ops': ops,
+    })
+    return True
@@ -1,72 +1,104 @@
+from datetime import timedelta
 from celery import shared_task
+from django.db import transaction
 from django.utils import timezone
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
+from .metrics import group_send
 from .models import GameRoom, Player
+from .room_state import get_room_snapshot, room_state_sends, turn_changed_event
 
 """Turn timeout handling with delayed skip.
 
 Flow:
-1. At turn start external code should schedule check_turn_timeout(countdown=turn_time_limit).
-2. When check_turn_timeout fires and detects expiry, it DOES NOT immediately switch turn.
-    It broadcasts a 'turn_timeout' event and schedules skip_turn in 5 seconds, passing the
-    original turn_start_time (epoch seconds) for idempotence.
+1. At turn start external code stores turn_deadline and calls timers.schedule_turn_timeout(),
+    which arms an in-process timer (TURN_TIMERS = 'wheel', see timers.py) or a
+    check_turn_timeout countdown task (TURN_TIMERS = 'celery'), tagged with the turn's
+    turn_start_time. With TURN_TIMERS = 'sweep' nothing is armed: the periodic
+    sweep_turn_deadlines task finds expired turns through the indexed turn_deadline.
+2. When the check fires for a turn that is still current and has expired, it DOES NOT
+    immediately switch turn. It broadcasts a 'turn_timeout' event and schedules skip_turn
+    in SKIP_GRACE_SECONDS, passing the original turn_start_time (epoch seconds) for idempotence.
+    Checks for a turn that has already ended do nothing (no rescheduling).
 3. If the player makes a guess during the 5 second grace period (turn_start_time resets),
     skip_turn aborts because the epoch no longer matches.
-4. skip_turn performs team-aware turn advancement, broadcasts a game_message and asks
-    all consumers to refresh room state, then schedules the next check_turn_timeout.
+4. skip_turn performs team-aware turn advancement, broadcasts a game_message and the
+    new room state snapshot (built once), then schedules the next turn's timeout.
+
+announce_if_expired() and advance_expired_turn() hold the logic; the Celery tasks, the
+in-process timers and the sweeper are thin wrappers around them.
 """
 
-@shared_task
-def check_turn_timeout(room_id):
-    """Detect turn expiry and announce upcoming skip (without switching immediately)."""
+SKIP_GRACE_SECONDS = 5
+# Rooms claimed per sweeper transaction
+SWEEP_BATCH_SIZE = 100
+# A room claimed for skipping is retried after this long if its sweeper dies before advancing it
+SWEEP_LEASE_SECONDS = 30
+
+
+def turn_timeout_message():
+    """Group message announcing the skip of an expired turn (also sent by engine.RoomActor)."""
+    return {
+        'type': 'turn_timeout',
+        'message': f'Turn time expired! Skipping to next team in {SKIP_GRACE_SECONDS} seconds.'
+    }
+
+
+def turn_skipped_message(team, display_name):
+    """Group message naming the player whose turn it is after a skip (also sent by engine.RoomActor)."""
+    return {
+        'type': 'game_message',
+        'message': f"Turn skipped. Team {team}'s player {display_name}'s turn now."
+    }
+
+
+def announce_timeout(room_id):
+    channel_layer = get_channel_layer()
+    async_to_sync(group_send)(channel_layer, f'game_{room_id}', turn_timeout_message())
+
+
+def announce_if_expired(room_id, turn_started=None):
+    """Check a turn's deadline; broadcast 'turn_timeout' if it has passed.
+
+    `turn_started` (ISO turn_start_time) ties the check to one turn: a check for a
+    turn that has since ended returns None. Otherwise returns (True, epoch) once
+    expired (announced) or (False, seconds remaining).
+    """
     try:
         room = GameRoom.objects.get(id=room_id)
     except GameRoom.DoesNotExist:
-        return
+        return None
     if room.status != GameRoom.PLAYING or not room.turn_start_time:
-        return
+        return None
+    if turn_started is not None and room.turn_start_time.isoformat() != turn_started:
+        return None
     elapsed = timezone.now() - room.turn_start_time
     if elapsed.total_seconds() < room.turn_time_limit:
-        # Not yet expired; optionally reschedule a safety check (not strictly needed)
-        remaining = room.turn_time_limit - int(elapsed.total_seconds())
-        check_turn_timeout.apply_async(args=[str(room_id)], countdown=remaining)
-        return
+        return False, room.turn_time_limit - elapsed.total_seconds()
 
-    # Already expired; announce and schedule skip after 5s if not already scheduled.
-    original_epoch = int(room.turn_start_time.timestamp())
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'game_{room_id}',
-        {
-            'type': 'turn_timeout',
-            'message': 'Turn time expired! Skipping to next team in 5 seconds.'
-        }
-    )
-    # Schedule skip
-    skip_turn.apply_async(args=[str(room_id), original_epoch], countdown=5)
+    announce_timeout(room_id)
+    return True, int(room.turn_start_time.timestamp())
 
 
-@shared_task
-def skip_turn(room_id, original_turn_start_epoch):
-    """Skip the current turn if still the same expired turn and advance to next team's player."""
+def advance_expired_turn(room_id, original_turn_start_epoch):
+    """Skip the turn if it is still the same expired turn; returns the updated room or None."""
     try:
         room = GameRoom.objects.get(id=room_id)
     except GameRoom.DoesNotExist:
-        return
+        return None
     if room.status != GameRoom.PLAYING or not room.turn_start_time:
-        return
+        return None
     # Abort if turn already advanced (turn_start_time changed)
     current_epoch = int(room.turn_start_time.timestamp())
     if current_epoch != original_turn_start_epoch:
-        return
+        return None
 
     players = list(room.players.order_by('joined_at'))
     if not players:
-        return
+        return None
     # Find current index
     try:
-        current_index = next(i for i,p in enumerate(players) if p.user == room.current_turn_player)
+        current_index = next(i for i,p in enumerate(players) if p.user_id == room.current_turn_player_id)
     except StopIteration:
         current_index = 0
     current_team = players[current_index].team
@@ -81,28 +113,135 @@ def skip_turn(room_id, original_turn_start_epoch):
     if not next_player:
         # Fallback sequential
         next_player = players[(current_index + 1) % n]
-    room.current_turn_player = next_player.user
-    room.current_turn_team = next_player.team
-    room.turn_start_time = timezone.now()
-    room.save()
+    # Claim the expired turn only if no guess advanced it meanwhile (no row lock)
+    now = timezone.now()
+    changes = {
+        'current_turn_player_id': next_player.user_id,
+        'current_turn_team': next_player.team,
+        'turn_start_time': now,
+        'turn_deadline': room.deadline_for(now),
+    }
+    claimed = GameRoom.objects.filter(
+        id=room.id, status=GameRoom.PLAYING, turn_start_time=room.turn_start_time
+    ).update(**changes)
+    if not claimed:
+        return None
+    for field, value in changes.items():
+        setattr(room, field, value)
 
     # Use display name for the message
     display_name = next_player.display_name or next_player.user.username
 
     channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'game_{room_id}',
-        {
-            'type': 'game_message',
-            'message': f"Turn skipped. Team {room.current_turn_team}'s player {display_name}'s turn now."
-        }
+    async_to_sync(group_send)(
+        channel_layer, f'game_{room_id}',
+        turn_changed_event(room, next_player.display_name)
     )
-    async_to_sync(channel_layer.group_send)(
-        f'game_{room_id}',
-        {
-            'type': 'refresh_room_state'
-        }
+    async_to_sync(group_send)(
+        channel_layer, f'game_{room_id}', turn_skipped_message(room.current_turn_team, display_name)
     )
+    # Build the new state once here and fan it out; consumers personalize in memory
+    snapshot = get_room_snapshot(room_id)
+    if snapshot:
+        for group, message in room_state_sends(room_id, snapshot):
+            async_to_sync(group_send)(channel_layer, group, message)
+    return room
+
+
+def overdue_turns(slack):
+    """(room_id, epoch) of playing rooms whose turn expired more than grace + `slack` seconds ago.
+
+    Their deadline's owner is gone (e.g. its process died), so any process may skip them.
+    """
+    cutoff = timezone.now() - timedelta(seconds=SKIP_GRACE_SECONDS + slack)
+    rooms = GameRoom.objects.filter(
+        status=GameRoom.PLAYING, turn_deadline__lt=cutoff, turn_start_time__isnull=False
+    ).values_list('id', 'turn_start_time')
+    return [(str(room_id), int(started.timestamp())) for room_id, started in rooms]
+
+
+def claim_expired_turns(now, limit=SWEEP_BATCH_SIZE):
+    """Lock up to `limit` playing rooms whose turn_deadline has passed and move their deadlines on.
+
+    SKIP LOCKED lets concurrent sweepers split the expired rooms instead of queueing
+    behind each other's locks. A room whose turn limit just ran out gets its grace
+    period as the new deadline; a room whose grace period ran out is leased for
+    SWEEP_LEASE_SECONDS until advance_expired_turn() gives it the next turn's deadline.
+    Returns (ids of rooms to announce, (room_id, epoch) of rooms to skip).
+    """
+    announce, skip = [], []
+    with transaction.atomic():
+        rooms = list(
+            GameRoom.objects.select_for_update(skip_locked=True)
+            .filter(status=GameRoom.PLAYING, turn_deadline__lte=now)
+            .order_by('turn_deadline')
+            .only('id', 'turn_start_time', 'turn_time_limit', 'turn_deadline')[:limit]
+        )
+        for room in rooms:
+            expires = room.deadline_for(room.turn_start_time)
+            if expires is None:
+                room.turn_deadline = None
+            elif room.turn_deadline <= expires:
+                # Not announced yet: the deadline still is the end of the turn itself
+                room.turn_deadline = expires + timedelta(seconds=SKIP_GRACE_SECONDS)
+                announce.append(str(room.id))
+            else:
+                room.turn_deadline = now + timedelta(seconds=SWEEP_LEASE_SECONDS)
+                skip.append((str(room.id), int(room.turn_start_time.timestamp())))
+        GameRoom.objects.bulk_update(rooms, ['turn_deadline'])
+    return announce, skip
+
+
+def sweep_turn_deadlines(batch_size=SWEEP_BATCH_SIZE):
+    """Announce or skip every expired turn, `batch_size` rooms per transaction.
+
+    Broadcasts happen after each batch commits. Returns (announced, skipped).
+    """
+    now = timezone.now()
+    announced = skipped = 0
+    while True:
+        announce, skip = claim_expired_turns(now, batch_size)
+        for room_id in announce:
+            announce_timeout(room_id)
+        for room_id, epoch in skip:
+            if advance_expired_turn(room_id, epoch):
+                skipped += 1
+        announced += len(announce)
+        if len(announce) + len(skip) < batch_size:
+            return announced, skipped
+
+
+@shared_task
+def check_turn_timeout(room_id, turn_started=None):
+    """Detect turn expiry and announce upcoming skip (without switching immediately)."""
+    result = announce_if_expired(room_id, turn_started)
+    if result is None:
+        return
+    expired, value = result
+    if expired:
+        skip_turn.apply_async(args=[str(room_id), value], countdown=SKIP_GRACE_SECONDS)
+    else:
+        check_turn_timeout.apply_async(args=[str(room_id), turn_started], countdown=value)
+
+
+@shared_task
+def sweep_expired_turns():
+    """Periodic (celery beat) turn deadline sweep for TURN_TIMERS = 'sweep'."""
+    return sweep_turn_deadlines()
 
-    # Schedule next timeout check for new turn
-    check_turn_timeout.apply_async(args=[str(room_id)], countdown=room.turn_time_limit)
+
+@shared_task(bind=True)
+def purge_old_games(self):
+    """Periodic (celery beat) retention run; progress is visible as the task's PROGRESS state."""
+    from .retention import run_retention
+    return run_retention(progress=lambda report: self.update_state(state='PROGRESS', meta=dict(report)))
+
+
+@shared_task
+def skip_turn(room_id, original_turn_start_epoch):
+    """Skip the current turn if still the same expired turn and advance to next team's player."""
+    from .timers import schedule_turn_timeout
+    room = advance_expired_turn(room_id, original_turn_start_epoch)
+    if room:
+        # Schedule next timeout check for new turn
+        schedule_turn_timeout(room)
@@ -1,3 +1,1182 @@
-from django.test import TestCase
+"""Tests for the game app, and query budgets for GameConsumer messages and the game views.
 
-# Create your tests here.
+QueryBudgetTests only checks budgets; each feature's behaviour is tested in
+its own TestCase, driving the same views and sockets through GuestClient.
+QueryRecorder attributes every SQL statement (and its time) to the handler
+invocation that issued it: ``ws:<message type>`` for each message handled by
+GameConsumer.receive, ``ws:connect`` for the socket handshake and
+``view:<url name> <METHOD>`` for the REST views. A test fails when any
+invocation runs more queries than QUERY_BUDGETS allows for its handler, or
+when a handler has no declared budget.
+
+Needs no outside services (in-memory channel layer and cache):
+
+    DB_ENGINE=sqlite3 python manage.py test game
+
+or against a local Postgres with DB_SSLMODE=disable and the usual DB_* vars.
+"""
+import asyncio
+import base64
+import contextvars
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+import msgpack
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.backends import utils
+from django.test import Client, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+
+from numdle_backend.asgi import application
+from . import views
+from .coalescer import FrameCoalescer
+from .consumers import GameConsumer
+from . import guests
+from .guests import clear_guest_cache
+from .models import GameArchive, GameRoom, Guess, Player, TeamStrategy, UserMessage
+from .room_state import get_room_snapshot
+from . import coalescer, engine, metrics, retention, spectators, tasks, wire
+from . import strategy as strategy_module
+from .tasks import check_turn_timeout
+from .timers import TimerWheel, schedule_turn_timeout
+
+# Maximum queries per handler invocation. The room state bundle a message
+# handler gathers for its broadcast is budgeted on its own, as
+# ws:room_state_bundle, so handler budgets cover the handler's own work only.
+# SQLite logs the BEGIN of each transaction as a query.
+QUERY_BUDGETS = {
+    # Snapshot rebuild (players with their room, guesses) and the team strategy,
+    # created on first use (SELECT, BEGIN, INSERT)
+    'ws:room_state_bundle': 5,
+    # The player lookup; in actor mode also the room actor's load (2) and its
+    # player re-read on attach, and the strategy init (3, as in the bundle)
+    'ws:connect': 7,
+    # Transaction, locked players + room, room save, teammates, analytics when the game starts
+    'ws:set_secret_number': 5,
+    # Transaction, players + room + guess count, turn claim, guess; a win adds the winner and analytics
+    'ws:make_guess': 6,
+    'ws:change_team': 2,
+    'ws:start_game': 4,
+    'ws:get_room_state': 0,
+    'ws:resync': 0,
+    'ws:get_team_strategy': 2,
+    'ws:update_team_strategy': 5,
+    # The handler only buffers; this is the write-behind flush its first patch schedules
+    'ws:patch_team_strategy': 4,
+    # Spectator sockets: one cached snapshot per room and process, nothing while the cache is warm
+    'ws:watch': 0,
+    'view:health GET': 0,
+    'view:metrics GET': 0,
+    'view:game_rooms GET': 1,
+    'view:game_rooms POST': 2,
+    'view:join_room POST': 9,
+    'view:room_detail GET': 3,
+    # One INSERT per copied player (two here)
+    'view:rematch POST': 6,
+    'view:submit_message POST': 1,
+    'view:admin_analytics GET': 2,
+    'view:admin_list_rooms GET': 1,
+    'view:admin_list_messages GET': 2,
+}
+
+_invocation = contextvars.ContextVar('query_budget_invocation', default=None)
+
+
+class QueryRecorder:
+    """Records (sql, seconds) per handler invocation while installed."""
+
+    def __init__(self):
+        self.invocations = defaultdict(list)  # handler -> [[(sql, seconds), ...], ...]
+
+    @contextmanager
+    def handler(self, name):
+        queries = []
+        self.invocations[name].append(queries)
+        token = _invocation.set(queries)
+        try:
+            yield queries
+        finally:
+            _invocation.reset(token)
+
+    @staticmethod
+    def _timed(execute):
+        def wrapper(cursor, sql, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return execute(cursor, sql, *args, **kwargs)
+            finally:
+                # Context variables follow database_sync_to_async into its thread
+                queries = _invocation.get()
+                if queries is not None:
+                    queries.append((sql, time.perf_counter() - start))
+        return wrapper
+
+    @contextmanager
+    def installed(self):
+        recorder = self
+        receive = GameConsumer.receive
+        connect = GameConsumer.connect
+        room_state_bundle = GameConsumer._room_state_bundle
+
+        async def instrumented_receive(consumer, text_data=None, bytes_data=None):
+            if text_data is None:
+                # Rejected before any handler runs
+                await receive(consumer, text_data, bytes_data)
+                return
+            with recorder.handler(f"ws:{json.loads(text_data).get('type')}"):
+                await receive(consumer, text_data)
+
+        async def instrumented_connect(consumer):
+            with recorder.handler('ws:connect'):
+                await connect(consumer)
+
+        def instrumented_bundle(consumer):
+            with recorder.handler('ws:room_state_bundle'):
+                return room_state_bundle(consumer)
+
+        with mock.patch.object(utils.CursorWrapper, '_execute', self._timed(utils.CursorWrapper._execute)), \
+                mock.patch.object(utils.CursorWrapper, '_executemany', self._timed(utils.CursorWrapper._executemany)), \
+                mock.patch.object(GameConsumer, 'receive', instrumented_receive), \
+                mock.patch.object(GameConsumer, 'connect', instrumented_connect), \
+                mock.patch.object(GameConsumer, '_room_state_bundle', instrumented_bundle):
+            yield self
+
+    def over_budget(self):
+        """Human-readable budget violations, empty when every handler is within budget."""
+        problems = []
+        for name, runs in sorted(self.invocations.items()):
+            budget = QUERY_BUDGETS.get(name)
+            if budget is None:
+                problems.append(f"{name}: no query budget declared")
+                continue
+            worst = max(runs, key=len)
+            if len(worst) > budget:
+                statements = '\n    '.join(f'{seconds * 1000:.2f} ms  {sql[:120]}' for sql, seconds in worst)
+                problems.append(f"{name}: {len(worst)} queries > budget {budget}\n    {statements}")
+        return problems
+
+
+class GuestClient:
+    """Plays through the real views and GameConsumer as guests; Celery turn timeouts are stubbed out."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        clear_guest_cache()
+        self.tokens = {}
+        self.client = Client()
+        # Turn timeouts go to Celery (TURN_TIMERS='celery'); no broker in tests
+        timeouts = mock.patch.object(check_turn_timeout, 'apply_async')
+        timeouts.start()
+        self.addCleanup(timeouts.stop)
+
+    def handler(self, name):
+        """Context the queries of one request run in; QueryBudgetTests records them under `name`."""
+        return nullcontext()
+
+    def request(self, method, path, data=None, **extra):
+        match = resolve(path.partition('?')[0])
+        with self.handler(f'view:{match.url_name} {method}'):
+            return getattr(self.client, method.lower())(
+                path, json.dumps(data) if data is not None else None,
+                content_type='application/json', **extra
+            )
+
+    def create_room(self, max_players=2, **fields):
+        response = self.request('POST', '/api/rooms/', {'max_players': max_players, **fields})
+        return response.json()['room_id']
+
+    def join(self, room_id, name):
+        response = self.request('POST', f'/api/rooms/{room_id}/join/', {'username': name, 'device_id': self.device(name)})
+        if response.status_code == 200:
+            self.tokens[name] = response.json()['guest_token']
+        return response
+
+    @staticmethod
+    def device(name):
+        # Guest ids must look like hex/uuid
+        return name.encode().hex()[:8].ljust(8, '0') + '-0000'
+
+    def socket(self, room_id, name, protocol='full', subprotocols=None):
+        # Sockets authenticate with the signed token from their join
+        return WebsocketCommunicator(
+            application, f'/ws/game/{room_id}/?guest_token={self.tokens[name]}&protocol={protocol}',
+            subprotocols=subprotocols)
+
+    @staticmethod
+    async def drain(communicator):
+        frames = []
+        while not await communicator.receive_nothing(timeout=0.1):
+            raw = await communicator.receive_from()
+            frame = msgpack.unpackb(raw) if isinstance(raw, bytes) else json.loads(raw)
+            frames.extend(frame['frames'] if frame['type'] == 'batch' else [frame])
+        return frames
+
+    async def send(self, communicator, message):
+        await communicator.send_to(text_data=json.dumps(message))
+        return await self.drain(communicator)
+
+    def admin_headers(self):
+        return {'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(b'admin:secret').decode()}
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    TURN_TIMERS='celery',
+)
+class QueryBudgetTests(GuestClient, TransactionTestCase):
+    """Drives the real views and GameConsumer and checks every handler against its budget."""
+
+    def setUp(self):
+        super().setUp()
+        self.recorder = QueryRecorder()
+        installed = self.recorder.installed()
+        installed.__enter__()
+        self.addCleanup(installed.__exit__, None, None, None)
+
+    def handler(self, name):
+        return self.recorder.handler(name)
+
+    def assertWithinBudgets(self):
+        problems = self.recorder.over_budget()
+        if problems:
+            self.fail('\n' + '\n'.join(problems))
+
+    def test_room_list_is_constant_in_room_count(self):
+        for rooms in (1, 8):
+            for i in range(rooms):
+                room_id = self.create_room()
+                self.join(room_id, f'p{rooms}{i}')
+            self.request('GET', '/api/rooms/')
+        counts = [len(q) for q in self.recorder.invocations['view:game_rooms GET']]
+        self.assertEqual(counts[0], counts[1])
+        self.assertWithinBudgets()
+
+    def test_lobby_pages(self):
+        rooms = [self.create_room(max_players=4) for _ in range(3)]
+        self.join(rooms[0], 'x')
+        self.request('GET', '/api/rooms/?limit=2')
+        self.request('GET', '/api/rooms/?min_players=1&has_space=true')
+        first = self.request('GET', '/api/rooms/')
+        self.request('GET', '/api/rooms/', HTTP_IF_NONE_MATCH=first['ETag'])
+        # A lobby that has not changed is answered from its ETag alone
+        self.assertEqual(self.recorder.invocations['view:game_rooms GET'][-1], [])
+        self.assertWithinBudgets()
+
+    def test_room_views(self):
+        room_id = self.create_room()
+        self.join(room_id, 'alice')
+        self.join(room_id, 'bob')
+        self.request('GET', f'/api/rooms/{room_id}/')
+        GameRoom.objects.filter(id=room_id).update(status=GameRoom.FINISHED)
+        self.request('POST', f'/api/rooms/{room_id}/rematch/', {'username': 'alice', 'device_id': self.device('alice')})
+        self.request('GET', '/api/health/')
+        self.request('POST', '/api/messages/submit/', {'username': 'alice', 'subject': 's', 'message': 'm'})
+        self.assertWithinBudgets()
+
+    def test_admin_views(self):
+        for i in range(4):
+            room_id = self.create_room()
+            self.join(room_id, f'a{i}')
+            UserMessage.objects.create(username=f'a{i}', subject='s', message='m')
+        with mock.patch.object(views, 'ADMIN_USER', 'admin'), mock.patch.object(views, 'ADMIN_PASS', 'secret'):
+            for path in ('/api/admin/analytics/', '/api/admin/analytics/?since=2000-01-01', '/api/admin/rooms/',
+                         '/api/admin/messages/', '/api/admin/messages/?limit=3'):
+                self.request('GET', path, **self.admin_headers())
+            export = self.request('GET', '/api/admin/rooms/?format=ndjson', **self.admin_headers())
+            b''.join(export.streaming_content)
+        self.assertWithinBudgets()
+
+    async def test_game_messages(self):
+        room_id = await sync_to_async(self.create_room)()
+        await sync_to_async(self.join)(room_id, 'alice')
+        await sync_to_async(self.join)(room_id, 'bob')
+        alice, bob = self.socket(room_id, 'alice'), self.socket(room_id, 'bob', protocol='delta')
+        await alice.connect()
+        await bob.connect()
+        await self.drain(bob)
+
+        await self.send(alice, {'type': 'change_team', 'team': 'A'})
+        await self.send(alice, {'type': 'start_game'})
+        await self.send(alice, {'type': 'get_room_state'})
+        await self.send(alice, {'type': 'resync'})
+        frames = await self.send(alice, {'type': 'get_team_strategy'})
+        strategy = next(f['data'] for f in frames if f['type'] == 'team_strategy_update')
+        await self.send(alice, {
+            'type': 'update_team_strategy', 'version': strategy['version'], 'notes': 'n',
+            'slot_digits': strategy['slot_digits'], 'draft_guess': strategy['draft_guess'],
+        })
+        await alice.send_to(text_data=json.dumps({
+            'type': 'patch_team_strategy', 'base': strategy['version'] + 1, 'client': 'c1', 'seq': 1,
+            'ops': [{'op': 'set_draft', 'index': 0, 'digit': '7'}],
+        }))
+        await asyncio.sleep(strategy_module.FLUSH_INTERVAL)
+        await self.send(alice, {'type': 'set_secret_number', 'number': '1234'})
+        await self.send(bob, {'type': 'set_secret_number', 'number': '5678'})
+        # A rejected guess (not bob's turn), two real turns and the win
+        await self.send(bob, {'type': 'make_guess', 'guess': '1243'})
+        await self.send(alice, {'type': 'make_guess', 'guess': '5687'})
+        await self.send(bob, {'type': 'make_guess', 'guess': '1243'})
+        await self.send(alice, {'type': 'make_guess', 'guess': '5678'})
+        await alice.disconnect()
+        await bob.disconnect()
+
+        self.assertEqual(len(self.recorder.invocations['ws:make_guess']), 4)
+        # Every message is one unit of work: at most one database_sync_to_async hop
+        for (message_type,), row in metrics.ws_message_hops.values.items():
+            self.assertEqual(sum(row[2:-1]), 0, f'{message_type} took more than one hop')
+        await sync_to_async(self.request)('GET', '/api/metrics/')
+        self.assertWithinBudgets()
+
+    async def test_spectators(self):
+        room_id = await sync_to_async(self.create_room)()
+        await sync_to_async(self.join)(room_id, 'alice')
+        watchers = [WebsocketCommunicator(application, f'/ws/watch/{room_id}/') for _ in range(2)]
+        with self.recorder.handler('ws:watch'):
+            for watcher in watchers:
+                await watcher.connect()
+                await self.drain(watcher)
+        for watcher in watchers:
+            await watcher.disconnect()
+        self.assertWithinBudgets()
+
+    async def test_actor_engine(self):
+        actor_engine(self)
+        room_id = await sync_to_async(self.create_room)()
+        await sync_to_async(self.join)(room_id, 'alice')
+        await sync_to_async(self.join)(room_id, 'bob')
+        alice, bob = self.socket(room_id, 'alice'), self.socket(room_id, 'bob')
+        await alice.connect()
+        await bob.connect()
+        await self.send(alice, {'type': 'start_game'})
+        await self.send(alice, {'type': 'set_secret_number', 'number': '1234'})
+        await self.send(bob, {'type': 'set_secret_number', 'number': '5678'})
+        await self.send(alice, {'type': 'make_guess', 'guess': '5687'})
+        await self.send(bob, {'type': 'make_guess', 'guess': '1243'})
+        await self.send(alice, {'type': 'make_guess', 'guess': '5678'})
+        # Guesses are played on the loaded actor: the only query is the team strategy read for the room state push
+        tables = [{sql.split(' FROM ')[1].split()[0] for sql, _ in run} for run in self.recorder.invocations['ws:make_guess']]
+        self.assertEqual(tables, [{'"game_teamstrategy"'}] * 3)
+        await alice.disconnect()
+        await bob.disconnect()
+        self.assertWithinBudgets()
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    TURN_TIMERS='celery',
+)
+class LobbyTests(GuestClient, TransactionTestCase):
+    """The room list pages, filters and revalidates by ETag; the lobby socket streams room changes."""
+
+    def test_pages(self):
+        rooms = [self.create_room(max_players=4) for _ in range(5)]
+        for name in ('x', 'y'):
+            self.join(rooms[0], name)
+        self.join(rooms[1], 'z')
+        seen, cursor = [], ''
+        while True:
+            page = self.request('GET', f'/api/rooms/?limit=2&cursor={cursor}').json()
+            self.assertLessEqual(len(page['rooms']), 2)
+            seen += [r['id'] for r in page['rooms']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, rooms[::-1])
+        crowded = self.request('GET', '/api/rooms/?min_players=1&has_space=true').json()['rooms']
+        self.assertEqual([r['id'] for r in crowded], [rooms[1], rooms[0]])
+        self.assertEqual(self.request('GET', '/api/rooms/?private=true').json()['rooms'], [])
+        self.assertEqual(self.request('GET', '/api/rooms/?limit=0').status_code, 400)
+
+        first = self.request('GET', '/api/rooms/')
+        self.assertEqual(self.request('GET', '/api/rooms/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        listed = f'"other", W/{first["ETag"]}'
+        self.assertEqual(self.request('GET', '/api/rooms/', HTTP_IF_NONE_MATCH=listed).status_code, 304)
+        # Only whole tags match, not headers that merely contain one
+        self.assertEqual(self.request('GET', '/api/rooms/', HTTP_IF_NONE_MATCH=first['ETag'] + 'x').status_code, 200)
+        self.join(rooms[2], 'w')
+        self.assertEqual(self.request('GET', '/api/rooms/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    async def test_socket(self):
+        lobby_socket = WebsocketCommunicator(application, '/ws/lobby/')
+        self.assertTrue((await lobby_socket.connect())[0])
+        snapshot = await lobby_socket.receive_json_from()
+        self.assertEqual((snapshot['type'], snapshot['data']['rooms']), ('lobby_snapshot', []))
+
+        room_id = await sync_to_async(self.create_room)()
+        await sync_to_async(self.join)(room_id, 'alice')
+        await sync_to_async(self.join)(room_id, 'bob')
+        alice, bob = self.socket(room_id, 'alice'), self.socket(room_id, 'bob')
+        await alice.connect()
+        await bob.connect()
+        await self.send(alice, {'type': 'set_secret_number', 'number': '1234'})
+        await self.send(bob, {'type': 'set_secret_number', 'number': '5678'})
+        events = []
+        while not await lobby_socket.receive_nothing(timeout=0.1):
+            frame = await lobby_socket.receive_json_from()
+            events.append((frame['event'], frame['room']))
+        self.assertEqual([e for e, _ in events], ['room_created', 'room_updated', 'room_updated', 'room_closed'])
+        self.assertEqual(events[2][1], {'id': room_id, 'player_count': 2, 'status': GameRoom.SETTING_NUMBERS})
+        self.assertTrue(all(room['id'] == room_id for _, room in events))
+
+        await lobby_socket.send_json_to({'type': 'resync'})
+        self.assertEqual((await lobby_socket.receive_json_from())['data']['rooms'], [])
+        for communicator in (alice, bob, lobby_socket):
+            await communicator.disconnect()
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class AdminViewTests(GuestClient, TransactionTestCase):
+    """The admin views page messages, filter and export rooms and count games over a date range."""
+
+    def setUp(self):
+        super().setUp()
+        for name, value in (('ADMIN_USER', 'admin'), ('ADMIN_PASS', 'secret')):
+            patch = mock.patch.object(views, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_admin_views(self):
+        for i in range(4):
+            room_id = self.create_room()
+            self.join(room_id, f'a{i}')
+            UserMessage.objects.create(username=f'a{i}', subject='s', message='m')
+        for path in ('/api/admin/analytics/', '/api/admin/rooms/', '/api/admin/messages/'):
+            self.assertEqual(self.request('GET', path, **self.admin_headers()).status_code, 200)
+        stats = self.request('GET', '/api/admin/analytics/?since=2000-01-01', **self.admin_headers()).json()
+        bad = self.request('GET', '/api/admin/analytics/?since=yesterday', **self.admin_headers())
+        pages, cursor = [], ''
+        while cursor is not None:
+            page = self.request('GET', f'/api/admin/messages/?limit=3&cursor={cursor}', **self.admin_headers()).json()
+            pages.append([m['username'] for m in page['messages']])
+            cursor = page['next_cursor']
+        export = self.request('GET', '/api/admin/rooms/?format=ndjson&status=waiting', **self.admin_headers())
+        rows = [json.loads(line) for line in b''.join(export.streaming_content).splitlines()]
+        bad_filter = self.request('GET', '/api/admin/rooms/?status=lost', **self.admin_headers())
+        self.assertEqual(pages, [['a3', 'a2', 'a1'], ['a0']])
+        self.assertEqual(page['total_count'], 4)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(bad_filter.status_code, 400)
+        self.assertEqual((stats['total_rooms'], stats['total_players']), (4, 4))
+        self.assertEqual(stats['status_breakdown'], {GameRoom.WAITING: 4})
+        self.assertEqual((stats['range']['rooms_created'], stats['range']['players_joined']), (4, 4))
+        self.assertEqual(bad.status_code, 400)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    TURN_TIMERS='celery',
+)
+class GameMessageTests(GuestClient, TransactionTestCase):
+    """A game played over GameConsumer: team groups, strategy patches, secret routing, rematch and the stats it leaves."""
+
+    async def test_game_messages(self):
+        room_id = await sync_to_async(self.create_room)()
+        await sync_to_async(self.join)(room_id, 'alice')
+        await sync_to_async(self.join)(room_id, 'bob')
+        alice, bob = self.socket(room_id, 'alice'), self.socket(room_id, 'bob', protocol='delta')
+        self.assertTrue((await alice.connect())[0])
+        self.assertTrue((await bob.connect())[0])
+        await self.drain(alice)
+        await self.drain(bob)
+
+        await self.send(alice, {'type': 'change_team', 'team': 'A'})
+        # Each socket is in its team's group; team-private messages go there
+        groups = get_channel_layer().groups
+        self.assertEqual((len(groups[f'game_{room_id}_A']), len(groups[f'game_{room_id}_B'])), (1, 1))
+        await self.send(alice, {'type': 'start_game'})
+        frames = await self.send(alice, {'type': 'get_team_strategy'})
+        strategy = next(f['data'] for f in frames if f['type'] == 'team_strategy_update')
+        await self.send(alice, {
+            'type': 'update_team_strategy', 'version': strategy['version'], 'notes': 'n',
+            'slot_digits': strategy['slot_digits'], 'draft_guess': strategy['draft_guess'],
+        })
+        # Two patches within one flush interval: one UPDATE, one team_strategy_patch
+        base = strategy['version'] + 1
+        writes = metrics.strategy_writes.values.get((), 0)
+        await alice.send_to(text_data=json.dumps({
+            'type': 'patch_team_strategy', 'base': base, 'client': 'c1', 'seq': 1,
+            'ops': [{'op': 'set_cell', 'row': 0, 'col': 3, 'value': 1}, {'op': 'splice', 'at': 1, 'delete': 0, 'insert': 'ote'}],
+        }))
+        await alice.send_to(text_data=json.dumps({
+            'type': 'patch_team_strategy', 'base': base, 'client': 'c1', 'seq': 2,
+            'ops': [{'op': 'set_draft', 'index': 0, 'digit': '7'}, {'op': 'set_cell', 'row': 9, 'col': 0, 'value': 1}],
+        }))
+        await asyncio.sleep(strategy_module.FLUSH_INTERVAL)
+        patches = [f['data'] for f in await self.drain(alice) if f['type'] == 'team_strategy_patch']
+        self.assertEqual([(p['version'], [q['seq'] for q in p['patches']]) for p in patches], [(base + 1, [1, 2])])
+        self.assertFalse([f for f in await self.drain(bob) if f['type'] == 'team_strategy_patch'])
+        ts = await TeamStrategy.objects.aget(room_id=room_id, team='A')
+        self.assertEqual((ts.notes, ts.slot_digits[0][3], ts.draft_guess[0], ts.version), ('note', 1, '7', base + 1))
+        self.assertEqual(metrics.strategy_writes.values[()] - writes, 1)
+        with mock.patch.object(metrics, 'group_send', wraps=metrics.group_send) as group_send:
+            await self.send(alice, {'type': 'set_secret_number', 'number': '1234'})
+        # The secret_set delta carries the secret to the team's own group only
+        deltas = [c.args[1:] for c in group_send.call_args_list if c.args[2]['type'] == 'room_delta']
+        self.assertEqual(
+            [(group, 'private' in message) for group, message in deltas],
+            [(f'game_{room_id}_A', True), (f'game_{room_id}', False)],
+        )
+        frames = await self.send(bob, {'type': 'set_secret_number', 'number': '5678'})
+        # The other team's secret_set delta comes without its secret (and only once)
+        secret_set = [f['data'] for f in frames if f['type'] == 'room_delta' and f['event'] == 'secret_set']
+        self.assertEqual([d.get('secret_number') for d in secret_set], [None, '5678'])
+        await self.drain(alice)
+        # A rejected guess (not bob's turn) and two real turns
+        frames = await self.send(bob, {'type': 'make_guess', 'guess': '1243'})
+        self.assertIn('Not your turn', [f.get('message') for f in frames])
+        await self.send(alice, {'type': 'make_guess', 'guess': '5687'})
+        await self.send(bob, {'type': 'make_guess', 'guess': '1243'})
+        frames = await self.send(alice, {'type': 'make_guess', 'guess': '5678'})
+        state = [f for f in frames if f['type'] == 'room_state_update'][-1]['data']
+        self.assertEqual(state['status'], GameRoom.FINISHED)
+        self.assertEqual(len(state['guesses']), 3)
+        await alice.disconnect()
+        await bob.disconnect()
+
+        response = await sync_to_async(self.request)(
+            'POST', f'/api/rooms/{room_id}/rematch/', {'username': 'alice', 'device_id': self.device('alice')})
+        self.assertEqual(response.status_code, 200)
+        rematch = await GameRoom.objects.aget(id=response.json()['room_id'])
+        self.assertEqual(await Player.objects.filter(room=rematch).acount(), 2)
+        with mock.patch.object(views, 'ADMIN_USER', 'admin'), mock.patch.object(views, 'ADMIN_PASS', 'secret'):
+            stats = (await sync_to_async(self.request)('GET', '/api/admin/analytics/', **self.admin_headers())).json()
+        self.assertEqual(stats['status_breakdown'], {GameRoom.FINISHED: 1, rematch.status: 1})
+        self.assertEqual((stats['games_started'], stats['games_finished'], stats['average_guesses_to_win']), (1, 1, 3))
+        self.assertEqual(stats['range']['games_per_hour'][0]['games'], 1)
+        exposition = (await sync_to_async(self.request)('GET', '/api/metrics/')).content.decode()
+        self.assertIn('numdle_ws_messages_total{type="make_guess"}', exposition)
+        self.assertIn('numdle_ws_active_sockets 0', exposition)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    TURN_TIMERS='celery',
+)
+class WireFormatTests(GuestClient, TransactionTestCase):
+    """Broadcasts are encoded once per audience, in the compact binary format where a socket negotiated it."""
+
+    async def test_compact_wire_format(self):
+        room_id = await sync_to_async(self.create_room)()
+        await sync_to_async(self.join)(room_id, 'alice')
+        await sync_to_async(self.join)(room_id, 'bob')
+        alice = self.socket(room_id, 'alice', protocol='delta', subprotocols=[wire.COMPACT_PROTOCOL])
+        bob = self.socket(room_id, 'bob', protocol='delta', subprotocols=['other', wire.COMPACT_PROTOCOL])
+        self.assertEqual(await alice.connect(), (True, wire.COMPACT_PROTOCOL))
+        self.assertEqual(await bob.connect(), (True, wire.COMPACT_PROTOCOL))
+        frames = await self.drain(alice)
+        await self.drain(bob)
+        players = {p['username']: p['id'] for p in frames[-1]['data']['players']}
+
+        await self.send(alice, {'type': 'change_team', 'team': 'A'})
+        await self.send(alice, {'type': 'start_game'})
+        await self.send(alice, {'type': 'set_secret_number', 'number': '1234'})
+        await self.send(bob, {'type': 'set_secret_number', 'number': '5678'})
+        await self.drain(alice)
+        await self.drain(bob)
+        with mock.patch.object(wire.CompactCodec, 'encode', autospec=True, side_effect=wire.CompactCodec.encode) as encode:
+            frames = await self.send(alice, {'type': 'make_guess', 'guess': '5687'})
+            frames_bob = await self.drain(bob)
+        added = [f['data'] for f in frames + frames_bob if f['type'] == 'room_delta' and f['event'] == 'guess_added']
+        self.assertEqual(len(added), 2)
+        self.assertEqual(added[0][:6], [players['alice'], players['bob'], '5687', 2, 2, False])
+        self.assertIsInstance(added[0][6], int)
+        # Encoded once for both sockets
+        encoded = [c.args[1] for c in encode.call_args_list if c.args[1].get('event') == 'guess_added']
+        self.assertEqual(len(encoded), 1)
+
+        frames = await self.send(alice, {'type': 'resync'})
+        state = next(f['data'] for f in frames if f['type'] == 'room_state_update')
+        self.assertEqual(state['guesses'], [added[0]])
+        # Clients send JSON text even over the binary format
+        await alice.send_to(bytes_data=msgpack.packb({'type': 'resync'}))
+        self.assertEqual([f['type'] for f in await self.drain(alice)], ['game_message'])
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_broadcasts_encoded_once(self):
+        room_id = await sync_to_async(self.create_room)(max_players=4)
+        sockets = {}
+        for name in ('alice', 'bob', 'carol'):
+            await sync_to_async(self.join)(room_id, name)
+            sockets[name] = self.socket(room_id, name)
+            self.assertTrue((await sockets[name].connect())[0])
+        await self.send(sockets['bob'], {'type': 'change_team', 'team': 'A'})
+        await self.send(sockets['carol'], {'type': 'change_team', 'team': 'B'})
+        frames = [f for communicator in sockets.values() for f in await self.drain(communicator)]
+        state = next(f['data'] for f in reversed(frames) if f['type'] == 'room_state_update')
+        teams = {p['username']: p['team'] for p in state['players']}
+        self.assertEqual(teams, {'alice': 'A', 'bob': 'A', 'carol': 'B'})
+
+        def encoded(encode, kind):
+            return [c.args[1] for c in encode.call_args_list if c.args[1]['type'] == kind]
+
+        with mock.patch.object(wire.JsonCodec, 'encode', autospec=True, side_effect=wire.JsonCodec.encode) as encode:
+            frames = {'alice': await self.send(sockets['alice'], {'type': 'start_game'})}
+            for name in ('bob', 'carol'):
+                frames[name] = await self.drain(sockets[name])
+        for name in sockets:
+            self.assertIn('Game starting. Teams set your secrets!', [f.get('message') for f in frames[name]])
+        # No secret set yet: the group message and the room state are encoded by the sender only
+        self.assertEqual(len(encoded(encode, 'room_state_update')), 1)
+        self.assertEqual(len(encoded(encode, 'game_message')), 2)  # + alice's own reply
+
+        with mock.patch.object(wire.JsonCodec, 'encode', autospec=True, side_effect=wire.JsonCodec.encode) as encode, \
+                mock.patch.object(metrics, 'group_send', wraps=metrics.group_send) as group_send:
+            frames = {'alice': await self.send(sockets['alice'], {'type': 'set_secret_number', 'number': '1234'})}
+            for name in ('bob', 'carol'):
+                frames[name] = await self.drain(sockets[name])
+        # Team A's secret travels to team A's group only
+        sent = [c.args[1:] for c in group_send.call_args_list if c.args[2]['type'] == 'room_state_update']
+        self.assertEqual([group for group, _ in sent], [f'game_{room_id}_A', f'game_{room_id}'])
+        self.assertIn('1234', json.dumps(sent[0][1]['snapshot']))
+        self.assertNotIn('1234', json.dumps(sent[1][1]))
+        states = {
+            name: next(f['data'] for f in reversed(frames[name]) if f['type'] == 'room_state_update') for name in sockets
+        }
+        # Team A shares one personalized encoding; carol gets the sender's generic one
+        self.assertEqual(len(encoded(encode, 'room_state_update')), 2)
+        self.assertEqual(states['alice'], states['bob'])
+        self.assertEqual({p.get('secret_number') for p in states['bob']['players']}, {'1234', None})
+        self.assertNotIn('1234', json.dumps(states['carol']))
+        for communicator in sockets.values():
+            await communicator.disconnect()
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    TURN_TIMERS='celery',
+)
+class SpectatorSocketTests(GuestClient, TransactionTestCase):
+    """Anonymous viewers share one feed per room, never see a secret and cannot act."""
+
+    async def test_spectators(self):
+        room_id = await sync_to_async(self.create_room)()
+        await sync_to_async(self.join)(room_id, 'alice')
+        await sync_to_async(self.join)(room_id, 'bob')
+        alice = self.socket(room_id, 'alice')
+        bob = self.socket(room_id, 'bob')
+        await alice.connect()
+        await bob.connect()
+        await self.send(alice, {'type': 'change_team', 'team': 'A'})
+        await self.drain(bob)
+
+        fps = mock.patch.object(spectators, 'MAX_FPS', 50)
+        fps.start()
+        self.addCleanup(fps.stop)
+        load = mock.patch.object(spectators, 'get_room_snapshot', side_effect=spectators.get_room_snapshot)
+        loads = load.start()
+        self.addCleanup(load.stop)
+        # Anonymous, no player row; the second viewer shares the first one's feed
+        full = WebsocketCommunicator(application, f'/ws/watch/{room_id}/')
+        delta = WebsocketCommunicator(application, f'/ws/watch/{room_id}/?protocol=delta&fps=10')
+        self.assertTrue((await full.connect())[0])
+        self.assertTrue((await delta.connect())[0])
+        frames = await self.drain(full) + await self.drain(delta)
+        self.assertEqual(loads.call_count, 1)
+        self.assertEqual([f['type'] for f in frames], ['room_state_update'] * 2)
+        self.assertEqual(len(frames[0]['data']['players']), 2)
+
+        await self.send(alice, {'type': 'start_game'})
+        await self.send(alice, {'type': 'set_secret_number', 'number': '1234'})
+        await self.send(bob, {'type': 'set_secret_number', 'number': '5678'})
+        await self.send(alice, {'type': 'make_guess', 'guess': '1243'})
+        await asyncio.sleep(0.2)
+        seen = {'full': await self.drain(full), 'delta': await self.drain(delta)}
+        for frames in seen.values():
+            for frame in frames:
+                self.assertNotIn('1234', json.dumps(frame))
+                self.assertNotIn('5678', json.dumps(frame))
+        self.assertEqual({f['type'] for f in seen['full']}, {'room_state_update'})
+        self.assertEqual(seen['full'][-1]['data']['guesses'][0]['guess'], '1243')
+        self.assertIn('guess_added', [f.get('event') for f in seen['delta']])
+        # Viewers are rejected by nothing but a missing room, and cannot act
+        await full.send_to(text_data=json.dumps({'type': 'make_guess', 'guess': '5678'}))
+        self.assertEqual(await self.drain(full), [])
+        self.assertFalse((await WebsocketCommunicator(application, '/ws/watch/0000/').connect())[0])
+
+        for communicator in (full, delta, alice, bob):
+            await communicator.disconnect()
+        self.assertEqual(spectators._feeds, {})
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    TURN_TIMERS='celery',
+)
+class ActorEngineTests(GuestClient, TransactionTestCase):
+    """With GAME_ENGINE = 'actor', GameConsumer plays on the room actor, which flushes when the last socket leaves."""
+
+    async def test_actor_engine(self):
+        actor_engine(self)
+        room_id = await sync_to_async(self.create_room)()
+        await sync_to_async(self.join)(room_id, 'alice')
+        alice = self.socket(room_id, 'alice')
+        self.assertTrue((await alice.connect())[0])
+        # bob joins (REST) behind the loaded actor; his socket's attach merges the join in
+        await sync_to_async(self.join)(room_id, 'bob')
+        bob = self.socket(room_id, 'bob', protocol='delta')
+        self.assertTrue((await bob.connect())[0])
+        state = next(f['data'] for f in await self.drain(bob) if f['type'] == 'room_state_update')
+        await self.drain(alice)
+        self.assertEqual(state['status'], GameRoom.SETTING_NUMBERS)
+        self.assertEqual({p['username']: p['team'] for p in state['players']}, {'alice': 'A', 'bob': 'B'})
+        actor = engine._actors[room_id]
+
+        # The strategy follows the actor's team before the change reaches the database
+        await self.send(alice, {'type': 'change_team', 'team': 'B'})
+        frames = await self.send(alice, {'type': 'get_team_strategy'})
+        self.assertEqual(next(f['data'] for f in frames if f['type'] == 'team_strategy_update')['team'], 'B')
+        self.assertEqual((await Player.objects.aget(room_id=room_id, display_name='alice')).team, 'A')
+        await self.send(alice, {'type': 'change_team', 'team': 'A'})
+
+        await self.send(alice, {'type': 'start_game'})
+        await self.send(alice, {'type': 'set_secret_number', 'number': '1234'})
+        await self.send(bob, {'type': 'set_secret_number', 'number': '5678'})
+        bob_id = next(p['id'] for p in state['players'] if p['username'] == 'bob')
+        await self.send(alice, {'type': 'make_guess', 'guess': '5687', 'target_player_id': str(bob_id)})
+        await self.send(bob, {'type': 'make_guess', 'guess': '1243'})
+        frames = await self.send(alice, {'type': 'make_guess', 'guess': '5678'})
+        self.assertEqual([f['data'] for f in frames if f['type'] == 'room_state_update'][-1]['status'], GameRoom.FINISHED)
+        frames = await self.send(alice, {'type': 'make_guess', 'guess': '5678'})
+        self.assertIn('Game is not in progress', [f.get('message') for f in frames])
+        # bob's deltas: one seq per change, the gaps only where a change has no delta event
+        seqs = [f['seq'] for f in await self.drain(bob) if f['type'] == 'room_delta']
+        self.assertEqual(seqs, sorted(set(seqs)))
+
+        await alice.disconnect()
+        await bob.disconnect()
+        # The last socket closes the actor, which flushes everything
+        self.assertNotIn(room_id, engine._actors)
+        room = await GameRoom.objects.aget(id=room_id)
+        self.assertEqual((room.status, room.engine_seq), (GameRoom.FINISHED, actor.seq))
+        self.assertEqual(await Guess.objects.filter(room_id=room_id).acount(), 3)
+
+
+class StrategyMergeTests(SimpleTestCase):
+    """merge_patches rebases concurrent notes splices and rejects bases older than its history."""
+
+    def doc(self, notes, version=1):
+        return TeamStrategy(team='A', notes=notes, version=version, **strategy_module.default_strategy())
+
+    @staticmethod
+    def patch(client, base, *ops):
+        return {'client': client, 'seq': 1, 'base': base, 'user_id': 1, 'reply_to': client, 'ops': list(ops)}
+
+    @staticmethod
+    def splice(at, delete, insert):
+        return {'op': 'splice', 'at': at, 'delete': delete, 'insert': insert}
+
+    def test_concurrent_splices_merge(self):
+        ts = self.doc('hello world')
+        applied, rejected = strategy_module.merge_patches(ts, [
+            self.patch('a', 1, self.splice(5, 0, ',')),
+            self.patch('b', 1, self.splice(6, 5, 'there'), {'op': 'set_cell', 'row': 1, 'col': 2, 'value': 2}),
+        ])
+        self.assertEqual((ts.notes, ts.version, ts.slot_digits[1][2], rejected), ('hello, there', 2, 2, []))
+        self.assertEqual(applied[1]['ops'][0], self.splice(7, 5, 'there'))
+        # A patch based on version 1 arriving in the next flush is rebased over both
+        strategy_module.merge_patches(ts, [self.patch('c', 1, self.splice(11, 0, '!'))])
+        self.assertEqual((ts.notes, ts.version), ('hello, there!', 3))
+
+    def test_overlapping_delete(self):
+        self.assertEqual(strategy_module.transform_splice((2, 6, 'X'), (4, 2, 'abc')), [(2, 2, 'X'), (6, 2, '')])
+        self.assertEqual(strategy_module.transform_splice((4, 0, 'X'), (4, 0, 'ab')), [(6, 0, 'X')])
+
+    def test_stale_base_rejected(self):
+        ts = self.doc('abc', version=9)
+        applied, rejected = strategy_module.merge_patches(ts, [
+            self.patch('a', 3, self.splice(0, 1, ''), {'op': 'set_draft', 'index': 2, 'digit': '4'}),
+        ])
+        self.assertEqual((ts.notes, ts.draft_guess[2], len(rejected)), ('abc', '4', 1))
+        self.assertEqual(applied[0]['ops'], [{'op': 'set_draft', 'index': 2, 'digit': '4'}])
+
+
+class FrameCoalescerTests(SimpleTestCase):
+    """A room state supersedes the pending state and deltas it covers; nothing it reflects is sent after it."""
+
+    async def coalesce(self, pushes):
+        sent = []
+
+        async def send(data):
+            sent.append(json.loads(data))
+
+        outbound = FrameCoalescer(send, window=0.01)
+        for frame, key, seq in pushes:
+            await outbound.push(frame, key=key, seq=seq)
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(sent), 1)
+        return sent[0]['frames'] if sent[0]['type'] == 'batch' else [sent[0]]
+
+    def state(self, version):
+        return {'type': 'room_state_update', 'data': {'version': version}}, 'room_state', version
+
+    def delta(self, seq):
+        return {'type': 'room_delta', 'seq': seq}, None, seq
+
+    def assertNothingCoveredAfterState(self, frames):
+        for i, frame in enumerate(frames):
+            if frame['type'] == 'room_state_update':
+                later = [f['seq'] for f in frames[i + 1:] if f['type'] == 'room_delta']
+                self.assertTrue(all(seq > frame['data']['version'] for seq in later), frames)
+
+    async def test_state_drops_covered_deltas(self):
+        before = dict(coalescer.stats)
+        frames = await self.coalesce([
+            self.state(5), self.delta(6),
+            ({'type': 'game_message', 'message': 'hi'}, None, None),
+            self.state(6),
+        ])
+        self.assertEqual([f['type'] for f in frames], ['game_message', 'room_state_update'])
+        counted = {key: coalescer.stats[key] - before[key] for key in before}
+        # Four frames, two superseded, the other two in one batch: three sends saved
+        self.assertEqual(
+            (counted['frames_queued'], counted['frames_superseded'], counted['frames_sent'], counted['frames_saved']),
+            (4, 2, 1, 3),
+        )
+        self.assertEqual(frames[1]['data']['version'], 6)
+        self.assertNothingCoveredAfterState(frames)
+
+    async def test_newer_deltas_follow_the_state(self):
+        frames = await self.coalesce([self.delta(6), self.delta(7), self.state(6), self.delta(8)])
+        self.assertEqual(
+            [(f['type'], f.get('seq', f.get('data', {}).get('version'))) for f in frames],
+            [('room_state_update', 6), ('room_delta', 7), ('room_delta', 8)],
+        )
+        self.assertNothingCoveredAfterState(frames)
+
+
+class TimerWheelTests(SimpleTestCase):
+    """The timing wheel fires every timer on its tick, across cascades, and cancels in place."""
+
+    def test_fires_on_time_across_levels(self):
+        wheel = TimerWheel(tick=1, slots=4, levels=3)
+        fired = []
+        delays = [1, 3, 4, 5, 15, 16, 17, 40, 47]
+        for delay in delays:
+            wheel.schedule(delay, lambda d=delay: fired.append((d, wheel.current)))
+        for _ in range(48):
+            wheel._advance()
+        self.assertEqual(fired, [(d, d) for d in delays])
+
+    def test_cancel(self):
+        wheel = TimerWheel(tick=1, slots=4, levels=3)
+        fired = []
+        keep = wheel.schedule(20, fired.append, 'keep')
+        drop = wheel.schedule(20, fired.append, 'drop')
+        for _ in range(10):
+            wheel._advance()
+        wheel.cancel(drop)
+        for _ in range(20):
+            wheel._advance()
+        self.assertEqual(fired, ['keep'])
+        self.assertIsNone(keep.slot)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class TurnDeadlineSweepTests(TransactionTestCase):
+    """sweep_turn_deadlines announces an expired turn, then skips it once the grace period is over."""
+
+    def playing_room(self, name, started_ago):
+        alice = User.objects.create(username=f'{name}-a')
+        bob = User.objects.create(username=f'{name}-b')
+        room = GameRoom(name=name, status=GameRoom.PLAYING, turn_time_limit=60,
+                        current_turn_player=alice, current_turn_team='A')
+        room.turn_start_time = timezone.now() - timedelta(seconds=started_ago)
+        room.turn_deadline = room.deadline_for(room.turn_start_time)
+        room.save()
+        Player.objects.create(room=room, user=alice, team='A', display_name='alice')
+        Player.objects.create(room=room, user=bob, team='B', display_name='bob')
+        return room
+
+    def test_announce_then_skip(self):
+        expired = [self.playing_room(f'r{i}', 61) for i in range(3)]
+        running = self.playing_room('running', 10)
+        self.assertEqual(tasks.sweep_turn_deadlines(batch_size=2), (3, 0))
+        self.assertEqual(tasks.sweep_turn_deadlines(batch_size=2), (0, 0))
+
+        GameRoom.objects.filter(pk__in=[r.pk for r in expired]).update(
+            turn_deadline=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(tasks.sweep_turn_deadlines(batch_size=2), (0, 3))
+        for room in GameRoom.objects.filter(pk__in=[r.pk for r in expired]):
+            self.assertEqual(room.current_turn_team, 'B')
+            self.assertEqual(room.turn_deadline, room.deadline_for(room.turn_start_time))
+        running.refresh_from_db()
+        self.assertEqual(running.current_turn_team, 'A')
+
+    @override_settings(TURN_TIMERS='celery')
+    def test_actor_rooms_arm_nothing(self):
+        room = self.playing_room('actor', 0)
+        with mock.patch.object(engine, 'ENGINE', 'actor'), mock.patch.object(check_turn_timeout, 'apply_async') as countdown:
+            schedule_turn_timeout(room)
+        countdown.assert_not_called()
+
+
+def actor_engine(test):
+    """Run `test` with GAME_ENGINE = 'actor', a scratch journal directory and flushes only when asked for."""
+    journal = tempfile.TemporaryDirectory()
+    test.addCleanup(journal.cleanup)
+    for name, value in (('ENGINE', 'actor'), ('JOURNAL_DIR', journal.name), ('FLUSH_INTERVAL', 60)):
+        patch = mock.patch.object(engine, name, value)
+        patch.start()
+        test.addCleanup(patch.stop)
+    return journal.name
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class RoomActorTests(TransactionTestCase):
+    """RoomActor plays a game in memory, persists it on flush and replays the journal a crashed process left."""
+
+    def setUp(self):
+        cache.clear()
+        self.journal_dir = actor_engine(self)
+
+    def playing_room(self):
+        alice = User.objects.create(username='actor-a')
+        bob = User.objects.create(username='actor-b')
+        room = GameRoom.objects.create(
+            name='actor', status=GameRoom.PLAYING, team_a_secret='1234', team_b_secret='5678',
+            current_turn_player=alice, current_turn_team='A', turn_start_time=timezone.now(),
+        )
+        self.alice = Player.objects.create(room=room, user=alice, team='A', display_name='alice', secret_number='1234')
+        self.bob = Player.objects.create(room=room, user=bob, team='B', display_name='bob', secret_number='5678')
+        return str(room.id)
+
+    async def test_guess_to_win(self):
+        room_id = await database_sync_to_async(self.playing_room)()
+        actor = await engine.get_actor(room_id)
+        loaded = actor.version
+        alice, bob = self.alice.user_id, self.bob.user_id
+
+        self.assertEqual(actor.make_guess(bob, '1243')[:2], (False, "Not your turn"))
+        self.assertEqual(actor.make_guess(alice, '5687', 'nobody')[:2], (False, "Invalid guess"))
+        ok, _, events = actor.make_guess(alice, '5687', str(self.bob.id))
+        self.assertTrue(ok)
+        self.assertEqual([e['event'] for e in events], ['guess_added', 'turn_changed'])
+        self.assertEqual(events[0]['data']['strikes'], 2)
+        events += actor.make_guess(bob, '1243')[2]
+        ok, _, won = actor.make_guess(alice, '5678')
+        events += won
+        self.assertEqual(won[-1]['data']['winner_username'], 'alice')
+        self.assertEqual(actor.make_guess(bob, '1234')[:2], (False, "Game is not in progress"))
+        # One seq per event, none of them a version the cache hands out
+        seqs = [e['seq'] for e in events]
+        self.assertEqual(seqs, list(range(loaded + 1, loaded + 1 + len(events))))
+        self.assertEqual(actor.snapshot()['version'], seqs[-1])
+
+        self.assertEqual(await Guess.objects.filter(room_id=room_id).acount(), 0)
+        await actor.flush()
+        room = await GameRoom.objects.aget(id=room_id)
+        self.assertEqual((room.status, room.engine_seq), (GameRoom.FINISHED, actor.seq))
+        self.assertEqual(await Guess.objects.filter(room_id=room_id).acount(), 3)
+        self.assertTrue((await Player.objects.aget(id=self.alice.id)).is_winner)
+        snapshot = await database_sync_to_async(get_room_snapshot)(room_id)
+        self.assertNotIn(snapshot['version'], [loaded] + seqs)
+        self.assertEqual(snapshot['state']['winner_username'], 'alice')
+        engine._actors.pop(room_id)
+        await actor.close()
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    async def test_replay_after_crash(self):
+        room_id = await database_sync_to_async(self.playing_room)()
+        actor = await engine.get_actor(room_id)
+        self.assertTrue(actor.make_guess(self.alice.user_id, '5687')[0])
+        # A failed flush keeps the entries journaled and pending
+        errors = engine.stats['flush_errors']
+        with mock.patch.object(engine, 'persist_entries', side_effect=RuntimeError('db down')), \
+                self.assertLogs('game.engine', 'ERROR'):
+            await actor.flush()
+        self.assertEqual(engine.stats['flush_errors'] - errors, 1)
+        self.assertEqual([entry['op'] for entry in actor.unflushed], ['guess', 'room'])
+        # The process dies: nothing flushed, journal left behind
+        for handle in (actor.flush_task, actor.turn_timer):
+            handle.cancel()
+        actor.journal.close()
+        engine._actors.pop(room_id)
+
+        with self.assertLogs('game.engine', 'WARNING') as logs:
+            reloaded = await database_sync_to_async(engine.RoomActor.load)(room_id)
+        self.assertIn('Replaying 2 journal entries', logs.output[0])
+        room = await GameRoom.objects.aget(id=room_id)
+        self.assertEqual(room.engine_seq, actor.seq)
+        self.assertEqual(room.current_turn_player_id, self.bob.user_id)
+        self.assertEqual(await Guess.objects.filter(room_id=room_id).acount(), 1)
+        self.assertEqual([g['guess'] for g in reloaded.guesses], ['5687'])
+        self.assertEqual(reloaded.room.current_turn_player_id, self.bob.user_id)
+        self.assertGreater(reloaded.version, actor.version)
+        await reloaded.close()
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class RetentionTests(TransactionTestCase):
+    """run_retention archives old finished games, expires stale lobby rooms, purges orphan guests and keeps recent ones."""
+
+    def room(self, name, status, age):
+        alice = User.objects.create(username=f'{name}-a')
+        bob = User.objects.create(username=f'{name}-b')
+        room = GameRoom.objects.create(name=name, status=status, team_a_secret='1234', team_b_secret='5678')
+        a = Player.objects.create(room=room, user=alice, team='A', display_name='alice', is_winner=True)
+        b = Player.objects.create(room=room, user=bob, team='B', display_name='bob')
+        Guess.objects.create(player=b, target_player=a, room=room, guess_number='1243', strikes=2, balls=2)
+        Guess.objects.create(player=a, target_player=b, room=room, guess_number='5678', strikes=4, balls=0, is_correct=True)
+        then = timezone.now() - age
+        GameRoom.objects.filter(pk=room.pk).update(
+            created_at=then, finished_at=then if status == GameRoom.FINISHED else None)
+        return room
+
+    def test_archive_and_expire(self):
+        old = [self.room(f'old{i}', GameRoom.FINISHED, timedelta(days=30)) for i in range(3)]
+        recent = self.room('recent', GameRoom.FINISHED, timedelta(days=1))
+        stale = self.room('stale', GameRoom.WAITING, timedelta(days=2))
+        fresh = self.room('fresh', GameRoom.WAITING, timedelta(minutes=5))
+        long_ago = timezone.now() - timedelta(days=60)
+        User.objects.create(username='g:gone', date_joined=long_ago)
+        Player.objects.create(room=fresh, user=User.objects.create(username='g:kept', date_joined=long_ago))
+        reports = []
+
+        report = retention.run_retention(batch_size=2, pause=0, progress=lambda r: reports.append(dict(r)))
+        self.assertEqual(report, {'expired': 1, 'archived': 3, 'guesses_deleted': 8, 'guests_purged': 1, 'done': True})
+        self.assertEqual(list(User.objects.filter(username__startswith='g:').values_list('username', flat=True)), ['g:kept'])
+        self.assertEqual([r['archived'] for r in reports], [0, 2, 3, 3])
+        self.assertEqual(set(GameRoom.objects.values_list('pk', flat=True)), {recent.pk, fresh.pk})
+        self.assertEqual(Guess.objects.count(), 4)
+        self.assertFalse(GameArchive.objects.filter(pk=stale.pk).exists())
+
+        game = retention.decode_game(GameArchive.objects.get(pk=old[0].pk).data)
+        self.assertEqual([p[1] for p in game['players']], ['alice', 'bob'])
+        self.assertEqual([g[2:6] for g in game['guesses']], [['1243', 2, 2, False], ['5678', 4, 0, True]])
+        self.assertEqual(game['secrets'], {'A': '1234', 'B': '5678'})
+        self.assertEqual(retention.run_retention(pause=0)['archived'], 0)
+
+
+class GuestIdentityTests(TransactionTestCase):
+    """get_guest creates a guest with one INSERT, then answers from the identity cache until the user is deleted."""
+
+    def setUp(self):
+        clear_guest_cache()
+
+    def test_cached_identity(self):
+        username = guests.guest_username('0f0e0d0c-aaaa')
+        with CaptureQueriesContext(connection) as created:
+            user = guests.get_guest(username)
+        writes = [q['sql'].split()[0] for q in created.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(writes, ['INSERT'])
+        self.assertFalse(User.objects.get(pk=user.pk).has_usable_password())
+        with CaptureQueriesContext(connection) as cached:
+            self.assertEqual(guests.get_guest(username).pk, user.pk)
+        self.assertEqual(cached.captured_queries, [])
+
+        User.objects.filter(pk=user.pk).delete()
+        self.assertNotEqual(guests.get_guest(username).pk, user.pk)
+
+    def test_signed_token(self):
+        user = guests.get_guest(guests.guest_username('0f0e0d0c-bbbb'))
+        token = guests.issue_token(user)
+        with CaptureQueriesContext(connection) as queries:
+            resolved = guests.user_from_token(token)
+        self.assertEqual((resolved.pk, resolved.username, queries.captured_queries), (user.pk, user.username, []))
+        self.assertIsNone(guests.user_from_token(token[:-1] + ('A' if token[-1] != 'A' else 'B')))
+        self.assertIsNone(guests.user_from_token('garbage'))
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    )
+    def test_purged_guest_rejoins(self):
+        device = '0f0e0d0c-cccc'
+        username = guests.guest_username(device)
+        stale = guests.get_guest(username)
+        User.objects.filter(pk=stale.pk).update(date_joined=timezone.now() - timedelta(days=retention.GUEST_DAYS + 1))
+        retention.purge_orphan_guests_batch(timezone.now() - timedelta(days=retention.GUEST_DAYS), 10)
+        self.assertIsNone(guests._cached_id(username))
+        self.assertFalse(User.objects.filter(pk=stale.pk).exists())
+
+        # Another process's local cache still maps the device to the purged id
+        guests._remember(username, stale.pk)
+        room = GameRoom.objects.create(name='purged')
+        with mock.patch.object(views, 'refresh_guest', wraps=views.refresh_guest) as refresh:
+            response = Client().post(f'/api/rooms/{room.id}/join/', json.dumps({'username': 'carol', 'device_id': device}),
+                                     content_type='application/json')
+        self.assertEqual((response.status_code, refresh.call_count), (200, 1))
+        player = Player.objects.get(room=room)
+        self.assertNotEqual(player.user_id, stale.pk)
+        self.assertEqual(player.user.username, username)
+        self.assertEqual(guests.user_from_token(response.json()['guest_token']).pk, player.user_id)
+
+
+@skipUnless(settings.DATABASES['default'].get('OPTIONS', {}).get('pool'), 'needs Postgres with DB_POOL_MODE=pool')
+class ConnectionPoolTests(TransactionTestCase):
+    """With DB_POOL_MODE=pool, queries run on pooled connections and the pool shows up in /api/metrics/."""
+
+    def test_pool_metrics(self):
+        User.objects.count()
+        stats = connection.pool.get_stats()
+        self.assertGreaterEqual(stats['pool_size'], 1)
+        body = Client().get('/api/metrics/').content.decode()
+        self.assertIn('numdle_db_pool_size', body)
+        self.assertIn('numdle_db_pool_wait_seconds_total', body)
+
+
+class SpectatorFeedTests(SimpleTestCase):
+    """RoomFeed caps each viewer's frame rate and sends a slow viewer only the latest state."""
+
+    @staticmethod
+    def snapshot(version):
+        return {'version': version, 'state': {'room_id': 'feed-test', 'version': version, 'guesses': []}, 'private': {}}
+
+    async def test_slow_viewer_gets_latest(self):
+        feed = spectators.RoomFeed('feed-test', asyncio.get_running_loop())
+        sent, release = [], asyncio.Event()
+
+        async def slow_send(data):
+            sent.append(json.loads(data)['data']['version'])
+            await release.wait()
+
+        with mock.patch.object(spectators, 'MAX_FPS', 100):
+            viewer = spectators.Viewer(slow_send)
+            feed.viewers.add(viewer)
+            feed.set_state(self.snapshot(1))
+            feed.resync(viewer)
+            await asyncio.sleep(0.05)
+            for version in (2, 3, 4):
+                feed.set_state(self.snapshot(version))
+                await asyncio.sleep(0.02)
+            self.assertEqual(sent, [1])
+            release.set()
+            await asyncio.sleep(0.05)
+        self.assertEqual(sent, [1, 4])
+        await feed.close()
@@ -0,0 +1,210 @@
+"""In-process turn deadlines (TURN_TIMERS = 'wheel').
+
+Instead of one Celery countdown task per turn (never revoked, each later
+loading the room just to find the turn long over), every ASGI process keeps
+the deadlines of the turns it started in a hierarchical timing wheel:
+
+- scheduling and cancelling a timer are O(1) set operations; starting a new
+  turn in a room cancels that room's previous timer;
+- one ticker task per process advances the wheel every TIMER_TICK_MS;
+- a timer carries the turn_start_time of its turn, so a timer for a turn that
+  another process has already advanced costs one query and is dropped.
+
+Handover: every TURN_RESCUE_INTERVAL seconds each process also skips playing
+rooms whose deadline passed more than grace + TURN_RESCUE_SLACK seconds ago.
+Those belong to a process that died (or to rooms idle since a restart); the
+conditional UPDATE in tasks.advance_expired_turn() makes concurrent rescues
+safe. No Celery worker is needed in this mode.
+
+TURN_TIMERS = 'celery' keeps the check_turn_timeout / skip_turn countdown tasks;
+TURN_TIMERS = 'sweep' arms nothing and leaves expired turns to the periodic
+tasks.sweep_expired_turns (celery beat), which reads the indexed turn_deadline.
+
+With GAME_ENGINE = 'actor' none of these run: each RoomActor times its own
+turns (engine.RoomActor.arm_turn_timer), schedule_turn_timeout() arms
+nothing and the sweeper is not scheduled.
+"""
+import asyncio
+import logging
+import math
+import time
+from channels.db import database_sync_to_async
+from django.conf import settings
+from . import tasks
+from .engine import actor_mode_enabled
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    __slots__ = ('expires', 'callback', 'args', 'slot')
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.slot = None
+
+
+class TimerWheel:
+    """Hierarchical timing wheel: `levels` wheels of `slots` slots, level L covering slots**L ticks per slot.
+
+    Not thread-safe; use it from its event loop only.
+    """
+
+    def __init__(self, tick=0.1, slots=64, levels=4):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.current = 0
+        self.origin = time.monotonic()
+        self.task = None
+
+    def schedule(self, delay, callback, *args):
+        """Run callback(*args) (a coroutine function or plain function) after `delay` seconds."""
+        ticks = max(1, math.ceil(delay / self.tick))
+        # Beyond the outermost wheel's horizon (~19 days at the defaults) timers are clamped
+        horizon = (self.slots - 1) * self.slots ** (self.levels - 1)
+        timer = Timer(self.current + min(ticks, horizon), callback, args)
+        self._place(timer)
+        return timer
+
+    def start(self):
+        """Start the ticker task on the running loop."""
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    @staticmethod
+    def cancel(timer):
+        if timer.slot is not None:
+            timer.slot.discard(timer)
+            timer.slot = None
+
+    def _place(self, timer):
+        # Highest level whose slot for `expires` differs from the current one; that
+        # slot is cascaded down (or fired, at level 0) exactly when it comes due.
+        level = 0
+        for candidate in range(self.levels - 1, 0, -1):
+            span = self.slots ** candidate
+            if timer.expires // span != self.current // span:
+                level = candidate
+                break
+        slot = self.wheels[level][(timer.expires // self.slots ** level) % self.slots]
+        slot.add(timer)
+        timer.slot = slot
+
+    def _advance(self):
+        self.current += 1
+        for level in range(1, self.levels):
+            span = self.slots ** level
+            if self.current % span:
+                break
+            slot = self.wheels[level][(self.current // span) % self.slots]
+            cascading = list(slot)
+            slot.clear()
+            for timer in cascading:
+                self._place(timer)
+        slot = self.wheels[0][self.current % self.slots]
+        due = list(slot)
+        slot.clear()
+        for timer in due:
+            timer.slot = None
+            try:
+                result = timer.callback(*timer.args)
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+            except Exception:
+                logger.exception("Timer callback failed")
+
+    async def _run(self):
+        while True:
+            target = int((time.monotonic() - self.origin) / self.tick)
+            while self.current < target:
+                self._advance()
+            await asyncio.sleep(self.origin + (self.current + 1) * self.tick - time.monotonic())
+
+
+class TurnTimers:
+    """Turn deadlines of the rooms this process started turns in."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.wheel = TimerWheel(tick=getattr(settings, 'TIMER_TICK_MS', 100) / 1000)
+        self.timers = {}  # room_id -> Timer
+        self.rescue_interval = getattr(settings, 'TURN_RESCUE_INTERVAL', 10)
+        self.rescue_slack = getattr(settings, 'TURN_RESCUE_SLACK', 5)
+        self.wheel.schedule(self.rescue_interval, self._rescue)
+        self.wheel.start()
+
+    def schedule(self, room_id, turn_started, countdown):
+        """(Re)arm a room's deadline; replaces (cancels) its previous timer. Loop thread only."""
+        self.cancel(room_id)
+        self.timers[room_id] = self.wheel.schedule(countdown, self._expired, room_id, turn_started)
+
+    def cancel(self, room_id):
+        timer = self.timers.pop(room_id, None)
+        if timer is not None:
+            self.wheel.cancel(timer)
+
+    async def _expired(self, room_id, turn_started):
+        self.timers.pop(room_id, None)
+        result = await database_sync_to_async(tasks.announce_if_expired)(room_id, turn_started)
+        if result is None:
+            return
+        expired, value = result
+        if expired:
+            self.timers[room_id] = self.wheel.schedule(tasks.SKIP_GRACE_SECONDS, self._skip, room_id, value)
+        else:
+            self.schedule(room_id, turn_started, value)
+
+    async def _skip(self, room_id, epoch):
+        self.timers.pop(room_id, None)
+        room = await database_sync_to_async(tasks.advance_expired_turn)(room_id, epoch)
+        if room:
+            self.schedule(room_id, room.turn_start_time.isoformat(), room.turn_time_limit)
+
+    async def _rescue(self):
+        self.wheel.schedule(self.rescue_interval, self._rescue)
+        try:
+            overdue = await database_sync_to_async(tasks.overdue_turns)(self.rescue_slack)
+        except Exception:
+            logger.exception("Turn rescue sweep failed")
+            return
+        for room_id, epoch in overdue:
+            if room_id not in self.timers:
+                logger.info("Taking over overdue turn deadline of room %s", room_id)
+                await self._skip(room_id, epoch)
+
+
+_turn_timers = None
+
+
+def get_turn_timers():
+    """This process's TurnTimers, bound to the running loop on first use (call from async code)."""
+    global _turn_timers
+    loop = asyncio.get_running_loop()
+    if _turn_timers is None or _turn_timers.loop is not loop:
+        _turn_timers = TurnTimers(loop)
+    return _turn_timers
+
+
+def schedule_turn_timeout(room):
+    """Arm the timeout of the turn that just started in `room`. Safe to call from sync code/threads."""
+    if not room.turn_time_limit or not room.turn_start_time or actor_mode_enabled():
+        return
+    countdown = room.turn_time_limit
+    turn_started = room.turn_start_time.isoformat()
+    mode = getattr(settings, 'TURN_TIMERS', 'wheel')
+    if mode == 'sweep':
+        # turn_deadline, saved with the turn, is all the sweeper needs
+        return
+    if mode == 'celery':
+        tasks.check_turn_timeout.apply_async(args=[str(room.id), turn_started], countdown=countdown)
+        return
+    timers = _turn_timers
+    if timers is None or timers.loop.is_closed():
+        # No ASGI loop in this process (e.g. a Celery worker); a rescue sweep picks the turn up
+        logger.debug("No turn timers in this process for room %s", room.id)
+        return
+    timers.loop.call_soon_threadsafe(timers.schedule, str(room.id), turn_started, countdown)
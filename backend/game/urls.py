@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path('health/', views.health, name='health'),
+    path('metrics/', views.metrics_view, name='metrics'),
     path('admin/analytics/', views.admin_analytics, name='admin_analytics'),
     path('admin/rooms/', views.admin_list_rooms, name='admin_list_rooms'),
     path('admin/rooms/<uuid:room_id>/delete/', views.admin_force_delete_room, name='admin_force_delete_room'),
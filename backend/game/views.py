@@ -1,12 +1,20 @@
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import IntegrityError
+from django.db.models import Count, Q
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
+from . import analytics, lobby, metrics
+from .guests import get_guest, guest_username, issue_token, refresh_guest
+from .pagination import InvalidQuery, bool_param, choice_param, int_param, keyset_page, ndjson_response, newest_first
 from .models import GameRoom, Player, Guess, UserMessage
+from .room_state import bump_room_version, forget_room
 import json
 import uuid
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 
 @csrf_exempt
@@ -15,6 +23,16 @@ def health(request):
     return JsonResponse({"status": "ok"})
 
 
+def metrics_view(request):
+    """Prometheus scrape endpoint; requires `Authorization: Bearer <METRICS_TOKEN>` when that is set."""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and request.META.get('HTTP_AUTHORIZATION', '') != f'Bearer {token}':
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 ## All authentication endpoints removed for guest-only mode.
 
 # --- Admin Basic Auth Helpers ---
@@ -41,44 +59,56 @@ def admin_analytics(request):
         return JsonResponse({'error':'Method not allowed'}, status=405)
     if not _admin_authenticated(request):
         return JsonResponse({'error':'Unauthorized'}, status=401)
-    rooms = GameRoom.objects.all()
-    total_rooms = rooms.count()
-    by_status = {}
-    total_players = 0
-    finished = 0
-    for r in rooms:
-        by_status[r.status] = by_status.get(r.status,0)+1
-        total_players += r.players.count()
-        if r.status == GameRoom.FINISHED:
-            finished += 1
-    avg_players = total_players / total_rooms if total_rooms else 0
-    return JsonResponse({
-        'total_rooms': total_rooms,
-        'status_breakdown': by_status,
-        'total_players': total_players,
-        'average_players_per_room': round(avg_players,2),
-        'finished_rooms': finished,
-    })
+    # ?since=&until= (ISO datetimes or dates) select the range totals and games per hour
+    bounds = {}
+    for name in ('since', 'until'):
+        raw = request.GET.get(name)
+        if not raw:
+            continue
+        try:
+            value = parse_datetime(raw)
+        except ValueError:
+            value = None
+        if not value:
+            return JsonResponse({'error': f'Invalid {name}'}, status=400)
+        bounds[name] = value if timezone.is_aware(value) else timezone.make_aware(value)
+    return JsonResponse(analytics.summary(**bounds))
 
 def admin_list_rooms(request):
     if request.method != 'GET':
         return JsonResponse({'error':'Method not allowed'}, status=405)
     if not _admin_authenticated(request):
         return JsonResponse({'error':'Unauthorized'}, status=401)
-    rooms = GameRoom.objects.all().order_by('-created_at')
-    data = []
-    for r in rooms:
-        data.append({
-            'id': str(r.id),
-            'name': r.name,
-            'status': r.status,
-            'player_count': r.players.count(),
-            'max_players': r.max_players,
-            'turn_time_limit': r.turn_time_limit,
-            'created_at': r.created_at.isoformat(),
-            'is_private': r.is_private,
-        })
-    return JsonResponse({'rooms': data})
+    # ?status=&private=&q=&limit=&cursor=, or ?format=ndjson to stream every match
+    try:
+        rooms = GameRoom.objects.annotate(player_count=Count('players'))
+        status = choice_param(request.GET, 'status', GameRoom.STATUS_CHOICES)
+        if status:
+            rooms = rooms.filter(status=status)
+        private = bool_param(request.GET, 'private')
+        if private is not None:
+            rooms = rooms.filter(is_private=private)
+        if request.GET.get('q'):
+            rooms = rooms.filter(name__icontains=request.GET['q'])
+        if request.GET.get('format') == 'ndjson':
+            return ndjson_response(newest_first(rooms, request.GET.get('cursor')), _admin_room, 'rooms.ndjson')
+        page, next_cursor = keyset_page(rooms, request.GET.get('cursor'), int_param(request.GET, 'limit', 1, 500) or 100)
+    except InvalidQuery as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'rooms': [_admin_room(r) for r in page], 'next_cursor': next_cursor})
+
+
+def _admin_room(r):
+    return {
+        'id': str(r.id),
+        'name': r.name,
+        'status': r.status,
+        'player_count': r.player_count,
+        'max_players': r.max_players,
+        'turn_time_limit': r.turn_time_limit,
+        'created_at': r.created_at.isoformat(),
+        'is_private': r.is_private,
+    }
 
 @csrf_exempt
 def admin_force_delete_room(request, room_id):
@@ -90,30 +120,30 @@ def admin_force_delete_room(request, room_id):
         room = GameRoom.objects.get(id=room_id)
     except GameRoom.DoesNotExist:
         return JsonResponse({'error':'Room not found'}, status=404)
+    players = room.players.count()
     room.delete()
+    analytics.record(analytics.room_deleted(room.status, players))
+    forget_room(room_id)
+    lobby.publish_from_sync('room_closed', {'id': str(room_id)})
     return JsonResponse({'message':'Room deleted'})
 
 
 @csrf_exempt
 def game_rooms(request):
     if request.method == 'GET':
-        rooms = GameRoom.objects.filter(status__in=[GameRoom.WAITING, GameRoom.SETTING_NUMBERS])
-        data = [{
-            'id': str(r.id),
-            'name': r.name,
-            'status': r.status,
-            'player_count': r.players.count(),
-            'max_players': r.max_players,
-            'turn_time_limit': r.turn_time_limit,
-            'created_at': r.created_at.isoformat(),
-            'creator_username': (
-                r.players.filter(user=r.creator).first().display_name
-                if r.creator and r.players.filter(user=r.creator).exists()
-                else None
-            ),
-            'is_private': r.is_private,
-        } for r in rooms]
-        return JsonResponse({'rooms': data})
+        # ?limit=&cursor=&min_players=&max_players=&has_space=&private= (see lobby.py)
+        try:
+            query = lobby.parse_query(request.GET)
+        except lobby.InvalidQuery as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        etag, body = lobby.get_page(query)
+        if lobby.etag_matches(etag, request.headers.get('If-None-Match')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = f'max-age={lobby.LOBBY_CACHE_TTL}'
+        return response
     if request.method == 'POST':
         try:
             body = json.loads(request.body or '{}')
@@ -134,10 +164,21 @@ def game_rooms(request):
             is_private=is_private,
             password=password if is_private else ''
         )
+        analytics.record(analytics.room_created(room.status))
+        lobby.publish_from_sync('room_created', lobby.room_summary(room, 0))
         return JsonResponse({'room_id': str(room.id), 'name': room.name, 'message': 'Room created successfully'})
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
 
+def _team_counts(room):
+    """The room's player count and team sizes ('total', 'a', 'b') in one query."""
+    return room.players.aggregate(
+        total=Count('id'),
+        a=Count('id', filter=Q(team='A')),
+        b=Count('id', filter=Q(team='B')),
+    )
+
+
 @csrf_exempt
 def join_room(request, room_id):
     if request.method != 'POST':
@@ -158,45 +199,60 @@ def join_room(request, room_id):
         return JsonResponse({'error': 'Please Log out and Log back in'}, status=400)
     
     # Use device_id as the sole unique identifier
-    internal_username = f"g:{device_id}"[:150]
-    user, _ = User.objects.get_or_create(username=internal_username)
+    user = get_guest(guest_username(device_id))
 
     # Rejoin shortcut for the resolved user
     try:
         player = Player.objects.get(user=user, room=room)
+        changed = False
         # Update display name if changed
         if display_name and player.display_name != display_name[:30]:
             player.display_name = display_name[:30]
             player.save(update_fields=['display_name'])
+            changed = True
         if not player.team:
-            a_count = room.players.filter(team='A').count()
-            b_count = room.players.filter(team='B').count()
-            player.team = 'A' if a_count <= b_count else 'B'
+            counts = _team_counts(room)
+            player.team = 'A' if counts['a'] <= counts['b'] else 'B'
             player.save(update_fields=['team'])
-        return JsonResponse({'message': 'Rejoined room successfully', 'room_id': str(room.id), 'room_status': room.status})
+            changed = True
+        if changed:
+            bump_room_version(room.id)
+        return JsonResponse({'message': 'Rejoined room successfully', 'room_id': str(room.id), 'room_status': room.status, 'guest_token': issue_token(user)})
     except Player.DoesNotExist:
         pass
     if room.is_private:
         provided = data.get('password', '')
         if not provided or provided != (room.password or ''):
             return JsonResponse({'error': 'Invalid or missing room password'}, status=403)
-    if room.is_full:
+    counts = _team_counts(room)
+    if counts['total'] >= room.max_players:
         return JsonResponse({'error': 'Room is full'}, status=400)
     if room.status not in [GameRoom.WAITING, GameRoom.SETTING_NUMBERS]:
         return JsonResponse({'error': 'Game already in progress'}, status=400)
-    player = Player.objects.create(user=user, room=room, display_name=display_name[:30])
+    fields = {'room': room, 'display_name': display_name[:30], 'team': 'A' if counts['a'] <= counts['b'] else 'B'}
+    try:
+        # Autocommit: the INSERT itself fails on a missing User
+        player = Player.objects.create(user=user, **fields)
+    except IntegrityError:
+        # The guest id came from a cache and its User was purged since (retention)
+        if User.objects.filter(id=user.id).exists():
+            raise
+        user = refresh_guest(user)
+        player = Player.objects.create(user=user, **fields)
     # If no creator recorded yet, first joiner becomes creator (needed for start control)
-    if room.creator is None:
+    if room.creator_id is None:
         room.creator = user
         room.save(update_fields=['creator'])
-    a_count = room.players.filter(team='A').count()
-    b_count = room.players.filter(team='B').count()
-    player.team = 'A' if a_count <= b_count else 'B'
-    player.save()
-    if room.is_full and room.status == GameRoom.WAITING:
+    player_count = counts['total'] + 1
+    deltas = {'players_joined': 1, 'players': 1}
+    if player_count >= room.max_players and room.status == GameRoom.WAITING:
+        analytics.status_change(room.status, GameRoom.SETTING_NUMBERS, deltas)
         room.status = GameRoom.SETTING_NUMBERS
-        room.save()
-    return JsonResponse({'message': 'Joined room successfully', 'room_id': str(room.id), 'room_status': room.status})
+        room.save(update_fields=['status'])
+    analytics.record(deltas)
+    bump_room_version(room.id)
+    lobby.publish_from_sync('room_updated', {'id': str(room.id), 'player_count': player_count, 'status': room.status})
+    return JsonResponse({'message': 'Joined room successfully', 'room_id': str(room.id), 'room_status': room.status, 'guest_token': issue_token(user)})
 
 
 @csrf_exempt
@@ -206,13 +262,15 @@ def room_detail(request, room_id):
     except GameRoom.DoesNotExist:
         return JsonResponse({'error': 'Room not found'}, status=404)
     if request.method == 'GET':
+        room_players = list(room.players.select_related('user'))
+        by_user = {p.user_id: p for p in room_players}
         players = [{
             'id': p.id,
             'username': (p.display_name or p.user.username),
             'has_secret_number': bool(p.secret_number),
             'is_winner': p.is_winner,
             'joined_at': p.joined_at.isoformat()
-        } for p in room.players.all()]
+        } for p in room_players]
         recent_guesses = [{
             'player': g.player.display_name or g.player.user.username,
             'target_player': g.target_player.display_name or g.target_player.user.username,
@@ -221,31 +279,30 @@ def room_detail(request, room_id):
             'balls': g.balls,
             'is_correct': g.is_correct,
             'timestamp': g.timestamp.isoformat()
-        } for g in Guess.objects.filter(room=room).order_by('-timestamp')[:10]]
+        } for g in Guess.objects.filter(room=room).select_related('player__user', 'target_player__user').order_by('-timestamp')[:10]]
         return JsonResponse({'room': {
             'id': str(room.id),
             'name': room.name,
             'status': room.status,
             'max_players': room.max_players,
             'turn_time_limit': room.turn_time_limit,
-            'current_turn_player': None if not room.current_turn_player else (
-                room.players.filter(user=room.current_turn_player).first().display_name
-                if room.players.filter(user=room.current_turn_player).exists() else None
+            'current_turn_player': (
+                by_user[room.current_turn_player_id].display_name if room.current_turn_player_id in by_user else None
             ),
             'turn_start_time': room.turn_start_time.isoformat() if room.turn_start_time else None,
             'created_at': room.created_at.isoformat(),
-            'creator_username': (
-                room.players.filter(user=room.creator).first().display_name
-                if room.creator and room.players.filter(user=room.creator).exists()
-                else None
-            ),
+            'creator_username': by_user[room.creator_id].display_name if room.creator_id in by_user else None,
             'is_private': room.is_private,
         }, 'players': players, 'recent_guesses': recent_guesses})
     if request.method == 'DELETE':
         # Anyone can delete for simplicity if no creator
         if room.creator and (not request.user.is_authenticated or request.user != room.creator):
             return JsonResponse({'error': 'Only creator can delete'}, status=403)
+        players = room.players.count()
         room.delete()
+        analytics.record(analytics.room_deleted(room.status, players))
+        forget_room(room_id)
+        lobby.publish_from_sync('room_closed', {'id': str(room_id)})
         return JsonResponse({'message': 'Room deleted'})
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
@@ -275,25 +332,33 @@ def rematch(request, room_id):
         return JsonResponse({'error': 'Please Log out and Log back in'}, status=400)
     
     # Use device_id as the sole unique identifier
-    internal_username = f"g:{device_id}"[:150]
-    acting_user, _ = User.objects.get_or_create(username=internal_username)
-    # Ensure acting user was part of original
-    if not Player.objects.filter(user=acting_user, room=original_room).exists():
-        return JsonResponse({'error': 'Only players from the original game can create a rematch'}, status=403)
+    acting_user = get_guest(guest_username(device_id))
+    original_players = list(original_room.players.order_by('joined_at'))
+    # Ensure acting user was part of original. A purged guest has no players, so a
+    # cached id that fails this may be stale: check once more with a fresh one
+    # (past this check the acting User exists and the inserts below cannot fail on it)
+    if not any(op.user_id == acting_user.id for op in original_players):
+        acting_user = refresh_guest(acting_user)
+        if not any(op.user_id == acting_user.id for op in original_players):
+            return JsonResponse({'error': 'Only players from the original game can create a rematch'}, status=403)
     new_room = GameRoom.objects.create(
         name=f"{original_room.name}",
         max_players=original_room.max_players,
         turn_time_limit=original_room.turn_time_limit,
         creator=acting_user,
         is_private=original_room.is_private,
-        password=original_room.password
+        password=original_room.password,
+        status=GameRoom.SETTING_NUMBERS if len(original_players) >= original_room.max_players else GameRoom.WAITING,
     )
-    for op in original_room.players.all().order_by('joined_at'):
-        Player.objects.create(user=op.user, room=new_room, team=op.team, display_name=op.display_name)
-    if new_room.is_full:
-        new_room.status = GameRoom.SETTING_NUMBERS
-        new_room.save()
-    return JsonResponse({'message': 'Rematch room created successfully', 'room_id': str(new_room.id), 'room_name': new_room.name, 'room_status': new_room.status})
+    # One INSERT each (not bulk_create), so joined_at keeps the original join order
+    players = [
+        Player.objects.create(user_id=op.user_id, room=new_room, team=op.team, display_name=op.display_name)
+        for op in original_players
+    ]
+    analytics.record(analytics.room_created(new_room.status, len(players)))
+    creator_name = next((p.display_name for p in players if p.user_id == acting_user.id), None)
+    lobby.publish_from_sync('room_created', lobby.room_summary(new_room, len(players), creator_name))
+    return JsonResponse({'message': 'Rematch room created successfully', 'room_id': str(new_room.id), 'room_name': new_room.name, 'room_status': new_room.status, 'guest_token': issue_token(acting_user)})
 
 
 # --- Message Submission System ---
@@ -344,43 +409,52 @@ def admin_list_messages(request):
     if not _admin_authenticated(request):
         return JsonResponse({'error': 'Unauthorized'}, status=401)
     
-    # Get query parameters for filtering
-    status_filter = request.GET.get('status')
-    message_type_filter = request.GET.get('type')
-    
-    messages = UserMessage.objects.all()
-    
-    if status_filter and status_filter in [choice[0] for choice in UserMessage.STATUS_CHOICES]:
-        messages = messages.filter(status=status_filter)
-    
-    if message_type_filter and message_type_filter in [choice[0] for choice in UserMessage.TYPE_CHOICES]:
-        messages = messages.filter(message_type=message_type_filter)
-    
-    messages_data = []
-    for msg in messages[:100]:  # Limit to 100 most recent
-        messages_data.append({
-            'id': str(msg.id),
-            'username': msg.username,
-            'subject': msg.subject,
-            'message': msg.message,
-            'message_type': msg.message_type,
-            'message_type_display': msg.get_message_type_display(),
-            'status': msg.status,
-            'status_display': msg.get_status_display(),
-            'created_at': msg.created_at.isoformat(),
-            'reviewed_at': msg.reviewed_at.isoformat() if msg.reviewed_at else None,
-            'admin_notes': msg.admin_notes
-        })
-    
+    # Filters: ?status=&type=&username=; pages: ?limit=&cursor=; ?format=ndjson streams every match
+    try:
+        messages = UserMessage.objects.all()
+        status_filter = choice_param(request.GET, 'status', UserMessage.STATUS_CHOICES)
+        if status_filter:
+            messages = messages.filter(status=status_filter)
+        message_type_filter = choice_param(request.GET, 'type', UserMessage.TYPE_CHOICES)
+        if message_type_filter:
+            messages = messages.filter(message_type=message_type_filter)
+        if request.GET.get('username'):
+            messages = messages.filter(username=request.GET['username'])
+        if request.GET.get('format') == 'ndjson':
+            return ndjson_response(newest_first(messages, request.GET.get('cursor')), _admin_message, 'messages.ndjson')
+        page, next_cursor = keyset_page(messages, request.GET.get('cursor'), int_param(request.GET, 'limit', 1, 500) or 100)
+    except InvalidQuery as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    counts = UserMessage.objects.aggregate(
+        total_count=Count('id'),
+        pending_count=Count('id', filter=Q(status=UserMessage.PENDING)),
+        reviewed_count=Count('id', filter=Q(status=UserMessage.REVIEWED)),
+        resolved_count=Count('id', filter=Q(status=UserMessage.RESOLVED)),
+    )
     return JsonResponse({
-        'messages': messages_data,
-        'total_count': UserMessage.objects.count(),
-        'pending_count': UserMessage.objects.filter(status=UserMessage.PENDING).count(),
-        'reviewed_count': UserMessage.objects.filter(status=UserMessage.REVIEWED).count(),
-        'resolved_count': UserMessage.objects.filter(status=UserMessage.RESOLVED).count()
+        'messages': [_admin_message(msg) for msg in page],
+        'next_cursor': next_cursor,
+        **counts,
     })
 
 
+def _admin_message(msg):
+    return {
+        'id': str(msg.id),
+        'username': msg.username,
+        'subject': msg.subject,
+        'message': msg.message,
+        'message_type': msg.message_type,
+        'message_type_display': msg.get_message_type_display(),
+        'status': msg.status,
+        'status_display': msg.get_status_display(),
+        'created_at': msg.created_at.isoformat(),
+        'reviewed_at': msg.reviewed_at.isoformat() if msg.reviewed_at else None,
+        'admin_notes': msg.admin_notes
+    }
+
+
 @csrf_exempt
 def admin_update_message(request, message_id):
     """Admin endpoint to update message status and add notes"""
@@ -0,0 +1,208 @@
+"""Wire formats of game socket frames, negotiated through the WebSocket subprotocol.
+
+- JSON (default, no subprotocol): frames as JSON text, unchanged.
+- Compact (``Sec-WebSocket-Protocol: numdle.compact.v1``): binary MessagePack
+  frames in which the bulky parts of room state are packed:
+
+  - a guess (in room_state_update ``guesses`` and guess_added deltas) is an
+    array ``[player_id, target_player_id, guess, strikes, balls, is_correct,
+    timestamp]``; the player ids refer to ``players[].id`` of the room state,
+    the one place display names are sent;
+  - timestamps (``timestamp``, ``turn_start_time``, ``updated_at``) are
+    integer milliseconds since the epoch.
+
+  Everything else keeps its JSON shape. Clients still send JSON text.
+
+Clients that ask for no (or an unknown) subprotocol get JSON, so the compact
+format is opt-in per socket. WS_WIRE_FORMATS = ['json'] turns it off for the
+deployment (and with it its share of broadcast encoding).
+
+Group messages are encoded by their sender: prepare() (applied by
+metrics.group_send) adds the frame every recipient socket would send, encoded
+once in each format (``frames``: {'json': text, 'compact': bytes}). Sockets
+forward the format they negotiated as is, so a broadcast costs two encodings
+whatever the number of sockets in the room; str and bytes travel through both
+the Redis and the in-memory channel layers unchanged. The frame of a
+room_state_update is the generic (secret-free) state; sockets that see
+secrets encode theirs through encode_shared(), once per format, process and
+set of visible secrets. Packed guess lists of a room state are memoized per
+room version the same way.
+"""
+import json
+from collections import OrderedDict
+from datetime import datetime
+import msgpack
+from django.conf import settings
+from .room_state import shows_generic_state
+
+COMPACT_PROTOCOL = 'numdle.compact.v1'
+
+_SHARED_SIZE = 512
+
+
+def epoch_ms(value):
+    """ISO timestamp (as sent in JSON frames) -> integer epoch milliseconds; None stays None."""
+    if not value:
+        return value
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def pack_guess(guess):
+    return [
+        guess.get('player_id', guess['player']),
+        guess.get('target_player_id', guess['target_player']),
+        guess['guess'], guess['strikes'], guess['balls'], guess['is_correct'],
+        epoch_ms(guess['timestamp']),
+    ]
+
+
+class _Memo:
+    """Bounded mapping of recently encoded values (event-loop use only)."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key, build):
+        value = self.entries.get(key)
+        if value is None:
+            value = self.entries[key] = build()
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return value
+
+
+_shared = _Memo(_SHARED_SIZE)
+_guesses = _Memo(64)
+
+
+def _packed_guesses(state):
+    guesses = state['guesses']
+    key = (state['room_id'], state['version'], len(guesses))
+    if key[1] is None:
+        return [pack_guess(g) for g in guesses]
+    return _guesses.get(key, lambda: [pack_guess(g) for g in guesses])
+
+
+def compact_frame(frame):
+    """A frame reshaped for the compact format (see the module docstring)."""
+    kind = frame.get('type')
+    data = frame.get('data')
+    if kind == 'room_state_update':
+        data = {
+            **data,
+            'guesses': _packed_guesses(data),
+            'turn_start_time': epoch_ms(data.get('turn_start_time')),
+        }
+    elif kind == 'room_delta':
+        if frame['event'] == 'guess_added':
+            data = pack_guess(data)
+        elif 'turn_start_time' in data:
+            data = {**data, 'turn_start_time': epoch_ms(data['turn_start_time'])}
+    elif kind in ('team_strategy_init', 'team_strategy_update', 'team_strategy_conflict', 'team_strategy_patch'):
+        data = {**data, 'updated_at': epoch_ms(data.get('updated_at'))}
+    else:
+        return frame
+    return {**frame, 'data': data}
+
+
+class JsonCodec:
+    name = 'json'
+    binary = False
+
+    def encode(self, frame):
+        return json.dumps(frame)
+
+    def batch(self, encoded):
+        return '{"type": "batch", "frames": [' + ', '.join(encoded) + ']}'
+
+
+class CompactCodec:
+    name = 'compact'
+    binary = True
+
+    _batch_head = msgpack.packb('type') + msgpack.packb('batch') + msgpack.packb('frames')
+
+    def encode(self, frame):
+        return msgpack.packb(compact_frame(frame))
+
+    def batch(self, encoded):
+        # {'type': 'batch', 'frames': [...]} around frames packed already
+        packer = msgpack.Packer()
+        return packer.pack_map_header(2) + self._batch_head + packer.pack_array_header(len(encoded)) + b''.join(encoded)
+
+
+JSON = JsonCodec()
+COMPACT = CompactCodec()
+
+
+# Formats sockets may negotiate and broadcasts are pre-encoded in (JSON always)
+CODECS = (JSON,) + ((COMPACT,) if 'compact' in getattr(settings, 'WS_WIRE_FORMATS', ('json', 'compact')) else ())
+
+
+class Encoded:
+    """A frame encoded already, in every format: {codec name: data} (see prepare())."""
+
+    __slots__ = ('frames',)
+
+    def __init__(self, frames):
+        self.frames = frames
+
+
+def encode_frames(frame):
+    return {codec.name: codec.encode(frame) for codec in CODECS}
+
+
+def client_frame(message):
+    """The frame a group message becomes on every recipient socket, or None for other messages.
+
+    A room_delta carrying a private part (sent to that team's group only, see
+    room_state.delta_sends) includes it; the room group copy of a
+    room_state_update gives the generic state, which sockets seeing no secret
+    send (None once every player sees one). Team copies of a room state are
+    personalized by each socket (see room_state.room_state_sends).
+    """
+    kind = message['type']
+    if kind == 'game_message':
+        return {'type': 'game_message', 'message': message['message']}
+    if kind == 'turn_timeout':
+        return {'type': 'turn_timeout', 'message': 'Turn time expired!'}
+    if kind == 'room_delta':
+        return {
+            'type': 'room_delta',
+            'seq': message['seq'],
+            'event': message['event'],
+            'data': {**message['data'], **message['private']} if 'private' in message else message['data'],
+        }
+    if kind == 'team_strategy_group_update':
+        return {'type': 'team_strategy_update', 'data': message['payload']}
+    if kind == 'team_strategy_patch':
+        return {
+            'type': 'team_strategy_patch',
+            'data': {key: message[key] for key in ('team', 'version', 'patches', 'updated_at', 'last_editor')},
+        }
+    if kind == 'room_state_update' and 'team' not in message and shows_generic_state(message['snapshot']):
+        return {'type': 'room_state_update', 'data': message['snapshot']['state']}
+    return None
+
+
+def prepare(message):
+    """`message` with its client frame pre-encoded in ``frames`` (unchanged when it has none)."""
+    if 'frames' in message:
+        return message
+    frame = client_frame(message)
+    if frame is None:
+        return message
+    return {**message, 'frames': encode_frames(frame)}
+
+
+def negotiate(subprotocols):
+    """(codec, subprotocol to accept or None) for the subprotocols a client offered."""
+    if COMPACT in CODECS and COMPACT_PROTOCOL in (subprotocols or ()):
+        return COMPACT, COMPACT_PROTOCOL
+    return JSON, None
+
+
+def encode_shared(codec, key, frame):
+    """codec.encode(frame) for a frame identical for every recipient, memoized by (format, `key`)."""
+    return _shared.get((codec.name, key), lambda: codec.encode(frame))
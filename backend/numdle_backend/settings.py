@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
 
 # Load environment variables from .env file
 load_dotenv()
@@ -109,6 +110,82 @@ else:
         },
     }
 
+# Shared cache (room-state snapshots and their version counters).
+# Must be shared by every web process and Celery worker, so it defaults to the
+# same Redis as the channel layer; CACHE_URL=locmem is only safe single-process.
+CACHE_URL = os.getenv('CACHE_URL', REDIS_URL or 'redis://127.0.0.1:6379/2')
+if CACHE_URL == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        },
+    }
+ROOM_SNAPSHOT_TTL = int(os.getenv('ROOM_SNAPSHOT_TTL', '3600'))
+# Lifetime of cached lobby pages (GET /api/rooms/); joins and new rooms invalidate them at once
+LOBBY_CACHE_TTL = int(os.getenv('LOBBY_CACHE_TTL', '2'))
+
+# Outbound websocket frames produced within this window are sent as one frame (0 disables)
+WS_COALESCE_WINDOW_MS = float(os.getenv('WS_COALESCE_WINDOW_MS', '5'))
+# Game socket wire formats offered (game/wire.py); broadcasts are pre-encoded once in each
+WS_WIRE_FORMATS = [f.strip() for f in os.getenv('WS_WIRE_FORMATS', 'json,compact').split(',') if f.strip()]
+# Spectator sockets (ws/watch/, game/spectators.py): frames per second per viewer (0 disables
+# spectating) and public deltas each room feed keeps for viewers catching up
+SPECTATOR_MAX_FPS = float(os.getenv('SPECTATOR_MAX_FPS', '4'))
+SPECTATOR_DELTA_HISTORY = int(os.getenv('SPECTATOR_DELTA_HISTORY', '64'))
+
+# Game engine: 'db' applies every action through the database; 'actor' keeps each
+# active room in memory in one ASGI process (requires routing all sockets of a room
+# to the same process) with a journal and write-behind persistence. See game/engine.py.
+GAME_ENGINE = os.getenv('GAME_ENGINE', 'db')
+ENGINE_JOURNAL_DIR = os.getenv('ENGINE_JOURNAL_DIR', os.path.join(BASE_DIR, 'journal'))
+ENGINE_JOURNAL_FSYNC = os.getenv('ENGINE_JOURNAL_FSYNC', 'False').lower() == 'true'
+ENGINE_FLUSH_INTERVAL_MS = float(os.getenv('ENGINE_FLUSH_INTERVAL_MS', '250'))
+
+# Turn timeouts: 'wheel' keeps deadlines in an in-process timer wheel (no Celery worker
+# needed; overdue turns of a dead process are taken over by a periodic rescue sweep),
+# 'celery' schedules check_turn_timeout countdown tasks, 'sweep' has celery beat run
+# sweep_expired_turns every TURN_SWEEP_INTERVAL seconds. See game/timers.py.
+# Ignored with GAME_ENGINE = 'actor': room actors time their own turns, and a
+# second mechanism skipping turns in the database would race with them.
+TURN_TIMERS = os.getenv('TURN_TIMERS', 'wheel')
+TURN_RESCUE_INTERVAL = float(os.getenv('TURN_RESCUE_INTERVAL', '10'))
+TURN_RESCUE_SLACK = float(os.getenv('TURN_RESCUE_SLACK', '5'))
+TURN_SWEEP_INTERVAL = float(os.getenv('TURN_SWEEP_INTERVAL', '1'))
+
+# Team strategy patches (game/strategy.py): buffered per room and written behind once
+# per STRATEGY_FLUSH_INTERVAL_MS; STRATEGY_HISTORY versions of notes splices are kept for rebasing
+STRATEGY_FLUSH_INTERVAL_MS = float(os.getenv('STRATEGY_FLUSH_INTERVAL_MS', '250'))
+STRATEGY_HISTORY = int(os.getenv('STRATEGY_HISTORY', '50'))
+
+# Guest identity cache (game/guests.py): 'local' in-process LRU, 'shared' Django cache, 'off'
+GUEST_IDENTITY_CACHE = os.getenv('GUEST_IDENTITY_CACHE', 'local')
+GUEST_CACHE_SIZE = int(os.getenv('GUEST_CACHE_SIZE', '10000'))
+GUEST_CACHE_TTL = int(os.getenv('GUEST_CACHE_TTL', '300'))
+# Lifetime of the signed guest tokens returned by join/rematch (WebSocket ?guest_token=)
+GUEST_TOKEN_MAX_AGE = int(os.getenv('GUEST_TOKEN_MAX_AGE', str(30 * 24 * 60 * 60)))
+
+# Retention (game/retention.py): archive and delete games finished more than
+# RETENTION_FINISHED_DAYS ago and rooms left waiting for RETENTION_WAITING_HOURS,
+# in batches, every RETENTION_INTERVAL seconds (celery beat; 0 disables)
+RETENTION_FINISHED_DAYS = float(os.getenv('RETENTION_FINISHED_DAYS', '7'))
+RETENTION_WAITING_HOURS = float(os.getenv('RETENTION_WAITING_HOURS', '24'))
+# Guest users without players or rooms are deleted this long after creation
+RETENTION_GUEST_DAYS = float(os.getenv('RETENTION_GUEST_DAYS', '30'))
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '50'))
+RETENTION_BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', '0.2'))
+RETENTION_MAX_SECONDS = float(os.getenv('RETENTION_MAX_SECONDS', '45'))
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', '600'))
+
+# Bearer token required by /api/metrics/ (empty leaves it open, e.g. behind a private network)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
 # CORS settings for frontend
 # Add local dev origins plus optional FRONTEND_ORIGIN env (e.g., https://numdle-sepia.vercel.app)
 _cors_origins = [
@@ -161,19 +238,65 @@ CSRF_TRUSTED_ORIGINS = list(dict.fromkeys(_csrf_origins))  # dedupe, keep order
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': os.getenv('DB_NAME', 'postgres'),
-        'USER': os.getenv('DB_USER', 'postgres'),
-        'PASSWORD': os.getenv('DB_PASSWORD', ''),
-    'HOST': os.getenv('DB_HOST', 'localhost'),
-        'PORT': os.getenv('DB_PORT', '5432'),
-        'OPTIONS': {
-            'sslmode': 'require',
-        },
+# DB_ENGINE=sqlite3 runs against a local SQLite file (tests, quick local dev);
+# DB_SSLMODE=disable for a local Postgres without TLS.
+#
+# DB_POOL_MODE decides how Postgres connections are reused:
+# - 'none' (default): a new connection per request or consumer call;
+# - 'persistent': each thread keeps its connection for DB_CONN_MAX_AGE
+#   seconds, checked with a ping before reuse (CONN_HEALTH_CHECKS);
+# - 'pool': one psycopg 3 pool per process (Django's native pool, needs
+#   `pip install "psycopg[binary,pool]"`) of DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE
+#   connections, checked on checkout; a request waits at most DB_POOL_TIMEOUT
+#   seconds for one. DB_POOL_MAX_SIZE is required: asgiref runs
+#   database_sync_to_async calls of all sockets on one shared thread and each
+#   in-flight HTTP request on its own thread (ASGI_THREADS does not bound
+#   either), so set it to 1 + the peak concurrent requests per process, within
+#   the server's max_connections divided by the number of processes.
+# Behind a transaction-mode pooler (PgBouncer pool_mode=transaction) set
+# DB_DISABLE_SERVER_SIDE_CURSORS=True: QuerySet.iterator() (NDJSON exports)
+# otherwise uses server-side cursors, which do not survive across transactions.
+DB_POOL_MODE = os.getenv('DB_POOL_MODE', 'none')
+if os.getenv('DB_ENGINE', 'postgresql') == 'sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', os.path.join(BASE_DIR, 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'postgres'),
+            'USER': os.getenv('DB_USER', 'postgres'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'OPTIONS': {
+                'sslmode': os.getenv('DB_SSLMODE', 'require'),
+            },
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_DISABLE_SERVER_SIDE_CURSORS', 'False').lower() == 'true',
+        }
     }
-}
+    if DB_POOL_MODE == 'persistent':
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+        DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+    elif DB_POOL_MODE == 'pool':
+        try:
+            from psycopg_pool import ConnectionPool
+        except ImportError:
+            raise ImproperlyConfigured('DB_POOL_MODE=pool needs psycopg 3 with its pool: pip install "psycopg[binary,pool]"')
+        if not os.getenv('DB_POOL_MAX_SIZE'):
+            raise ImproperlyConfigured('DB_POOL_MODE=pool needs DB_POOL_MAX_SIZE (connections per process)')
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE')),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+            'check': ConnectionPool.check_connection,
+        }
+    elif DB_POOL_MODE != 'none':
+        raise ImproperlyConfigured(f'Unknown DB_POOL_MODE {DB_POOL_MODE!r}')
 
 # Celery / Task queue configuration (reuse Redis)
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', REDIS_URL or 'redis://127.0.0.1:6379/1')
@@ -181,6 +304,17 @@ CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', REDIS_URL or 'redis:/
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 60  # hard limit safeguard
 CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULE = {}
+if TURN_TIMERS == 'sweep' and GAME_ENGINE != 'actor':
+    CELERY_BEAT_SCHEDULE['sweep-expired-turns'] = {
+        'task': 'game.tasks.sweep_expired_turns',
+        'schedule': TURN_SWEEP_INTERVAL,
+    }
+if RETENTION_INTERVAL:
+    CELERY_BEAT_SCHEDULE['purge-old-games'] = {
+        'task': 'game.tasks.purge_old_games',
+        'schedule': RETENTION_INTERVAL,
+    }
 
 
 # Password validation
@@ -7,6 +7,10 @@ interface Analytics {
   total_players: number;
   average_players_per_room: number;
   finished_rooms: number;
+  games_finished: number;
+  average_game_seconds: number;
+  average_guesses_to_win: number;
+  range: { games_finished: number; rooms_created: number };
 }
 
 interface AdminRoom {
@@ -202,6 +206,9 @@ export const AdminDashboard: React.FC = () => {
                     <li>Finished Rooms: <strong>{analytics.finished_rooms}</strong></li>
                     <li>Total Players: <strong>{analytics.total_players}</strong></li>
                     <li>Avg Players / Room: <strong>{analytics.average_players_per_room}</strong></li>
+                    <li>Games Finished: <strong>{analytics.games_finished}</strong> ({analytics.range.games_finished} in the last 24h)</li>
+                    <li>Avg Game Duration: <strong>{Math.round(analytics.average_game_seconds)}s</strong></li>
+                    <li>Avg Guesses / Game: <strong>{analytics.average_guesses_to_win}</strong></li>
                   </ul>
                 </div>
                 <div className="bg-white p-5 rounded-xl border shadow-sm space-y-3">
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Plus, Users, Clock, Play, Lock, Unlock, Trash2, Search, RefreshCw } from 'lucide-react';
 import { useGame } from '../contexts/GameContext';
 import { gameApi } from '../services/api';
+import { LobbySocket } from '../services/lobbySocket';
 import type { GameRoom } from '../types/game';
 import { TopBar } from './TopBar';
 
@@ -27,7 +28,10 @@ export const RoomListPage: React.FC<RoomListPageProps> = ({ onHowToPlay }) => {
   const [passwordError, setPasswordError] = useState('');
 
   useEffect(() => {
-    loadRooms();
+    // The lobby socket sends the room list on connect and keeps it current
+    const lobby = new LobbySocket();
+    lobby.connect(setRooms);
+    return () => lobby.disconnect();
   }, []);
 
   useEffect(() => {
@@ -1,8 +1,10 @@
 import React, { createContext, useContext, useState, useCallback, useEffect } from 'react';
 import type { ReactNode } from 'react';
-import type { User, RoomState, TeamStrategy } from '../types/game';
+import type { User, RoomDelta, RoomState, StrategyPatchEvent, TeamStrategy } from '../types/game';
 import { gameApi } from '../services/api';
+import { applyRoomDelta } from '../services/roomDeltas';
 import { gameWebSocket } from '../services/websocket';
+import { TeamStrategySync } from '../services/strategySync';
 
 interface GameContextType {
   user: User | null;
@@ -42,6 +44,10 @@ export const GameProvider: React.FC<GameProviderProps> = ({ children }) => {
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [timeoutGraceEndsAt, setTimeoutGraceEndsAt] = useState<number | null>(null);
+  // Team strategy edits go out as patch ops (see services/strategySync.ts)
+  const strategySyncRef = React.useRef<TeamStrategySync | null>(null);
+  if (!strategySyncRef.current) strategySyncRef.current = new TeamStrategySync(gameWebSocket, setTeamStrategy);
+  const strategySync = strategySyncRef.current;
 
   const clearError = useCallback(() => setError(null), []);
 
@@ -95,11 +101,12 @@ export const GameProvider: React.FC<GameProviderProps> = ({ children }) => {
     setUser(null);
     localStorage.removeItem('bc_user');
     localStorage.removeItem('bc_current_room');
+    localStorage.removeItem('bc_guest_token');
     // Note: We keep bc_device_id as it should persist across sessions
 
     // Clear states
     setCurrentRoom(null);
-    setTeamStrategy(null);
+    strategySync.dispose();
     setError(null);
     setTimeoutGraceEndsAt(null);
   }, [isConnected]);
@@ -154,17 +161,22 @@ export const GameProvider: React.FC<GameProviderProps> = ({ children }) => {
             });
           };
           gameWebSocket.onMessage('room_state_update', applyRoomState);
+          // Deltas arrive in seq order; gaps are repaired by a full state (services/websocket.ts)
+          gameWebSocket.onMessage('room_delta', (delta: RoomDelta) => {
+            setCurrentRoom(prev => (prev ? applyRoomDelta(prev, delta) : prev));
+          });
           gameWebSocket.onMessage('team_strategy_init', (data: TeamStrategy) => {
-            setTeamStrategy(data);
+            strategySync.reset(data);
           });
           gameWebSocket.onMessage('team_strategy_update', (data: TeamStrategy) => {
-            setTeamStrategy(prev => {
-              if (!prev || data.team === prev.team) return data;
-              return prev;
-            });
+            const current = strategySync.current();
+            if (!current || data.team === current.team) strategySync.reset(data);
+          });
+          gameWebSocket.onMessage('team_strategy_patch', (data: StrategyPatchEvent) => {
+            strategySync.receive(data);
           });
           gameWebSocket.onMessage('team_strategy_conflict', (data: TeamStrategy) => {
-            setTeamStrategy(data);
+            strategySync.reset(data);
           });
           gameWebSocket.onMessage('game_message', (data: { message: string }) => {
             setError(data.message);
@@ -222,11 +234,16 @@ export const GameProvider: React.FC<GameProviderProps> = ({ children }) => {
         });
       };
       gameWebSocket.onMessage('room_state_update', applyRoomState);
-      gameWebSocket.onMessage('team_strategy_init', (data: TeamStrategy) => setTeamStrategy(data));
+      gameWebSocket.onMessage('room_delta', (delta: RoomDelta) => {
+        setCurrentRoom(prev => (prev ? applyRoomDelta(prev, delta) : prev));
+      });
+      gameWebSocket.onMessage('team_strategy_init', (data: TeamStrategy) => strategySync.reset(data));
       gameWebSocket.onMessage('team_strategy_update', (data: TeamStrategy) => {
-        setTeamStrategy(prev => (!prev || data.team === prev.team) ? data : prev);
+        const current = strategySync.current();
+        if (!current || data.team === current.team) strategySync.reset(data);
       });
-      gameWebSocket.onMessage('team_strategy_conflict', (data: TeamStrategy) => setTeamStrategy(data));
+      gameWebSocket.onMessage('team_strategy_patch', (data: StrategyPatchEvent) => strategySync.receive(data));
+      gameWebSocket.onMessage('team_strategy_conflict', (data: TeamStrategy) => strategySync.reset(data));
 
       gameWebSocket.onMessage('game_message', (data: { message: string }) => {
         setError(data.message);
@@ -277,7 +294,7 @@ export const GameProvider: React.FC<GameProviderProps> = ({ children }) => {
   const leaveRoom = useCallback(() => {
     gameWebSocket.disconnect();
     setCurrentRoom(null);
-    setTeamStrategy(null);
+    strategySync.dispose();
     setIsConnected(false);
     localStorage.removeItem('bc_current_room');
   }, []);
@@ -311,42 +328,12 @@ export const GameProvider: React.FC<GameProviderProps> = ({ children }) => {
     }
   }, [user, currentRoom, leaveRoom, joinRoom]);
 
-  // Debounced send mechanism (simple implementation using timeout ref)
-  const strategySendRef = React.useRef<number | null>(null);
-  const pendingStrategyRef = React.useRef<TeamStrategy | null>(null);
-
-  const flushStrategy = useCallback(() => {
-    if (pendingStrategyRef.current) {
-      const s = pendingStrategyRef.current;
-      gameWebSocket.updateTeamStrategy({
-        version: s.version,
-        notes: s.notes,
-        slot_digits: s.slot_digits,
-        draft_guess: s.draft_guess,
-      });
-    }
-  }, []);
-
-  const scheduleFlush = useCallback(() => {
-    if (strategySendRef.current) window.clearTimeout(strategySendRef.current);
-    strategySendRef.current = window.setTimeout(() => {
-      flushStrategy();
-    }, 350); // 350ms debounce
-  }, [flushStrategy]);
-
+  // Local edits become patch ops, sent after a short debounce; version only advances on server ack
   const updateTeamStrategy = useCallback((partial: Partial<Omit<TeamStrategy, 'team' | 'version'>> & { optimistic?: boolean }) => {
-    setTeamStrategy(prev => {
-      if (!prev) return prev; // not loaded yet
-      const next: TeamStrategy = {
-        ...prev,
-        ...partial,
-        version: prev.version, // version only advances on server ack
-      };
-      pendingStrategyRef.current = next;
-      if (partial.optimistic !== false) scheduleFlush();
-      return next;
-    });
-  }, [scheduleFlush]);
+    const current = strategySync.current();
+    if (!current) return; // not loaded yet
+    strategySync.edit({ ...current, ...partial });
+  }, [strategySync]);
 
   const value: GameContextType = {
     user,
@@ -30,20 +30,23 @@ export const gameApi = {
     return response.data;
   },
 
-  joinRoom: async (roomId: string, password?: string, username?: string, deviceId?: string): Promise<{ message: string; room_status: string }> => {
+  joinRoom: async (roomId: string, password?: string, username?: string, deviceId?: string): Promise<{ message: string; room_status: string; guest_token: string }> => {
     const payload: any = {};
     if (password) payload.password = password;
     if (username) payload.username = username;
     if (deviceId) payload.device_id = deviceId;
     const response = await api.post(`/rooms/${roomId}/join/`, payload);
+    // Signed guest identity for the game socket (see GameWebSocket.connect)
+    if (response.data.guest_token) localStorage.setItem('bc_guest_token', response.data.guest_token);
     return response.data;
   },
 
-  rematchRoom: async (roomId: string, username?: string, deviceId?: string): Promise<{ room_id: string; room_name: string; room_status: string }> => {
+  rematchRoom: async (roomId: string, username?: string, deviceId?: string): Promise<{ room_id: string; room_name: string; room_status: string; guest_token: string }> => {
     const payload: any = {};
     if (username) payload.username = username;
     if (deviceId) payload.device_id = deviceId;
     const response = await api.post(`/rooms/${roomId}/rematch/`, payload);
+    if (response.data.guest_token) localStorage.setItem('bc_guest_token', response.data.guest_token);
     return response.data;
   },
 
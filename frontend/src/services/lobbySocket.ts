@@ -0,0 +1,71 @@
+import type { GameRoom } from '../types/game';
+
+type LobbyEvent =
+  | { type: 'lobby_snapshot'; data: { rooms: GameRoom[]; next_cursor: string | null } }
+  | { type: 'lobby_event'; event: 'room_created' | 'room_updated' | 'room_closed'; room: Partial<GameRoom> & { id: string } };
+
+/** Live lobby (ws/lobby/): a snapshot on connect, then room_created / room_updated / room_closed events. */
+export class LobbySocket {
+  private socket: WebSocket | null = null;
+  private rooms: GameRoom[] = [];
+  private listener: ((rooms: GameRoom[]) => void) | null = null;
+  private reconnectAttempts = 0;
+  private maxReconnectAttempts = 5;
+  private reconnectDelay = 1000;
+
+  connect(listener: (rooms: GameRoom[]) => void) {
+    this.listener = listener;
+    const base = (import.meta as any).env?.VITE_WS_BASE_URL || 'ws://localhost:8000';
+    this.socket = new WebSocket(`${base}/ws/lobby/`);
+    this.socket.onopen = () => {
+      this.reconnectAttempts = 0;
+    };
+    this.socket.onmessage = (event) => {
+      try {
+        this.apply(JSON.parse(event.data));
+      } catch (error) {
+        console.error('Error parsing lobby message:', error);
+      }
+    };
+    this.socket.onclose = () => this.handleDisconnect();
+  }
+
+  private apply(message: LobbyEvent) {
+    if (message.type === 'lobby_snapshot') {
+      this.rooms = message.data.rooms;
+    } else if (message.type === 'lobby_event') {
+      const { event, room } = message;
+      const rest = this.rooms.filter((r) => r.id !== room.id);
+      if (event === 'room_closed') {
+        this.rooms = rest;
+      } else if (event === 'room_created') {
+        this.rooms = [room as GameRoom, ...rest];
+      } else {
+        this.rooms = this.rooms.map((r) => (r.id === room.id ? { ...r, ...room } : r));
+      }
+    } else {
+      return;
+    }
+    this.listener?.(this.rooms);
+  }
+
+  /** Ask for a fresh snapshot. */
+  resync() {
+    if (this.socket?.readyState === WebSocket.OPEN) {
+      this.socket.send(JSON.stringify({ type: 'resync' }));
+    }
+  }
+
+  private handleDisconnect() {
+    if (this.listener && this.reconnectAttempts < this.maxReconnectAttempts) {
+      this.reconnectAttempts++;
+      setTimeout(() => this.listener && this.connect(this.listener), this.reconnectDelay * this.reconnectAttempts);
+    }
+  }
+
+  disconnect() {
+    this.listener = null;
+    this.socket?.close();
+    this.socket = null;
+  }
+}
@@ -0,0 +1,49 @@
+import type { RoomDelta, RoomState } from '../types/game';
+
+/** `state` with one room_delta applied (the delta protocol, backend GameConsumer). */
+export function applyRoomDelta(state: RoomState, delta: RoomDelta): RoomState {
+  const next = { ...state, version: delta.seq };
+  switch (delta.event) {
+    case 'guess_added':
+      return { ...next, guesses: [...state.guesses, delta.data] };
+    case 'turn_changed':
+      return { ...next, ...delta.data };
+    case 'team_changed':
+      return {
+        ...next,
+        players: state.players.map(p => (p.id === delta.data.player_id ? { ...p, team: delta.data.team } : p)),
+      };
+    case 'secret_set': {
+      const { team, set_by_username, secret_number } = delta.data;
+      return {
+        ...next,
+        ...(team === 'A'
+          ? { team_a_secret_set: true, team_a_set_by_username: set_by_username }
+          : { team_b_secret_set: true, team_b_set_by_username: set_by_username }),
+        // Only the team's own copy of the delta carries its secret
+        players: state.players.map(p => (p.team === team
+          ? { ...p, has_secret_number: true, ...(secret_number ? { secret_number } : {}) }
+          : p)),
+      };
+    }
+    case 'status_changed': {
+      const { status, winner_username, winner_team, team_secrets } = delta.data;
+      if (!winner_username) return { ...next, status };
+      // The winner made the winning guess (guess_added comes first); a finished game reveals both team secrets
+      const winnerId = [...state.guesses].reverse().find(g => g.is_correct)?.player_id;
+      return {
+        ...next,
+        status,
+        winner_username,
+        winner_team: winner_team ?? null,
+        players: state.players.map(p => ({
+          ...p,
+          is_winner: winnerId !== undefined ? p.id === winnerId : p.username === winner_username,
+          ...(team_secrets && p.team ? { secret_number: team_secrets[p.team] } : {}),
+        })),
+      };
+    }
+    default:
+      return state;
+  }
+}
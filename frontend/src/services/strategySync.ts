@@ -0,0 +1,150 @@
+import type { StrategyOp, StrategyPatchEvent, TeamStrategy } from '../types/game';
+import type { GameWebSocket } from './websocket';
+
+type Splice = Extract<StrategyOp, { op: 'splice' }>;
+
+/** Ops turning `prev` into `next`: changed cells and draft digits, plus one splice for the notes. */
+export function diffStrategy(prev: TeamStrategy, next: TeamStrategy): StrategyOp[] {
+  const ops: StrategyOp[] = [];
+  next.slot_digits.forEach((row, r) => row.forEach((value, c) => {
+    if (prev.slot_digits[r]?.[c] !== value) ops.push({ op: 'set_cell', row: r, col: c, value });
+  }));
+  next.draft_guess.forEach((digit, index) => {
+    if (prev.draft_guess[index] !== digit) ops.push({ op: 'set_draft', index, digit });
+  });
+  if (prev.notes !== next.notes) {
+    const a = prev.notes, b = next.notes;
+    let start = 0;
+    while (start < a.length && start < b.length && a[start] === b[start]) start++;
+    let end = 0;
+    while (end < a.length - start && end < b.length - start && a[a.length - 1 - end] === b[b.length - 1 - end]) end++;
+    ops.push({ op: 'splice', at: start, delete: a.length - start - end, insert: b.slice(start, b.length - end) });
+  }
+  return ops;
+}
+
+/** `ts` with `ops` applied (same clamping as the server). */
+export function applyOps(ts: TeamStrategy, ops: StrategyOp[]): TeamStrategy {
+  const slot_digits = ts.slot_digits.map(row => [...row]);
+  const draft_guess = [...ts.draft_guess];
+  let notes = ts.notes;
+  for (const op of ops) {
+    if (op.op === 'set_cell') slot_digits[op.row][op.col] = op.value;
+    else if (op.op === 'set_draft') draft_guess[op.index] = op.digit;
+    else {
+      const at = Math.min(op.at, notes.length);
+      notes = notes.slice(0, at) + op.insert + notes.slice(at + Math.min(op.delete, notes.length - at));
+    }
+  }
+  return { ...ts, slot_digits, draft_guess, notes };
+}
+
+/** `splice` rebased over the concurrent splice `over` (mirrors strategy.transform_splice on the server). */
+export function transformSplice(splice: Splice, over: Splice): Splice[] {
+  const oEnd = over.at + over.delete;
+  if (splice.at + splice.delete <= over.at && !(splice.at === over.at && splice.delete === 0)) return [splice];
+  if (splice.at >= oEnd) return [{ ...splice, at: splice.at - over.delete + over.insert.length }];
+  const after = Math.max(0, splice.at + splice.delete - oEnd);
+  if (splice.at < over.at) {
+    const parts: Splice[] = [{ op: 'splice', at: splice.at, delete: over.at - splice.at, insert: splice.insert }];
+    if (after) parts.push({ op: 'splice', at: splice.at + splice.insert.length + over.insert.length, delete: after, insert: '' });
+    return parts;
+  }
+  return [{ op: 'splice', at: over.at + over.insert.length, delete: after, insert: splice.insert }];
+}
+
+function rebase(ops: StrategyOp[], over: Splice[]): StrategyOp[] {
+  let result = ops;
+  for (const committed of over) {
+    result = result.flatMap((op): StrategyOp[] => op.op === 'splice' ? transformSplice(op, committed) : [op]);
+  }
+  return result;
+}
+
+/**
+ * Team strategy kept in sync through patch_team_strategy ops.
+ *
+ * The shown strategy is the last server version (`confirmed`) plus this
+ * client's ops the server has not acknowledged yet: sent ones (`inflight`,
+ * by seq) and ones still waiting for the debounce (`pending`). Incoming
+ * team_strategy_patch frames advance `confirmed` with the ops exactly as the
+ * server applied them; own unacknowledged notes edits are rebased over the
+ * other clients' splices. A version gap asks for the full state again.
+ */
+export class TeamStrategySync {
+  private confirmed: TeamStrategy | null = null;
+  private inflight: { seq: number; ops: StrategyOp[] }[] = [];
+  private pending: StrategyOp[] = [];
+  private seq = 0;
+  private timer: number | null = null;
+  private readonly client = crypto.randomUUID().slice(0, 8);
+
+  constructor(
+    private socket: Pick<GameWebSocket, 'patchTeamStrategy' | 'requestTeamStrategy'>,
+    private listener: (strategy: TeamStrategy | null) => void,
+    private delay = 150,
+  ) {}
+
+  current(): TeamStrategy | null {
+    if (!this.confirmed) return null;
+    return applyOps(this.confirmed, [...this.inflight.flatMap(p => p.ops), ...this.pending]);
+  }
+
+  /** Full state from the server (init, update or conflict); unacknowledged local edits are dropped. */
+  reset(strategy: TeamStrategy | null) {
+    this.confirmed = strategy;
+    this.inflight = [];
+    this.pending = [];
+    this.listener(strategy);
+  }
+
+  /** A local edit: the ops between the shown strategy and `next` are sent after the debounce. */
+  edit(next: TeamStrategy) {
+    const shown = this.current();
+    if (!shown) return;
+    const ops = diffStrategy(shown, next);
+    if (!ops.length) return;
+    this.pending.push(...ops);
+    this.listener(this.current());
+    if (this.timer) window.clearTimeout(this.timer);
+    this.timer = window.setTimeout(() => this.flush(), this.delay);
+  }
+
+  receive(event: StrategyPatchEvent) {
+    const confirmed = this.confirmed;
+    if (!confirmed || event.team !== confirmed.team || event.version <= confirmed.version) return;
+    if (event.version !== confirmed.version + 1) {
+      this.socket.requestTeamStrategy();
+      return;
+    }
+    let next = confirmed;
+    for (const patch of event.patches) {
+      next = applyOps(next, patch.ops);
+      if (patch.client === this.client) {
+        this.inflight = this.inflight.filter(p => p.seq > (patch.seq ?? 0));
+      } else {
+        const splices = patch.ops.filter((op): op is Splice => op.op === 'splice');
+        this.inflight = this.inflight.map(p => ({ ...p, ops: rebase(p.ops, splices) }));
+        this.pending = rebase(this.pending, splices);
+      }
+    }
+    this.confirmed = { ...next, version: event.version, updated_at: event.updated_at, last_editor: event.last_editor };
+    this.listener(this.current());
+  }
+
+  private flush() {
+    this.timer = null;
+    if (!this.confirmed || !this.pending.length) return;
+    const ops = this.pending;
+    this.pending = [];
+    this.seq += 1;
+    this.inflight.push({ seq: this.seq, ops });
+    this.socket.patchTeamStrategy({ base: this.confirmed.version, client: this.client, seq: this.seq, ops });
+  }
+
+  dispose() {
+    if (this.timer) window.clearTimeout(this.timer);
+    this.timer = null;
+    this.reset(null);
+  }
+}
@@ -1,4 +1,10 @@
-import type { WebSocketMessage } from '../types/game';
+import type { StrategyOp, WebSocketMessage } from '../types/game';
+import { COMPACT_PROTOCOL, CompactDecoder } from './wire';
+
+// Opt into the compact MessagePack frames (backend game/wire.py)
+const USE_COMPACT = (import.meta as any).env?.VITE_WS_COMPACT === 'true';
+// Delta protocol: room changes arrive as room_delta frames instead of full states (VITE_WS_DELTA=false opts out)
+const USE_DELTA = (import.meta as any).env?.VITE_WS_DELTA !== 'false';
 
 export class GameWebSocket {
   private socket: WebSocket | null = null;
@@ -7,6 +13,9 @@ export class GameWebSocket {
   private reconnectAttempts = 0;
   private maxReconnectAttempts = 5;
   private reconnectDelay = 1000;
+  // Room seq the client state is at (delta protocol); null until a state arrives
+  private roomSeq: number | null = null;
+  private resyncRequested = false;
 
   constructor() {
     this.messageHandlers = new Map();
@@ -19,17 +28,28 @@ export class GameWebSocket {
         const token = localStorage.getItem('bc_access_token');
   const guestUser = (() => { try { return JSON.parse(localStorage.getItem('bc_user') || 'null'); } catch { return null; } })();
   const deviceId = localStorage.getItem('bc_device_id');
+  const guestToken = localStorage.getItem('bc_guest_token');
         const base = (import.meta as any).env?.VITE_WS_BASE_URL || 'ws://localhost:8000';
         let qs = '';
         if (token) {
           qs = `?token=${encodeURIComponent(token)}`;
+        } else if (guestToken) {
+          qs = `?guest_token=${encodeURIComponent(guestToken)}`;
         } else if (deviceId && guestUser?.username) {
           qs = `?guest_id=${encodeURIComponent(deviceId)}&name=${encodeURIComponent(guestUser.username)}`;
         } else if (guestUser?.username) { // legacy fallback
           qs = `?guest=${encodeURIComponent(guestUser.username)}`;
         }
+        if (USE_DELTA) {
+          qs += `${qs ? '&' : '?'}protocol=delta`;
+        }
+        this.roomSeq = null;
+        this.resyncRequested = false;
         const wsUrl = `${base}/ws/game/${roomId}/` + qs;
-        this.socket = new WebSocket(wsUrl);
+        this.socket = USE_COMPACT ? new WebSocket(wsUrl, [COMPACT_PROTOCOL]) : new WebSocket(wsUrl);
+        this.socket.binaryType = 'arraybuffer';
+        // Servers without the compact format accept no subprotocol and keep sending JSON
+        const decoder = new CompactDecoder();
 
         this.socket.onopen = () => {
           console.log('WebSocket connected');
@@ -43,7 +63,9 @@ export class GameWebSocket {
 
         this.socket.onmessage = (event) => {
           try {
-            const message: WebSocketMessage = JSON.parse(event.data);
+            const message: WebSocketMessage = typeof event.data === 'string'
+              ? JSON.parse(event.data)
+              : decoder.decode(event.data);
             this.handleMessage(message);
           } catch (error) {
             console.error('Error parsing WebSocket message:', error);
@@ -66,10 +88,40 @@ export class GameWebSocket {
   }
 
   private handleMessage(message: WebSocketMessage) {
+    // Frames coalesced by the server arrive together, in order
+    if (message.type === 'batch') {
+      (message.frames || []).forEach((frame) => this.handleMessage(frame));
+      return;
+    }
+    if (message.type === 'room_state_update') {
+      const version = message.data?.version;
+      // A state older than the deltas already applied would roll the room back
+      if (typeof version === 'number' && this.roomSeq !== null && version < this.roomSeq && !this.resyncRequested) return;
+      this.roomSeq = typeof version === 'number' ? version : null;
+      this.resyncRequested = false;
+    } else if (message.type === 'room_delta' && !this.inSequence(message.seq)) {
+      return;
+    }
     const handler = this.messageHandlers.get(message.type);
     if (handler) {
-      handler(message.data || message);
+      // Deltas are handled whole (seq and event); other frames by their payload
+      handler(message.type === 'room_delta' ? message : (message.data || message));
+    }
+  }
+
+  /** Whether a room_delta applies next; on a gap, drop it and ask for the full state once. */
+  private inSequence(seq: number | undefined): boolean {
+    // Before the first state (sent on connect) there is nothing to apply deltas to
+    if (typeof seq !== 'number' || this.roomSeq === null || seq <= this.roomSeq) return false;
+    if (seq === this.roomSeq + 1) {
+      this.roomSeq = seq;
+      return true;
+    }
+    if (!this.resyncRequested) {
+      this.resyncRequested = true;
+      this.send({ type: 'resync' });
     }
+    return false;
   }
 
   private handleDisconnect() {
@@ -115,9 +167,9 @@ export class GameWebSocket {
     this.send({ type: 'get_team_strategy' });
   }
 
-  updateTeamStrategy(payload: { version: number; notes: string; slot_digits: number[][]; draft_guess: string[] }) {
+  patchTeamStrategy(payload: { base: number; client: string; seq: number; ops: StrategyOp[] }) {
     this.send({
-      type: 'update_team_strategy',
+      type: 'patch_team_strategy',
       ...payload,
     });
   }
@@ -0,0 +1,130 @@
+import type { Guess, WebSocketMessage } from '../types/game';
+
+// Compact game socket format (backend game/wire.py), opted into with VITE_WS_COMPACT=true
+export const COMPACT_PROTOCOL = 'numdle.compact.v1';
+
+/** Minimal MessagePack decoder: the types the server's msgpack.packb produces. */
+export function decodeMsgpack(buffer: ArrayBuffer): any {
+  const view = new DataView(buffer);
+  const bytes = new Uint8Array(buffer);
+  const text = new TextDecoder();
+  let pos = 0;
+
+  const str = (length: number) => {
+    const value = text.decode(bytes.subarray(pos, pos + length));
+    pos += length;
+    return value;
+  };
+  const array = (length: number) => {
+    const value = new Array(length);
+    for (let i = 0; i < length; i++) value[i] = read();
+    return value;
+  };
+  const map = (length: number) => {
+    const value: Record<string, any> = {};
+    for (let i = 0; i < length; i++) {
+      const key = read();
+      value[key] = read();
+    }
+    return value;
+  };
+  const bin = (length: number) => {
+    const value = bytes.slice(pos, pos + length);
+    pos += length;
+    return value;
+  };
+  const next = (size: number, get: (offset: number) => number) => {
+    const value = get(pos);
+    pos += size;
+    return value;
+  };
+
+  function read(): any {
+    const byte = bytes[pos++];
+    if (byte <= 0x7f) return byte;
+    if (byte <= 0x8f) return map(byte & 0x0f);
+    if (byte <= 0x9f) return array(byte & 0x0f);
+    if (byte <= 0xbf) return str(byte & 0x1f);
+    if (byte >= 0xe0) return byte - 0x100;
+    switch (byte) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xc4: return bin(next(1, o => view.getUint8(o)));
+      case 0xc5: return bin(next(2, o => view.getUint16(o)));
+      case 0xc6: return bin(next(4, o => view.getUint32(o)));
+      case 0xca: return next(4, o => view.getFloat32(o));
+      case 0xcb: return next(8, o => view.getFloat64(o));
+      case 0xcc: return next(1, o => view.getUint8(o));
+      case 0xcd: return next(2, o => view.getUint16(o));
+      case 0xce: return next(4, o => view.getUint32(o));
+      case 0xcf: return next(8, o => Number(view.getBigUint64(o)));
+      case 0xd0: return next(1, o => view.getInt8(o));
+      case 0xd1: return next(2, o => view.getInt16(o));
+      case 0xd2: return next(4, o => view.getInt32(o));
+      case 0xd3: return next(8, o => Number(view.getBigInt64(o)));
+      case 0xd9: return str(next(1, o => view.getUint8(o)));
+      case 0xda: return str(next(2, o => view.getUint16(o)));
+      case 0xdb: return str(next(4, o => view.getUint32(o)));
+      case 0xdc: return array(next(2, o => view.getUint16(o)));
+      case 0xdd: return array(next(4, o => view.getUint32(o)));
+      case 0xde: return map(next(2, o => view.getUint16(o)));
+      case 0xdf: return map(next(4, o => view.getUint32(o)));
+      default: throw new Error(`Unsupported MessagePack type 0x${byte.toString(16)}`);
+    }
+  }
+
+  return read();
+}
+
+const iso = (ms: number | null | undefined) => (typeof ms === 'number' ? new Date(ms).toISOString() : ms ?? null);
+
+/**
+ * Expands compact frames back to the JSON frame shapes the app handles.
+ * Keeps the player id -> name table of the last room state, which guess
+ * arrays (in room states and guess_added deltas) refer to.
+ */
+export class CompactDecoder {
+  private names = new Map<number, string>();
+
+  decode(buffer: ArrayBuffer): WebSocketMessage {
+    return this.expand(decodeMsgpack(buffer));
+  }
+
+  private guess(packed: any[]): Guess {
+    const [player, target, guess, strikes, balls, is_correct, timestamp] = packed;
+    const name = (ref: number | string) => (typeof ref === 'number' ? this.names.get(ref) ?? '' : ref);
+    return {
+      player: name(player),
+      target_player: name(target),
+      ...(typeof player === 'number' ? { player_id: player, target_player_id: target } : {}),
+      guess, strikes, balls, is_correct,
+      timestamp: iso(timestamp) as string,
+    };
+  }
+
+  private expand(frame: any): WebSocketMessage {
+    const data = frame.data;
+    switch (frame.type) {
+      case 'batch':
+        return { ...frame, frames: frame.frames.map((f: any) => this.expand(f)) };
+      case 'room_state_update':
+        this.names = new Map(data.players.map((p: any) => [p.id, p.username]));
+        return {
+          ...frame,
+          data: { ...data, guesses: data.guesses.map((g: any[]) => this.guess(g)), turn_start_time: iso(data.turn_start_time) },
+        };
+      case 'room_delta':
+        if (frame.event === 'guess_added') return { ...frame, data: this.guess(data) };
+        if (data && 'turn_start_time' in data) return { ...frame, data: { ...data, turn_start_time: iso(data.turn_start_time) } };
+        return frame;
+      case 'team_strategy_init':
+      case 'team_strategy_update':
+      case 'team_strategy_conflict':
+      case 'team_strategy_patch':
+        return { ...frame, data: { ...data, updated_at: iso(data.updated_at) } };
+      default:
+        return frame;
+    }
+  }
+}
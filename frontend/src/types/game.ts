@@ -30,6 +30,8 @@ export interface GameRoom {
 export interface Guess {
   player: string;
   target_player: string;
+  player_id?: number;
+  target_player_id?: number;
   guess: string;
   strikes: number;
   balls: number;
@@ -41,6 +43,7 @@ export interface RoomState {
   room_id: string;
   name: string;
   status: string;
+  version?: number | null; // room seq of the last change included (delta protocol)
   players: Player[];
   current_turn_player: string | null;
   current_turn_team?: 'A' | 'B' | null;
@@ -67,10 +70,35 @@ export interface TeamStrategy {
   last_editor?: string | null;
 }
 
+export type StrategyOp =
+  | { op: 'set_cell'; row: number; col: number; value: number }
+  | { op: 'set_draft'; index: number; digit: string }
+  | { op: 'splice'; at: number; delete: number; insert: string };
+
+// One write-behind flush of a team's strategy (team_strategy_patch frame)
+export interface StrategyPatchEvent {
+  team: 'A' | 'B';
+  version: number;
+  patches: { client: string; seq: number | null; ops: StrategyOp[] }[];
+  updated_at: string | null;
+  last_editor: string | null;
+}
+
+// One change of a room (room_delta frame, delta protocol); seq increases by one per change
+export type RoomDelta =
+  | { type: 'room_delta'; seq: number; event: 'guess_added'; data: Guess }
+  | { type: 'room_delta'; seq: number; event: 'turn_changed'; data: { current_turn_player: string | null; current_turn_team: 'A' | 'B' | null; turn_start_time: string | null } }
+  | { type: 'room_delta'; seq: number; event: 'team_changed'; data: { player_id: number; team: 'A' | 'B' } }
+  | { type: 'room_delta'; seq: number; event: 'secret_set'; data: { team: 'A' | 'B'; set_by_username: string; secret_number?: string } }
+  | { type: 'room_delta'; seq: number; event: 'status_changed'; data: { status: string; winner_username?: string; winner_team?: 'A' | 'B'; team_secrets?: { A: string; B: string } } };
+
 export interface WebSocketMessage {
   type: string;
   data?: any;
   message?: string;
+  frames?: WebSocketMessage[];
+  seq?: number;
+  event?: string;
 }
 
 export interface ApiResponse<T = any> {
@@ -8,16 +8,51 @@ from typing import Dict, List
 from analyzer import analyze_strategy, worst_case_analysis
 from strategies import get_strategy
 from game import generate_all_codes
+from results_store import DEFAULT_STORE_DIR, get_comparison, get_results
 
 
-def plot_strategy_comparison(results: Dict, save_path: str = None):
+def weighted_percentile(values: np.ndarray, weights: np.ndarray, q: float) -> float:
+    """
+    Percentile of a histogram, matching np.percentile on the expanded data.
+    
+    Uses the same linear interpolation as np.percentile without expanding
+    every observation into an array.
+    
+    Args:
+        values: Sorted distinct values
+        weights: Number of occurrences of each value
+        q: Percentile in [0, 100]
+        
+    Returns:
+        The q-th percentile
+    """
+    cumulative = np.cumsum(weights)
+    position = q / 100 * (cumulative[-1] - 1)
+    lower = int(np.floor(position))
+    upper = int(np.ceil(position))
+    lower_value = values[np.searchsorted(cumulative, lower, side='right')]
+    upper_value = values[np.searchsorted(cumulative, upper, side='right')]
+    return float(lower_value + (upper_value - lower_value) * (position - lower))
+
+
+def plot_strategy_comparison(results: Dict = None, save_path: str = None,
+                             strategies: List[str] = None, num_tests: int = 50,
+                             seed: int = 0, store_dir: str = DEFAULT_STORE_DIR):
     """
     Plot comparison of strategy performance.
     
     Args:
-        results: Dictionary from compare_strategies()
+        results: Dictionary from compare_strategies(); when omitted the
+            results for `strategies` are read from the results store
         save_path: Optional path to save the plot
+        strategies: Strategies to plot when reading from the store
+        num_tests: Number of test games of the stored runs
+        seed: Random seed of the stored runs
+        store_dir: Directory of the results store
     """
+    if results is None:
+        strategies = strategies or ['minimax', 'entropy', 'frequency', 'random']
+        results = get_comparison(strategies, num_tests, seed, store_dir)
     strategies = list(results.keys())
     avg_guesses = [results[s]['avg_guesses'] for s in strategies]
     max_guesses = [results[s]['max_guesses'] for s in strategies]
@@ -48,31 +83,33 @@ def plot_strategy_comparison(results: Dict, save_path: str = None):
         plt.show()
 
 
-def analyze_guess_distribution(strategy_name: str, num_tests: int = 1000):
+def analyze_guess_distribution(strategy_name: str, num_tests: int = 1000,
+                               seed: int = 0, store_dir: str = DEFAULT_STORE_DIR):
     """
     Analyze the distribution of guess counts for a strategy.
     
+    Results are read from the results store; games are only run when the
+    store has no entry for this strategy version, seed and game count.
+    
     Args:
         strategy_name: Name of the strategy to analyze
         num_tests: Number of test games
+        seed: Random seed of the run
+        store_dir: Directory of the results store
         
     Returns:
         Dictionary with distribution analysis
     """
-    results = analyze_strategy(strategy_name, num_tests)
+    results = get_results(strategy_name, num_tests, seed, store_dir)
     distribution = results['guess_distribution']
     
-    # Calculate statistics
-    guess_counts = []
-    frequencies = []
-    
-    for guesses, frequency in sorted(distribution.items()):
-        guess_counts.extend([guesses] * frequency)
-        frequencies.append(frequency)
+    # Calculate statistics directly from the histogram
+    guess_counts = np.array(sorted(distribution), dtype=float)
+    frequencies = np.array([distribution[g] for g in sorted(distribution)], dtype=float)
     
-    mean = np.mean(guess_counts)
-    median = np.median(guess_counts)
-    std = np.std(guess_counts)
+    mean = np.average(guess_counts, weights=frequencies)
+    median = weighted_percentile(guess_counts, frequencies, 50)
+    std = np.sqrt(np.average((guess_counts - mean) ** 2, weights=frequencies))
     
     return {
         'strategy': strategy_name,
@@ -81,10 +118,10 @@ def analyze_guess_distribution(strategy_name: str, num_tests: int = 1000):
         'median': median,
         'std': std,
         'percentiles': {
-            '25th': np.percentile(guess_counts, 25),
-            '75th': np.percentile(guess_counts, 75),
-            '90th': np.percentile(guess_counts, 90),
-            '95th': np.percentile(guess_counts, 95)
+            '25th': weighted_percentile(guess_counts, frequencies, 25),
+            '75th': weighted_percentile(guess_counts, frequencies, 75),
+            '90th': weighted_percentile(guess_counts, frequencies, 90),
+            '95th': weighted_percentile(guess_counts, frequencies, 95)
         }
     }
 
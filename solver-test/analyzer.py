@@ -4,7 +4,7 @@ Performance analysis tools for Numdle strategies.
 
 import time
 from collections import defaultdict, Counter
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 from game import feedback, generate_all_codes, is_valid_code
 from strategies import get_strategy, Strategy
 
@@ -41,13 +41,16 @@ def solve_game(secret: str, strategy: Strategy) -> List[Tuple[str, Tuple[int, in
     return history
 
 
-def analyze_strategy(strategy_name: str, num_tests: int = 100) -> Dict:
+def analyze_strategy(strategy_name: str, num_tests: int = 100,
+                     seed: Optional[int] = None) -> Dict:
     """
     Analyze a strategy's performance across multiple random games.
     
     Args:
         strategy_name: Name of the strategy to test
         num_tests: Number of random games to test
+        seed: Optional random seed, makes the sampled secrets (and the
+            random strategy's guesses) reproducible
         
     Returns:
         Dictionary with performance statistics
@@ -57,6 +60,8 @@ def analyze_strategy(strategy_name: str, num_tests: int = 100) -> Dict:
     
     # Select random subset for testing
     import random
+    if seed is not None:
+        random.seed(seed)
     test_codes = random.sample(all_codes, min(num_tests, len(all_codes)))
     
     guess_counts = []
@@ -0,0 +1,113 @@
+"""
+Persistent store for strategy analysis results.
+
+Each analysis run is saved as a compressed ``.npz`` file keyed by strategy
+name, strategy version, seed and number of games, so reports and plots can
+be regenerated without re-running any games.
+"""
+
+import os
+from typing import Dict, List, Optional
+import numpy as np
+from analyzer import analyze_strategy
+from strategies import get_strategy
+
+
+DEFAULT_STORE_DIR = os.environ.get(
+    'NUMDLE_RESULTS_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+)
+
+
+def result_path(strategy_name: str, num_tests: int, seed: int,
+                store_dir: str = DEFAULT_STORE_DIR) -> str:
+    """Return the file path of a stored run."""
+    version = get_strategy(strategy_name).version
+    filename = f"{strategy_name}-v{version}-seed{seed}-n{num_tests}.npz"
+    return os.path.join(store_dir, filename)
+
+
+def save_results(results: Dict, num_tests: int, seed: int,
+                 store_dir: str = DEFAULT_STORE_DIR) -> str:
+    """
+    Save the output of analyze_strategy() to the store.
+
+    The guess distribution is stored as a histogram (guess counts and their
+    frequencies) rather than one entry per game.
+
+    Returns:
+        Path of the written file
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    distribution = results['guess_distribution']
+    guess_counts = np.array(sorted(distribution), dtype=np.int16)
+    frequencies = np.array([distribution[g] for g in guess_counts], dtype=np.int64)
+
+    path = result_path(results['strategy'], num_tests, seed, store_dir)
+    np.savez_compressed(
+        path,
+        guess_counts=guess_counts,
+        frequencies=frequencies,
+        games_tested=results['games_tested'],
+        avg_time_per_game=results['avg_time_per_game'],
+    )
+    return path
+
+
+def load_results(strategy_name: str, num_tests: int, seed: int,
+                 store_dir: str = DEFAULT_STORE_DIR) -> Optional[Dict]:
+    """
+    Load a stored run in the same shape analyze_strategy() returns.
+
+    Returns:
+        Results dictionary, or None if the run is not in the store
+    """
+    path = result_path(strategy_name, num_tests, seed, store_dir)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as data:
+        guess_counts = data['guess_counts']
+        frequencies = data['frequencies']
+        games_tested = int(data['games_tested'])
+        avg_time_per_game = float(data['avg_time_per_game'])
+
+    return {
+        'strategy': strategy_name,
+        'games_tested': games_tested,
+        'avg_guesses': float(np.average(guess_counts, weights=frequencies)),
+        'min_guesses': int(guess_counts.min()),
+        'max_guesses': int(guess_counts.max()),
+        'avg_time_per_game': avg_time_per_game,
+        'guess_distribution': {int(g): int(f) for g, f in zip(guess_counts, frequencies)}
+    }
+
+
+def get_results(strategy_name: str, num_tests: int = 100, seed: int = 0,
+                store_dir: str = DEFAULT_STORE_DIR) -> Dict:
+    """
+    Return stored results for a run, running and saving it only on a miss.
+
+    Args:
+        strategy_name: Name of the strategy
+        num_tests: Number of test games
+        seed: Random seed of the run
+        store_dir: Directory of the results store
+
+    Returns:
+        Dictionary with performance statistics
+    """
+    results = load_results(strategy_name, num_tests, seed, store_dir)
+    if results is None:
+        results = analyze_strategy(strategy_name, num_tests, seed=seed)
+        save_results(results, num_tests, seed, store_dir)
+    return results
+
+
+def get_comparison(strategies: List[str], num_tests: int = 50, seed: int = 0,
+                   store_dir: str = DEFAULT_STORE_DIR) -> Dict:
+    """Store-backed equivalent of analyzer.compare_strategies()."""
+    return {
+        name: get_results(name, num_tests, seed, store_dir)
+        for name in strategies
+    }
@@ -11,6 +11,10 @@ from game import feedback, generate_all_codes
 class Strategy:
     """Base class for guessing strategies."""
     
+    # Bump when a strategy's guessing behaviour changes so cached
+    # analysis results (see results_store.py) are not reused.
+    version = 1
+    
     def __init__(self):
         self.all_codes = generate_all_codes()
         self.reset()